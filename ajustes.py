@@ -0,0 +1,136 @@
+"""
+Ajustes del bot. Cada campo se lee de la variable de entorno con su nombre en
+mayúsculas (OPENAI_MODEL -> openai_model); lo que no está definido se queda
+con el valor por defecto. Para tests y herramientas se puede construir
+`Ajustes(...)` directamente sin tocar el entorno.
+"""
+import os
+from dataclasses import dataclass, field, fields
+
+
+def _ids(texto: str) -> frozenset:
+    return frozenset(int(i) for i in texto.replace(",", " ").split())
+
+
+_CONVERSORES = {
+    str: str,
+    int: int,
+    float: float,
+    bool: lambda texto: texto == "1",
+    frozenset: _ids,
+}
+_TEXTOS = {
+    bool: lambda valor: "1" if valor else "0",
+    frozenset: lambda valor: ",".join(str(i) for i in sorted(valor)),
+}
+
+
+@dataclass
+class Ajustes:
+    telegram_bot_token: str = None
+    # Permite apuntar el bot a un Telegram falso (ver bench/recorridos.py)
+    telegram_base_url: str = "https://api.telegram.org/bot"
+
+    # Modelo principal y respaldo opcional (otro modelo u otro endpoint);
+    # OPENAI_BASE_URL permite apuntarlo a un servidor local (ver bench/stub_llm.py)
+    openai_api_key: str = None
+    openai_model: str = "gpt-3.5-turbo"
+    openai_base_url: str = None
+    openai_model_respaldo: str = None
+    openai_api_key_respaldo: str = None      # por defecto, la del principal
+    openai_base_url_respaldo: str = None     # por defecto, la del principal
+    llm_max_concurrencia: int = 8
+    llm_max_conexiones: int = 20
+    llm_timeout_peticion: float = 30.0
+    llm_timeout_total: float = 90.0
+    llm_reintentos: int = 2
+    llm_percentil_cobertura: float = 0.95
+    llm_max_coberturas: float = 0.1
+    llm_fallos_circuito: int = 5
+    llm_enfriamiento_circuito: float = 30.0
+    llm_max_tokens_respuesta: int = 0        # 0 = sin límite
+
+    # "json" (config.json + diario de cambios) o "sqlite" (migra config.json la primera vez)
+    almacen: str = "json"
+    config_file: str = "config.json"
+    almacen_sqlite: str = "bot.db"
+    config_intervalo_flush: float = 0.5
+    config_compactar_cada: int = 1000
+
+    # Selección de ejemplos y prompts; SELECCION_EJEMPLOS=aleatorio vuelve a la elección al azar
+    umbral_similitud: float = 0.8
+    seleccion_ejemplos: str = "bm25"
+    recuperacion_top_k: int = 3
+    prompt_presupuesto_ejemplos: int = 600
+    prompt_max_ejemplos: int = 1
+    ejemplos_por_pagina: int = 8             # botones por página al ver los ejemplos de un tipo
+
+    # Caché de completions (CACHE_DISCO activa la capa persistente) y candidatos de reescritura
+    cache_max_entradas: int = 512
+    cache_ttl: float = 86400.0
+    cache_disco: str = None
+    candidatos_k: int = 2
+    candidatos_ttl: float = 600.0
+    candidatos_max_concurrencia: int = 2     # llamadas especulativas a la vez, por debajo de LLM_MAX_CONCURRENCIA
+
+    streaming: bool = False
+    streaming_intervalo: float = 1.0
+
+    # Mensajes salientes y updates concurrentes
+    salida_por_segundo: float = 25.0
+    salida_por_chat: float = 1.0
+    salida_rafaga_chat: int = 3
+    max_updates_concurrentes: int = 16
+
+    lotes_directorio: str = "lotes"
+    lote_concurrencia: int = 4
+    lote_formato: str = "html"
+    lote_intervalo_progreso: float = 2.0
+
+    # METRICAS_PUERTO = 0 desactiva /metrics; ADMIN_IDS pueden usar /stats y /perfil
+    metricas_puerto: int = 0
+    metricas_host: str = "127.0.0.1"
+    perfilador: bool = False
+    admin_ids: frozenset = field(default_factory=frozenset)
+
+    # MODO=webhook recibe los updates en un servidor HTTP propio en lugar de hacer polling
+    modo: str = "polling"
+    webhook_url: str = None
+    webhook_host: str = "0.0.0.0"
+    webhook_puerto: int = 8080
+    webhook_ruta: str = "/telegram"
+    webhook_secreto: str = None              # obligatorio en modo webhook...
+    webhook_sin_secreto: bool = False        # ...salvo que esto lo desactive a propósito (p. ej. un proxy ya lo comprueba)
+    webhook_drenar: float = 0.0
+
+    # TRABAJADORES > 1 reparte los updates entre tantos procesos bot.py por hash
+    # del chat (ver enrutador.py); necesita ALMACEN=sqlite para compartir la configuración
+    trabajadores: int = 1
+    trabajadores_puerto: int = 8800          # el trabajador i escucha en 127.0.0.1:puerto + i
+    trabajador: int = None                   # índice de este proceso; lo fija el enrutador
+
+    # Conversaciones en curso (ver sesiones.py): en memoria hasta SESIONES_MAX, caducan
+    # tras SESIONES_TTL segundos sin uso y se guardan en SESIONES_SQLITE ("" = solo en memoria)
+    sesiones_sqlite: str = "sesiones.db"
+    sesiones_max: int = 10000
+    sesiones_ttl: float = 86400.0
+
+    @classmethod
+    def desde_entorno(cls, entorno=None) -> "Ajustes":
+        entorno = os.environ if entorno is None else entorno
+        valores = {}
+        for campo in fields(cls):
+            texto = entorno.get(campo.name.upper())
+            if texto is not None:
+                valores[campo.name] = _CONVERSORES[campo.type](texto)
+        return cls(**valores)
+
+    def a_entorno(self) -> dict:
+        """Variables de entorno que reproducen estos ajustes; None para los campos sin valor."""
+        entorno = {}
+        for campo in fields(self):
+            valor = getattr(self, campo.name)
+            if valor is not None:
+                valor = _TEXTOS.get(campo.type, str)(valor)
+            entorno[campo.name.upper()] = valor
+        return entorno
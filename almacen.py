@@ -0,0 +1,622 @@
+"""
+Almacenamiento de la configuración del personaje, los tipos de post y sus ejemplos.
+
+Los handlers solo hablan con la interfaz `Almacen`; hay dos implementaciones:
+- AlmacenJSON: config.json en memoria con diario de cambios (ver persistencia.py).
+- AlmacenSQLite: base de datos SQLite en modo WAL con escrituras incrementales y
+  búsquedas indexadas por tipo y por hash de contenido. Varios procesos pueden
+  compartirla: cada escritura queda en la tabla `cambios` y `sincronizar()`
+  aplica las de los demás (ver enrutador.py).
+
+Migración manual de un config.json existente:
+    python almacen.py config.json bot.db
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from persistencia import DiarioConfig, aplicar_operacion
+
+logger = logging.getLogger(__name__)
+
+CONFIGURACION_POR_DEFECTO = {
+    "nombre": "",
+    "etiqueta": "",
+    "personalidad": "",
+    "servicios": [],
+    "idioma": ""
+}
+
+
+def hash_contenido(texto: str) -> str:
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+class Almacen(ABC):
+    """
+    Interfaz común de almacenamiento. Los ejemplos se identifican por un ID que
+    no cambia nunca ni se reutiliza; su posición dentro del tipo es el orden de
+    los IDs y cambia al borrar los anteriores, así que las escrituras van por
+    ID. Las posiciones e IDs inexistentes lanzan IndexError y los tipos
+    inexistentes KeyError.
+    """
+
+    al_escribir = None
+
+    @abstractmethod
+    def configuracion(self) -> dict: ...
+
+    @abstractmethod
+    def actualizar_configuracion(self, campo: str, valor): ...
+
+    @abstractmethod
+    def tipos(self) -> list: ...
+
+    @abstractmethod
+    def existe_tipo(self, tipo: str) -> bool: ...
+
+    @abstractmethod
+    def crear_tipo(self, tipo: str): ...
+
+    @abstractmethod
+    def renombrar_tipo(self, tipo: str, nuevo: str): ...
+
+    @abstractmethod
+    def eliminar_tipo(self, tipo: str): ...
+
+    @abstractmethod
+    def ejemplos(self, tipo: str) -> list: ...
+
+    @abstractmethod
+    def ejemplos_con_id(self, tipo: str) -> list:
+        """Pares (id, texto) de todos los ejemplos del tipo, en orden."""
+
+    @abstractmethod
+    def contar_ejemplos(self, tipo: str) -> int: ...
+
+    @abstractmethod
+    def ejemplo(self, tipo: str, indice: int) -> str: ...
+
+    @abstractmethod
+    def posicion_ejemplo(self, tipo: str, id_ejemplo: int) -> int: ...
+
+    @abstractmethod
+    def ejemplo_por_id(self, tipo: str, id_ejemplo: int) -> str: ...
+
+    @abstractmethod
+    def ids_ejemplos(self, tipo: str) -> list: ...
+
+    @abstractmethod
+    def pagina_ejemplos(self, tipo: str, despues: int = None, antes: int = None, limite: int = 10,
+                        prefijo: str = "") -> list:
+        """
+        Hasta `limite` tuplas (id, posición, texto) en orden: las siguientes al
+        ID `despues`, las inmediatamente anteriores al ID `antes` o, sin
+        ninguno, las primeras. Con `prefijo`, solo los ejemplos que empiezan
+        por él (sin distinguir mayúsculas). Solo se leen los de la página.
+        """
+
+    @abstractmethod
+    def existe_ejemplo(self, tipo: str, texto: str) -> bool: ...
+
+    @abstractmethod
+    def agregar_ejemplo(self, tipo: str, texto: str) -> int:
+        """Añade el ejemplo al final del tipo y devuelve su ID."""
+
+    @abstractmethod
+    def actualizar_ejemplo(self, tipo: str, id_ejemplo: int, texto: str): ...
+
+    @abstractmethod
+    def borrar_ejemplo(self, tipo: str, id_ejemplo: int) -> str:
+        """Borra el ejemplo y devuelve su texto."""
+
+    def sincronizar(self) -> dict:
+        """
+        Aplica los cambios que otros procesos hayan hecho en el almacenamiento
+        compartido y devuelve, por cada tipo de post afectado, los IDs de los
+        ejemplos escritos (agregados, editados o borrados) para llevarlos a sus
+        índices, o None si ha cambiado el tipo entero. Sin almacenamiento
+        compartido no hay nada que hacer.
+        """
+        return {}
+
+    async def guardar(self):
+        """Fuerza la escritura de los cambios pendientes."""
+
+    async def cerrar(self):
+        await self.guardar()
+
+    def estadisticas(self) -> dict:
+        return {}
+
+    def observar_escrituras(self, observar):
+        """`observar(operacion, segundos)` recibe la duración de cada escritura a disco."""
+        self.al_escribir = observar
+
+
+class AlmacenJSON(Almacen):
+    """
+    Cada tipo guarda junto a `ejemplos` la lista paralela `ids` (creciente). El
+    contador `siguiente_id` es uno para todo el almacén, como en SQLite, así que
+    los IDs no se repiten entre tipos y se conservan al migrar. Las posiciones
+    de cada ID se calculan al consultarlas y se conservan hasta el siguiente
+    borrado del tipo.
+    """
+
+    def __init__(self, diario: DiarioConfig):
+        self.diario = diario
+        self._config = diario.cargar({
+            "configuracion": dict(CONFIGURACION_POR_DEFECTO),
+            "tipos_de_post": {}
+        })
+        self._posiciones = {}   # tipo -> {id: posición}
+        for tipo, datos in self._config["tipos_de_post"].items():
+            if "ids" not in datos:
+                # config.json anterior a los IDs: se numeran en orden y se anota en el diario
+                siguiente = self._config.get("siguiente_id", 1)
+                self._guardar("set", ["tipos_de_post", tipo, "ids"], list(range(siguiente, siguiente + len(datos["ejemplos"]))))
+                self._guardar("set", ["siguiente_id"], siguiente + len(datos["ejemplos"]))
+
+    def configuracion(self) -> dict:
+        return self._config["configuracion"]
+
+    def actualizar_configuracion(self, campo: str, valor):
+        self._guardar("set", ["configuracion", campo], valor)
+
+    def tipos(self) -> list:
+        return list(self._config["tipos_de_post"])
+
+    def existe_tipo(self, tipo: str) -> bool:
+        return tipo in self._config["tipos_de_post"]
+
+    def crear_tipo(self, tipo: str):
+        self._guardar("set", ["tipos_de_post", tipo], {"ejemplos": [], "ids": []})
+
+    def renombrar_tipo(self, tipo: str, nuevo: str):
+        self._guardar("rename", ["tipos_de_post", tipo], nuevo)
+        self._posiciones.pop(tipo, None)
+
+    def eliminar_tipo(self, tipo: str):
+        self._guardar("del", ["tipos_de_post", tipo])
+        self._posiciones.pop(tipo, None)
+
+    def ejemplos(self, tipo: str) -> list:
+        return self._config["tipos_de_post"][tipo]["ejemplos"]
+
+    def ejemplos_con_id(self, tipo: str) -> list:
+        datos = self._config["tipos_de_post"][tipo]
+        return list(zip(datos["ids"], datos["ejemplos"]))
+
+    def contar_ejemplos(self, tipo: str) -> int:
+        return len(self.ejemplos(tipo))
+
+    def ejemplo(self, tipo: str, indice: int) -> str:
+        return self.ejemplos(tipo)[self._validar_indice(tipo, indice)]
+
+    def posicion_ejemplo(self, tipo: str, id_ejemplo: int) -> int:
+        posiciones = self._posiciones.get(tipo)
+        if posiciones is None:
+            ids = self._config["tipos_de_post"][tipo]["ids"]
+            posiciones = self._posiciones[tipo] = {id_: posicion for posicion, id_ in enumerate(ids)}
+        if id_ejemplo not in posiciones:
+            raise IndexError(id_ejemplo)
+        return posiciones[id_ejemplo]
+
+    def ejemplo_por_id(self, tipo: str, id_ejemplo: int) -> str:
+        return self.ejemplos(tipo)[self.posicion_ejemplo(tipo, id_ejemplo)]
+
+    def ids_ejemplos(self, tipo: str) -> list:
+        return list(self._config["tipos_de_post"][tipo]["ids"])
+
+    def pagina_ejemplos(self, tipo: str, despues: int = None, antes: int = None, limite: int = 10,
+                        prefijo: str = "") -> list:
+        datos = self._config["tipos_de_post"][tipo]
+        ids, ejemplos = datos["ids"], datos["ejemplos"]
+        if antes is not None:
+            posiciones = range(bisect.bisect_left(ids, antes) - 1, -1, -1)
+        else:
+            posiciones = range(0 if despues is None else bisect.bisect_right(ids, despues), len(ids))
+        prefijo = prefijo.lower()
+        pagina = []
+        for posicion in posiciones:
+            if ejemplos[posicion][:len(prefijo)].lower() == prefijo:
+                pagina.append((ids[posicion], posicion, ejemplos[posicion]))
+                if len(pagina) == limite:
+                    break
+        return pagina[::-1] if antes is not None else pagina
+
+    def existe_ejemplo(self, tipo: str, texto: str) -> bool:
+        return texto in self.ejemplos(tipo)
+
+    def agregar_ejemplo(self, tipo: str, texto: str) -> int:
+        id_ejemplo = self._config.get("siguiente_id", 1)
+        self._guardar("append", ["tipos_de_post", tipo, "ejemplos"], texto)
+        self._guardar("append", ["tipos_de_post", tipo, "ids"], id_ejemplo)
+        self._guardar("set", ["siguiente_id"], id_ejemplo + 1)
+        if tipo in self._posiciones:
+            self._posiciones[tipo][id_ejemplo] = len(self.ejemplos(tipo)) - 1
+        return id_ejemplo
+
+    def actualizar_ejemplo(self, tipo: str, id_ejemplo: int, texto: str):
+        self._guardar("set", ["tipos_de_post", tipo, "ejemplos", self.posicion_ejemplo(tipo, id_ejemplo)], texto)
+
+    def borrar_ejemplo(self, tipo: str, id_ejemplo: int) -> str:
+        indice = self.posicion_ejemplo(tipo, id_ejemplo)
+        borrado = self.ejemplo(tipo, indice)
+        self._guardar("del", ["tipos_de_post", tipo, "ejemplos", indice])
+        self._guardar("del", ["tipos_de_post", tipo, "ids", indice])
+        # Las posiciones siguientes se desplazan: se recalculan en la próxima consulta
+        self._posiciones.pop(tipo, None)
+        return borrado
+
+    async def guardar(self):
+        await self.diario.flush(self._config)
+
+    async def cerrar(self):
+        await self.diario.cerrar(self._config)
+
+    def estadisticas(self) -> dict:
+        return self.diario.estadisticas()
+
+    def observar_escrituras(self, observar):
+        # Las escrituras reales las hace el diario, agrupadas y fuera del loop
+        self.diario.al_escribir = observar
+
+    def _validar_indice(self, tipo: str, indice: int) -> int:
+        if not 0 <= indice < len(self.ejemplos(tipo)):
+            raise IndexError(indice)
+        return indice
+
+    def _guardar(self, op: str, ruta: list, valor=None):
+        """
+        Aplica un cambio a la configuración en memoria y lo registra en el diario.
+        Lanza KeyError/IndexError sin registrar nada si la ruta no existe.
+        """
+        operacion = {"op": op, "ruta": ruta}
+        if op != "del":
+            operacion["valor"] = valor
+        aplicar_operacion(self._config, operacion)
+        self.diario.registrar(self._config, operacion)
+
+
+class AlmacenSQLite(Almacen):
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS configuracion (
+            campo TEXT PRIMARY KEY,
+            valor TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tipos_de_post (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS ejemplos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo_id INTEGER NOT NULL REFERENCES tipos_de_post(id) ON DELETE CASCADE,
+            texto TEXT NOT NULL,
+            hash TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ejemplos_tipo_hash ON ejemplos(tipo_id, hash);
+        CREATE INDEX IF NOT EXISTS ejemplos_tipo_id ON ejemplos(tipo_id, id);
+        CREATE TABLE IF NOT EXISTS cambios (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            origen TEXT NOT NULL,
+            ambito TEXT NOT NULL,
+            tipo TEXT,
+            ejemplo INTEGER
+        );
+    """
+    # Cambios que se conservan; un proceso que se quede más atrás lo recarga todo
+    MAX_CAMBIOS = 10000
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._db = sqlite3.connect(ruta, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(self.ESQUEMA)
+        self._configuracion = None
+        self._ids_tipo = {}
+        self._recargar_tipos()
+        # Versión de la última escritura aplicada y marca para reconocer las propias
+        self._origen = uuid.uuid4().hex
+        self._version = self._db.execute("SELECT COALESCE(MAX(version), 0) FROM cambios").fetchone()[0]
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self.escrituras = 0
+        self.sincronizaciones = 0
+
+    def vacio(self) -> bool:
+        return not self._ids_tipo and self._db.execute("SELECT 1 FROM configuracion LIMIT 1").fetchone() is None
+
+    def migrar_desde_json(self, ruta_json: str) -> bool:
+        """Importa un config.json (snapshot + diario) si la base de datos está vacía."""
+        if not self.vacio() or not os.path.exists(ruta_json):
+            return False
+        config = DiarioConfig(ruta_json).cargar({"configuracion": {}, "tipos_de_post": {}})
+        with self._db:
+            self._db.execute("BEGIN")
+            for campo, valor in config["configuracion"].items():
+                self._db.execute("INSERT INTO configuracion VALUES (?, ?)", (campo, json.dumps(valor, ensure_ascii=False)))
+            for tipo in config["tipos_de_post"]:
+                self._ids_tipo[tipo] = self._db.execute("INSERT INTO tipos_de_post (nombre) VALUES (?)", (tipo,)).lastrowid
+            # Los IDs de AlmacenJSON se conservan: los botones y las sesiones siguen
+            # apuntando al mismo ejemplo, y tampoco se reutiliza ninguno ya borrado
+            for tipo, datos in config["tipos_de_post"].items():
+                if "ids" in datos:
+                    self._db.executemany(
+                        "INSERT INTO ejemplos (id, tipo_id, texto, hash) VALUES (?, ?, ?, ?)",
+                        ((id_ejemplo, self._ids_tipo[tipo], texto, hash_contenido(texto))
+                         for id_ejemplo, texto in zip(datos["ids"], datos["ejemplos"])),
+                    )
+            self._db.execute("DELETE FROM sqlite_sequence WHERE name = 'ejemplos'")
+            self._db.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('ejemplos', MAX(?, (SELECT COALESCE(MAX(id), 0) FROM ejemplos)))",
+                (config.get("siguiente_id", 1) - 1,),
+            )
+            # Los de un config.json anterior a los IDs reciben uno nuevo
+            for tipo, datos in config["tipos_de_post"].items():
+                if "ids" not in datos:
+                    self._db.executemany(
+                        "INSERT INTO ejemplos (tipo_id, texto, hash) VALUES (?, ?, ?)",
+                        ((self._ids_tipo[tipo], texto, hash_contenido(texto)) for texto in datos["ejemplos"]),
+                    )
+        self._configuracion = None
+        logger.info("Migrados %d tipos de post desde %s", len(config["tipos_de_post"]), ruta_json)
+        return True
+
+    def configuracion(self) -> dict:
+        if self._configuracion is None:
+            configuracion = dict(CONFIGURACION_POR_DEFECTO)
+            for campo, valor in self._db.execute("SELECT campo, valor FROM configuracion"):
+                configuracion[campo] = json.loads(valor)
+            self._configuracion = configuracion
+        return self._configuracion
+
+    def actualizar_configuracion(self, campo: str, valor):
+        self._escribir(
+            "INSERT INTO configuracion VALUES (?, ?) ON CONFLICT(campo) DO UPDATE SET valor = excluded.valor",
+            (campo, json.dumps(valor, ensure_ascii=False)),
+            "configuracion",
+        )
+        self._configuracion = None
+
+    def tipos(self) -> list:
+        return list(self._ids_tipo)
+
+    def existe_tipo(self, tipo: str) -> bool:
+        return tipo in self._ids_tipo
+
+    def crear_tipo(self, tipo: str):
+        self._ids_tipo[tipo] = self._escribir("INSERT INTO tipos_de_post (nombre) VALUES (?)", (tipo,), "tipos", tipo).lastrowid
+
+    def renombrar_tipo(self, tipo: str, nuevo: str):
+        id_tipo = self._ids_tipo[tipo]
+        self._escribir("UPDATE tipos_de_post SET nombre = ? WHERE id = ?", (nuevo, id_tipo), "tipos", tipo, nuevo)
+        self._ids_tipo[nuevo] = self._ids_tipo.pop(tipo)
+
+    def eliminar_tipo(self, tipo: str):
+        self._escribir("DELETE FROM tipos_de_post WHERE id = ?", (self._ids_tipo[tipo],), "tipos", tipo)
+        del self._ids_tipo[tipo]
+
+    def ejemplos(self, tipo: str) -> list:
+        return [texto for texto, in self._db.execute(
+            "SELECT texto FROM ejemplos WHERE tipo_id = ? ORDER BY id", (self._ids_tipo[tipo],)
+        )]
+
+    def ejemplos_con_id(self, tipo: str) -> list:
+        return self._db.execute(
+            "SELECT id, texto FROM ejemplos WHERE tipo_id = ? ORDER BY id", (self._ids_tipo[tipo],)
+        ).fetchall()
+
+    def contar_ejemplos(self, tipo: str) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM ejemplos WHERE tipo_id = ?", (self._ids_tipo[tipo],)).fetchone()[0]
+
+    def ejemplo(self, tipo: str, indice: int) -> str:
+        fila = self._db.execute(
+            "SELECT texto FROM ejemplos WHERE tipo_id = ? ORDER BY id LIMIT 1 OFFSET ?", (self._ids_tipo[tipo], indice)
+        ).fetchone() if indice >= 0 else None
+        if fila is None:
+            raise IndexError(indice)
+        return fila[0]
+
+    def posicion_ejemplo(self, tipo: str, id_ejemplo: int) -> int:
+        # La posición no se guarda (borrar obligaría a renumerar los siguientes):
+        # se cuenta sobre el índice (tipo_id, id)
+        id_tipo = self._ids_tipo[tipo]
+        if self._db.execute("SELECT 1 FROM ejemplos WHERE id = ? AND tipo_id = ?", (id_ejemplo, id_tipo)).fetchone() is None:
+            raise IndexError(id_ejemplo)
+        return self._db.execute(
+            "SELECT COUNT(*) FROM ejemplos WHERE tipo_id = ? AND id < ?", (id_tipo, id_ejemplo)
+        ).fetchone()[0]
+
+    def ejemplo_por_id(self, tipo: str, id_ejemplo: int) -> str:
+        fila = self._db.execute(
+            "SELECT texto FROM ejemplos WHERE id = ? AND tipo_id = ?", (id_ejemplo, self._ids_tipo[tipo])
+        ).fetchone()
+        if fila is None:
+            raise IndexError(id_ejemplo)
+        return fila[0]
+
+    def ids_ejemplos(self, tipo: str) -> list:
+        return [fila[0] for fila in self._db.execute(
+            "SELECT id FROM ejemplos WHERE tipo_id = ? ORDER BY id", (self._ids_tipo[tipo],)
+        )]
+
+    def pagina_ejemplos(self, tipo: str, despues: int = None, antes: int = None, limite: int = 10,
+                        prefijo: str = "") -> list:
+        condiciones, parametros = ["tipo_id = ?"], [self._ids_tipo[tipo]]
+        if despues is not None:
+            condiciones.append("id > ?")
+            parametros.append(despues)
+        if antes is not None:
+            condiciones.append("id < ?")
+            parametros.append(antes)
+        if prefijo:
+            condiciones.append("texto LIKE ? ESCAPE '\\'")
+            parametros.append(prefijo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        filas = self._db.execute(
+            f"SELECT id, texto FROM ejemplos WHERE {' AND '.join(condiciones)} "
+            f"ORDER BY id {'DESC' if antes is not None else 'ASC'} LIMIT ?",
+            (*parametros, limite),
+        ).fetchall()
+        if antes is not None:
+            filas.reverse()
+        if not filas:
+            return []
+        # Solo se cuenta la posición del primero: las demás se deducen contando
+        # los anteriores que hay dentro de la propia página
+        ids = [id_ejemplo for id_ejemplo, _ in filas]
+        primera = self._db.execute(
+            "SELECT COUNT(*) FROM ejemplos WHERE tipo_id = ? AND id < ?", (self._ids_tipo[tipo], ids[0])
+        ).fetchone()[0]
+        if not prefijo:
+            return [(id_ejemplo, primera + i, texto) for i, (id_ejemplo, texto) in enumerate(filas)]
+        # Con prefijo hay huecos entre los de la página: se cuentan por tramos
+        posiciones = [primera]
+        for anterior, actual in zip(ids, ids[1:]):
+            posiciones.append(posiciones[-1] + self._db.execute(
+                "SELECT COUNT(*) FROM ejemplos WHERE tipo_id = ? AND id >= ? AND id < ?",
+                (self._ids_tipo[tipo], anterior, actual),
+            ).fetchone()[0])
+        return [(id_ejemplo, posicion, texto) for posicion, (id_ejemplo, texto) in zip(posiciones, filas)]
+
+    def existe_ejemplo(self, tipo: str, texto: str) -> bool:
+        return self._db.execute(
+            "SELECT 1 FROM ejemplos WHERE tipo_id = ? AND hash = ? AND texto = ?",
+            (self._ids_tipo[tipo], hash_contenido(texto), texto),
+        ).fetchone() is not None
+
+    # Las escrituras de ejemplos anotan su ID en `cambios`: van en su propia transacción
+    def agregar_ejemplo(self, tipo: str, texto: str) -> int:
+        id_tipo = self._ids_tipo[tipo]
+        inicio = time.perf_counter()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            id_ejemplo = self._db.execute(
+                "INSERT INTO ejemplos (tipo_id, texto, hash) VALUES (?, ?, ?)",
+                (id_tipo, texto, hash_contenido(texto)),
+            ).lastrowid
+            self._registrar_cambio("ejemplos", (tipo,), id_ejemplo)
+        self._medido(inicio)
+        return id_ejemplo
+
+    def actualizar_ejemplo(self, tipo: str, id_ejemplo: int, texto: str):
+        id_tipo = self._ids_tipo[tipo]
+        inicio = time.perf_counter()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            if self._db.execute(
+                "UPDATE ejemplos SET texto = ?, hash = ? WHERE id = ? AND tipo_id = ?",
+                (texto, hash_contenido(texto), id_ejemplo, id_tipo),
+            ).rowcount == 0:
+                raise IndexError(id_ejemplo)
+            self._registrar_cambio("ejemplos", (tipo,), id_ejemplo)
+        self._medido(inicio)
+
+    def borrar_ejemplo(self, tipo: str, id_ejemplo: int) -> str:
+        inicio = time.perf_counter()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            # Sin posición guardada no hay que desplazar los siguientes: borrar es una fila
+            borrado = self.ejemplo_por_id(tipo, id_ejemplo)
+            self._db.execute("DELETE FROM ejemplos WHERE id = ?", (id_ejemplo,))
+            self._registrar_cambio("ejemplos", (tipo,), id_ejemplo)
+        self._medido(inicio)
+        return borrado
+
+    def sincronizar(self) -> dict:
+        # data_version solo cambia cuando otra conexión ha escrito: es la comprobación barata
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return {}
+        self._data_version = data_version
+        filas = self._db.execute(
+            "SELECT version, origen, ambito, tipo, ejemplo FROM cambios WHERE version > ? ORDER BY version",
+            (self._version,),
+        ).fetchall()
+        if not filas:
+            return {}
+        self.sincronizaciones += 1
+        anteriores = set(self._ids_tipo)
+        if filas[0][0] > self._version + 1:
+            # Se han purgado cambios que no llegamos a ver: se recarga todo
+            self._version = filas[-1][0]
+            self._configuracion = None
+            self._recargar_tipos()
+            return dict.fromkeys(anteriores | set(self._ids_tipo))
+        self._version = filas[-1][0]
+        afectados = {}
+        recargar_tipos = False
+        for _, origen, ambito, tipo, ejemplo in filas:
+            if origen == self._origen:
+                continue
+            if ambito == "configuracion":
+                self._configuracion = None
+            elif ambito == "ejemplos":
+                if afectados.get(tipo, ()) is not None:
+                    afectados.setdefault(tipo, set()).add(ejemplo)
+            else:
+                recargar_tipos |= ambito == "tipos"
+                afectados[tipo] = None
+        if recargar_tipos:
+            self._recargar_tipos()
+        return afectados
+
+    async def cerrar(self):
+        self._db.close()
+
+    def estadisticas(self) -> dict:
+        return {
+            "escrituras": self.escrituras,
+            "tipos": len(self._ids_tipo),
+            "version": self._version,
+            "sincronizaciones": self.sincronizaciones,
+        }
+
+    def _recargar_tipos(self):
+        self._ids_tipo = {nombre: id_ for id_, nombre in self._db.execute("SELECT id, nombre FROM tipos_de_post")}
+
+    def _escribir(self, sql: str, parametros: tuple, ambito: str, *tipos) -> sqlite3.Cursor:
+        """Ejecuta la escritura y la anota en `cambios` en la misma transacción."""
+        inicio = time.perf_counter()
+        with self._db:
+            # IMMEDIATE toma el bloqueo de escritura al empezar: con varios procesos
+            # se espera el turno (timeout de la conexión) en lugar de fallar a mitad
+            self._db.execute("BEGIN IMMEDIATE")
+            cursor = self._db.execute(sql, parametros)
+            self._registrar_cambio(ambito, tipos or (None,))
+        self._medido(inicio)
+        return cursor
+
+    def _registrar_cambio(self, ambito: str, tipos: tuple, ejemplo: int = None):
+        for tipo in tipos:
+            version = self._db.execute(
+                "INSERT INTO cambios (origen, ambito, tipo, ejemplo) VALUES (?, ?, ?, ?)",
+                (self._origen, ambito, tipo, ejemplo),
+            ).lastrowid
+            if version == self._version + 1:
+                # Nadie ha escrito entre medias: no hay nada que sincronizar hasta aquí
+                self._version = version
+        if version % 1000 == 0:
+            self._db.execute("DELETE FROM cambios WHERE version <= ?", (version - self.MAX_CAMBIOS,))
+
+    def _medido(self, inicio: float):
+        self.escrituras += 1
+        if self.al_escribir is not None:
+            self.al_escribir("sql", time.perf_counter() - inicio)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        sys.exit("Uso: python almacen.py config.json bot.db")
+    almacen = AlmacenSQLite(sys.argv[2])
+    if not almacen.migrar_desde_json(sys.argv[1]):
+        sys.exit(f"{sys.argv[2]} ya tiene datos o {sys.argv[1]} no existe; no se ha migrado nada.")
@@ -0,0 +1,105 @@
+"""
+Arranque en frío del bot contra el Telegram falso y el stub del modelo:
+- importación de bot.py sin tokens (antes de create_app salía del proceso);
+- desde lanzar el proceso hasta su primer getUpdates;
+- hasta la primera respuesta (/start) y hasta el primer post generado, que
+  incluye construir el cliente del modelo.
+Para comparar antes/después, se ejecuta en cada versión del código.
+
+Uso:
+    python -m bench.arranque --repeticiones 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench.recorridos import BOT, detener_bot, esperar_polling, lanzar_bot
+from bench.stub_llm import StubLLM
+from bench.telegram_falso import TelegramFalso, callback_sintetico, update_sintetico
+
+
+async def _importar() -> str:
+    # Sin tokens: la versión anterior a create_app sale del proceso al importarse
+    entorno = dict(os.environ, TELEGRAM_BOT_TOKEN="", OPENAI_API_KEY="")
+    with tempfile.TemporaryDirectory() as directorio:
+        proceso = await asyncio.create_subprocess_exec(
+            sys.executable, "-c",
+            "import sys, time; inicio = time.perf_counter(); import bot; "
+            "print(time.perf_counter() - inicio, 'openai' in sys.modules)",
+            cwd=directorio, env=dict(entorno, PYTHONPATH=os.path.dirname(BOT)),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            salida, _ = await asyncio.wait_for(proceso.communicate(), 30)
+        except asyncio.TimeoutError:
+            proceso.kill()
+            return "no termina (arranca el bot al importarse)"
+    if proceso.returncode != 0:
+        return f"falla al importarse (código {proceso.returncode})"
+    segundos, openai = salida.decode().split()
+    return f"{float(segundos) * 1000:.0f} ms (openai importado: {'sí' if openai == 'True' else 'no'})"
+
+
+async def _arranque(stub: StubLLM, puerto_llm: int) -> tuple:
+    telegram = TelegramFalso()
+    puerto_telegram = await telegram.iniciar()
+    chat_id = 1000
+    try:
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta_log = os.path.join(directorio, "bot.log")
+            inicio = time.perf_counter()
+            with open(ruta_log, "wb") as log:
+                bot = await lanzar_bot(directorio, puerto_telegram, puerto_llm, log)
+            try:
+                await esperar_polling(telegram, bot)
+                polling = time.perf_counter() - inicio
+                telegram.publicar(update_sintetico(1, "/start", chat_id))
+                await telegram.esperar(chat_id, ("configurar", "ya existe"))
+                respuesta = time.perf_counter() - inicio
+
+                # Lo mínimo para generar un post: un tipo con un ejemplo
+                telegram.publicar(callback_sintetico(2, "add_tipo_post", chat_id))
+                await telegram.esperar(chat_id, "nombre del nuevo tipo")
+                telegram.publicar(update_sintetico(3, "bench", chat_id))
+                await telegram.esperar(chat_id, "agregado")
+                telegram.publicar(callback_sintetico(4, "ejemplo_bench", chat_id))
+                await telegram.esperar(chat_id, "Envíame un ejemplo")
+                telegram.publicar(update_sintetico(5, "Un ejemplo de post para medir el arranque", chat_id))
+                await telegram.esperar(chat_id, "agregado")
+                telegram.publicar(callback_sintetico(6, "post_bench", chat_id))
+                await telegram.esperar(chat_id, "Escribe el tema")
+                enviado = time.perf_counter()
+                telegram.publicar(update_sintetico(7, "arranque en frío", chat_id))
+                await telegram.esperar(chat_id, (stub.texto.split()[-1], "⚠️"))
+                primer_post = time.perf_counter() - enviado
+            finally:
+                await detener_bot(bot, ruta_log)
+    finally:
+        await telegram.detener()
+    return polling, respuesta, primer_post
+
+
+async def _main(args):
+    print(f"import bot: {await _importar()}")
+    stub = StubLLM(latencia=args.latencia)
+    puerto_llm = await stub.iniciar()
+    medidas = [await _arranque(stub, puerto_llm) for _ in range(args.repeticiones)]
+    await stub.detener()
+    for indice, nombre in enumerate((
+        "hasta el primer getUpdates",
+        "hasta la primera respuesta",
+        f"primer post (stub de {args.latencia * 1000:.0f} ms)",
+    )):
+        valores = [medida[indice] for medida in medidas]
+        print(f"{nombre:>34}: mediana {statistics.median(valores) * 1000:7.0f} ms, mínimo {min(valores) * 1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--latencia", type=float, default=0.1, help="latencia del stub del modelo (s)")
+    asyncio.run(_main(parser.parse_args()))
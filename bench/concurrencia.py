@@ -0,0 +1,50 @@
+"""
+Comprueba que N generaciones concurrentes tardan lo mismo que una.
+Lanza el stub LLM en proceso y dispara N llamadas a ClienteLLM a la vez.
+
+Uso:
+    python -m bench.concurrencia --n 20 --latencia 2
+"""
+import argparse
+import asyncio
+import time
+
+from bench.stub_llm import StubLLM
+from llm import ClienteLLM
+
+MENSAJES = [
+    {"role": "system", "content": "Habla como Stub."},
+    {"role": "user", "content": "Genera un post de prueba."},
+]
+
+
+async def _medir(cliente: ClienteLLM, n: int) -> float:
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente.completar(MENSAJES, "stub") for _ in range(n)))
+    return time.perf_counter() - inicio
+
+
+async def _main(args):
+    stub = StubLLM(latencia=args.latencia)
+    puerto = await stub.iniciar()
+    cliente = ClienteLLM(
+        api_key="stub",
+        base_url=f"http://127.0.0.1:{puerto}/v1",
+        max_concurrencia=args.concurrencia or args.n,
+    )
+    try:
+        una = await _medir(cliente, 1)
+        varias = await _medir(cliente, args.n)
+    finally:
+        await cliente.cerrar()
+        await stub.detener()
+    print(f"1 generación:  {una:.2f}s")
+    print(f"{args.n} generaciones: {varias:.2f}s ({varias / una:.2f}x el tiempo de una; en serie serían {args.n}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20)
+    parser.add_argument("--latencia", type=float, default=1.0)
+    parser.add_argument("--concurrencia", type=int, default=0, help="límite global (por defecto, n)")
+    asyncio.run(_main(parser.parse_args()))
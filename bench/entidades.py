@@ -0,0 +1,88 @@
+"""
+Microbenchmark de convert_entities_to_html sobre mensajes largos y con muchas entidades.
+Compara la implementación de formato.py con la original (recorrido lineal por
+entidad y reconstrucción de la cadena en cada paso).
+
+Uso:
+    python -m bench.entidades --caracteres 4000 --entidades 200
+"""
+import argparse
+import random
+import timeit
+from types import SimpleNamespace
+
+from formato import convert_entities_to_html
+
+TIPOS = ["bold", "italic", "underline", "strikethrough", "code", "spoiler"]
+
+
+# --- Implementación original, solo como referencia ---
+def utf16_offset_to_index(text: str, utf16_offset: int) -> int:
+    count = 0
+    for i, ch in enumerate(text):
+        if ord(ch) >= 0x10000:
+            count += 2
+        else:
+            count += 1
+        if count >= utf16_offset:
+            return i + 1
+    return len(text)
+
+
+def convert_entities_to_html_original(message) -> str:
+    if not message.entities:
+        return message.text
+
+    text = message.text
+    entities = sorted(message.entities, key=lambda ent: utf16_offset_to_index(text, ent.offset))
+    for ent in reversed(entities):
+        start = utf16_offset_to_index(text, ent.offset)
+        end = utf16_offset_to_index(text, ent.offset + ent.length)
+        substring = text[start:end]
+        if ent.type == "bold":
+            formatted = f"<b>{substring}</b>"
+        elif ent.type == "italic":
+            formatted = f"<i>{substring}</i>"
+        elif ent.type == "underline":
+            formatted = f"<u>{substring}</u>"
+        elif ent.type == "strikethrough":
+            formatted = f"<s>{substring}</s>"
+        elif ent.type == "code":
+            formatted = f"<code>{substring}</code>"
+        elif ent.type == "pre":
+            formatted = f"<pre>{substring}</pre>"
+        elif ent.type == "text_link":
+            formatted = f'<a href="{ent.url}">{substring}</a>'
+        else:
+            formatted = substring
+        text = text[:start] + formatted + text[end:]
+    return text
+
+
+def mensaje_sintetico(caracteres: int, entidades: int, semilla: int = 0):
+    """Texto con emojis (dos unidades UTF-16) y entidades consecutivas sin solaparse."""
+    rng = random.Random(semilla)
+    alfabeto = "abcdefghijklmnñopqrstuvwxyz áéíóú,.🚀🔥"
+    text = "".join(rng.choice(alfabeto) for _ in range(caracteres))
+    largo_utf16 = sum(2 if ord(ch) >= 0x10000 else 1 for ch in text)
+    paso = max(largo_utf16 // entidades, 2)
+    entities = [
+        SimpleNamespace(type=rng.choice(TIPOS), offset=offset, length=paso // 2)
+        for offset in range(0, largo_utf16 - paso, paso)
+    ]
+    return SimpleNamespace(text=text, entities=entities)
+
+
+def main(args):
+    message = mensaje_sintetico(args.caracteres, args.entidades)
+    for nombre, funcion in (("original", convert_entities_to_html_original), ("formato.py", convert_entities_to_html)):
+        segundos = min(timeit.repeat(lambda: funcion(message), number=args.iteraciones, repeat=3)) / args.iteraciones
+        print(f"{nombre:>10}: {segundos * 1000:.3f} ms/mensaje")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--caracteres", type=int, default=4000)
+    parser.add_argument("--entidades", type=int, default=200)
+    parser.add_argument("--iteraciones", type=int, default=20)
+    main(parser.parse_args())
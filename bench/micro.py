@@ -0,0 +1,168 @@
+"""
+Microbenchmarks de las piezas del bot que más se repiten por update:
+conversión de entidades a HTML, escritura de la configuración (diario JSON y
+SQLite), selección de ejemplos (BM25 y búsqueda de casi duplicados) y
+páginas del listado de ejemplos de un tipo grande.
+
+Con --guardar se escribe una línea base; con --comparar se compara contra
+ella y se sale con código 1 si algún caso es más lento que la tolerancia.
+
+Uso:
+    python -m bench.micro --guardar base.json
+    python -m bench.micro --comparar base.json --tolerancia 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+from almacen import AlmacenJSON, AlmacenSQLite
+from bench.entidades import mensaje_sintetico
+from duplicados import IndiceDuplicados
+from formato import convert_entities_to_html
+from persistencia import DiarioConfig
+from recuperacion import IndiceBM25
+
+PALABRAS = [f"palabra{i}" for i in range(2000)]
+
+
+def _texto(azar: random.Random, palabras: int) -> str:
+    return " ".join(azar.choice(PALABRAS) for _ in range(palabras))
+
+
+def _por_operacion(funcion, repeticiones: int) -> float:
+    return min(timeit.repeat(funcion, number=repeticiones, repeat=5)) / repeticiones
+
+
+def entidades(args) -> float:
+    mensaje = mensaje_sintetico(4000, 200)
+    return _por_operacion(lambda: convert_entities_to_html(mensaje), 20)
+
+
+def _escrituras(almacen, cambios: int) -> float:
+    """Segundos por cambio, con la escritura a disco incluida."""
+    azar = random.Random(0)
+
+    async def ronda():
+        for i in range(cambios):
+            if i % 2:
+                almacen.actualizar_configuracion("personalidad", _texto(azar, 20))
+            else:
+                almacen.agregar_ejemplo("bench", _texto(azar, 80))
+        await almacen.guardar()
+
+    return min(timeit.repeat(lambda: asyncio.run(ronda()), number=1, repeat=5)) / cambios
+
+
+def guardar_config_json(args) -> float:
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenJSON(DiarioConfig(os.path.join(directorio, "config.json")))
+        almacen.crear_tipo("bench")
+        return _escrituras(almacen, args.cambios)
+
+
+def guardar_config_sqlite(args) -> float:
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenSQLite(os.path.join(directorio, "bot.db"))
+        almacen.crear_tipo("bench")
+        try:
+            return _escrituras(almacen, args.cambios)
+        finally:
+            asyncio.run(almacen.cerrar())
+
+
+def _paginas(almacen, ejemplos: int) -> float:
+    """Una página a mitad del tipo y la búsqueda del ejemplo pulsado por su ID."""
+    azar = random.Random(0)
+    almacen.crear_tipo("bench")
+    for _ in range(ejemplos):
+        almacen.agregar_ejemplo("bench", _texto(azar, 20))
+    medio = almacen.pagina_ejemplos("bench", limite=ejemplos // 2)[-1][0]
+
+    def pagina():
+        filas = almacen.pagina_ejemplos("bench", despues=medio, limite=9)
+        almacen.posicion_ejemplo("bench", filas[0][0])
+
+    return _por_operacion(pagina, 100)
+
+
+def pagina_ejemplos_json(args) -> float:
+    with tempfile.TemporaryDirectory() as directorio:
+        return _paginas(AlmacenJSON(DiarioConfig(os.path.join(directorio, "config.json"))), args.ejemplos * 10)
+
+
+def pagina_ejemplos_sqlite(args) -> float:
+    with tempfile.TemporaryDirectory() as directorio:
+        almacen = AlmacenSQLite(os.path.join(directorio, "bot.db"))
+        try:
+            return _paginas(almacen, args.ejemplos * 10)
+        finally:
+            asyncio.run(almacen.cerrar())
+
+
+def seleccion_bm25(args) -> float:
+    azar = random.Random(0)
+    indice = IndiceBM25()
+    indice.reconstruir("bench", [(id_ejemplo, _texto(azar, 80)) for id_ejemplo in range(1, args.ejemplos + 1)])
+    temas = [_texto(azar, 6) for _ in range(100)]
+    ciclo = iter(temas * 1000)
+    return _por_operacion(lambda: indice.mejores("bench", next(ciclo), 3), 100)
+
+
+def duplicados(args) -> float:
+    azar = random.Random(0)
+    indice = IndiceDuplicados()
+    indice.reconstruir("bench", [(id_ejemplo, _texto(azar, 80)) for id_ejemplo in range(1, args.ejemplos + 1)])
+    nuevos = [_texto(azar, 80) for _ in range(100)]
+    ciclo = iter(nuevos * 1000)
+    return _por_operacion(lambda: indice.buscar("bench", next(ciclo)), 100)
+
+
+CASOS = {
+    "entidades": entidades,
+    "guardar_config_json": guardar_config_json,
+    "guardar_config_sqlite": guardar_config_sqlite,
+    "pagina_ejemplos_json": pagina_ejemplos_json,
+    "pagina_ejemplos_sqlite": pagina_ejemplos_sqlite,
+    "seleccion_bm25": seleccion_bm25,
+    "duplicados": duplicados,
+}
+
+
+def main(args) -> int:
+    resultados = {nombre: caso(args) for nombre, caso in CASOS.items() if not args.casos or nombre in args.casos}
+    base = {}
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as file:
+            base = json.load(file)
+    regresiones = []
+    for nombre, segundos in resultados.items():
+        linea = f"{nombre:>22}: {segundos * 1e6:10.1f} µs/op"
+        if nombre in base:
+            cambio = segundos / base[nombre] - 1
+            linea += f"  ({cambio:+.0%} frente a la base)"
+            if cambio > args.tolerancia:
+                regresiones.append(nombre)
+        print(linea)
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as file:
+            json.dump(resultados, file, indent=2)
+    if regresiones:
+        print(f"Regresiones por encima del {args.tolerancia:.0%}: {', '.join(regresiones)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("casos", nargs="*", help=f"casos a medir (por defecto todos: {', '.join(CASOS)})")
+    parser.add_argument("--ejemplos", type=int, default=500, help="ejemplos en el tipo para la selección")
+    parser.add_argument("--cambios", type=int, default=200, help="cambios por ronda de escritura")
+    parser.add_argument("--guardar", help="escribe los resultados como línea base")
+    parser.add_argument("--comparar", help="línea base con la que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento máximo admitido")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,225 @@
+"""
+Prueba de carga de extremo a extremo sin red ni tokens: arranca bot.py tal
+cual contra un Telegram falso y el stub del modelo, y hace que N chats
+simulados recorran a la vez el flujo completo: asistente de configuración (o
+edición de la configuración si ya existe), tipo de post, ejemplos, crear post,
+reescribir, aceptar y editar un ejemplo.
+
+Para cada número de chats informa del rendimiento, la latencia p50/p95/p99 de
+cada paso (desde que el update está disponible en getUpdates hasta que llega
+la respuesta esperada) y la memoria del proceso del bot antes y después.
+Los límites de envío del bot se levantan para medir el bot y no el token
+bucket; --limites-telegram los deja como estén en el entorno.
+
+Con --trabajadores N arranca el enrutador con N procesos trabajadores (y
+ALMACEN=sqlite); la memoria es la del enrutador más la de sus trabajadores.
+Para ver cómo escala con los núcleos, con el modelo casi instantáneo:
+    for n in 1 2 4; do python -m bench.recorridos --chats 1000 --latencia 0 --trabajadores $n; done
+
+Uso:
+    python -m bench.recorridos --chats 1 100 1000 --latencia 0.5
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+from bench.stub_llm import StubLLM
+from bench.telegram_falso import TelegramFalso, callback_sintetico, update_sintetico
+
+BOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot.py")
+PALABRAS = (
+    "oferta", "lanzamiento", "clientes", "equipo", "semana", "novedad", "descuento", "taller", "evento",
+    "consejo", "proyecto", "resultado", "comunidad", "producto", "servicio", "historia", "reto", "idea",
+)
+
+
+def _percentil(valores: list, q: float) -> float:
+    return valores[min(len(valores) - 1, int(len(valores) * q))]
+
+
+def _rss_mb(pid: int):
+    """Memoria residente del proceso y sus hijos (solo Linux); None si no se puede leer."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            hijos = [int(hijo) for hijo in file.read().split()]
+        with open(f"/proc/{pid}/status") as file:
+            for linea in file:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024 + sum(_rss_mb(hijo) or 0 for hijo in hijos)
+    except OSError:
+        pass
+    return None
+
+
+async def _recorrido(telegram: TelegramFalso, stub: StubLLM, chat_id: int, ids, latencias: dict, timeout: float):
+    azar = random.Random(chat_id)
+
+    async def paso(nombre: str, contiene, texto: str = None, boton: str = None) -> str:
+        if boton is not None:
+            update = callback_sintetico(next(ids), boton, chat_id)
+        else:
+            update = update_sintetico(next(ids), texto, chat_id)
+        inicio = time.perf_counter()
+        telegram.publicar(update)
+        respuesta = await telegram.esperar(chat_id, contiene, timeout)
+        latencias.setdefault(nombre, []).append(time.perf_counter() - inicio)
+        return respuesta
+
+    def frase(palabras: int) -> str:
+        return " ".join(azar.choice(PALABRAS) for _ in range(palabras))
+
+    post = (stub.texto.split()[-1], "⚠️")
+    tipo = f"tipo{chat_id}"
+
+    # La configuración es global: solo el primer chat la encuentra vacía
+    if "configurar" in await paso("start", ("configurar", "ya existe"), texto="/start"):
+        await paso("asistente", "etiqueta", texto="Bench")
+        await paso("asistente", "personalidad", texto="@bench")
+        await paso("asistente", "servicios", texto="Cercano, directo y con humor")
+        await paso("asistente", "idioma", texto="Consultoría, Formación")
+        await paso("asistente", "completada", texto="Español")
+    else:
+        await paso("editar_config", "Selecciona el campo", boton="editar_config")
+        await paso("editar_config", "personalidad", boton="edit_personalidad_menu")
+        await paso("editar_config", "actualizada", texto="Cercano, directo y con humor")
+    await paso("menu", "Selecciona una opción", texto="/menu")
+
+    await paso("crear_tipo", "nombre del nuevo tipo", boton="add_tipo_post")
+    await paso("crear_tipo", "agregado", texto=tipo)
+    for _ in range(3):
+        await paso("agregar_ejemplo", "Envíame un ejemplo", boton=f"ejemplo_{tipo}")
+        await paso("agregar_ejemplo", ("agregado", "No se ha agregado"), texto=frase(40))
+
+    await paso("crear_post", "Escribe el tema", boton=f"post_{tipo}")
+    await paso("crear_post", post, texto=frase(6))
+    await paso("reescribir", post, boton="reescribir_post")
+    await paso("aceptar", "Selecciona una opción", boton="aceptar_post")
+
+    await paso("editar_ejemplo", "Opciones para el tipo", boton=f"edit_tipo_{tipo}")
+    await paso("editar_ejemplo", "Selecciona el ejemplo", boton="ver_ejemplos")
+    ver = telegram.boton(chat_id, "ver_ej_")
+    await paso("editar_ejemplo", "Qué deseas hacer", boton=ver)
+    await paso("editar_ejemplo", "nuevo texto", boton="mod_ej_" + ver.rsplit("_", 1)[1])
+    await paso("editar_ejemplo", "actualizado", texto=frase(40))
+    telegram.olvidar(chat_id)
+
+
+async def _nivel(telegram: TelegramFalso, stub: StubLLM, pid: int, chats: list, ids, timeout: float) -> str:
+    latencias = {}
+    memoria_antes = _rss_mb(pid)
+    inicio = time.perf_counter()
+    resultados = await asyncio.gather(
+        *(_recorrido(telegram, stub, chat_id, ids, latencias, timeout) for chat_id in chats),
+        return_exceptions=True,
+    )
+    duracion = time.perf_counter() - inicio
+    memoria_despues = _rss_mb(pid)
+    fallidos = [r for r in resultados if isinstance(r, BaseException)]
+    pasos = sum(len(valores) for valores in latencias.values())
+
+    lineas = [
+        f"== {len(chats)} chats ==",
+        f"  {pasos} pasos en {duracion:.1f} s: {pasos / duracion:.0f} pasos/s, "
+        f"{(len(chats) - len(fallidos)) / duracion:.1f} recorridos/s, {len(fallidos)} recorridos fallidos",
+    ]
+    if fallidos:
+        lineas.append(f"  primer fallo: {fallidos[0]!r}")
+    if memoria_antes is not None and memoria_despues is not None:
+        lineas.append(
+            f"  memoria del bot: {memoria_antes:.1f} MB -> {memoria_despues:.1f} MB "
+            f"({memoria_despues - memoria_antes:+.1f} MB, {(memoria_despues - memoria_antes) * 1024 / len(chats):.1f} KB/chat)"
+        )
+    lineas.append(f"  {'paso':<16}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for nombre, valores in latencias.items():
+        valores.sort()
+        lineas.append(
+            f"  {nombre:<16}{len(valores):>7}{_percentil(valores, 0.5) * 1000:>10.1f}"
+            f"{_percentil(valores, 0.95) * 1000:>10.1f}{_percentil(valores, 0.99) * 1000:>10.1f}"
+        )
+    return "\n".join(lineas)
+
+
+async def lanzar_bot(directorio: str, puerto_telegram: int, puerto_llm: int, log, limites_telegram: bool = True,
+                     trabajadores: int = 1):
+    """
+    Arranca bot.py en `directorio` (config.json y lotes/ empiezan vacíos) contra
+    el Telegram falso y el stub del modelo. Con `limites_telegram=False` se
+    levantan los límites de envío para medir el bot y no el token bucket.
+    """
+    entorno = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="1:bench",
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{puerto_llm}/v1",
+        TELEGRAM_BASE_URL=f"http://127.0.0.1:{puerto_telegram}/bot",
+        MODO="polling",
+    )
+    if not limites_telegram:
+        entorno.update(SALIDA_POR_SEGUNDO="1000000", SALIDA_POR_CHAT="1000000", SALIDA_RAFAGA_CHAT="1000000")
+    if trabajadores > 1:
+        entorno.update(TRABAJADORES=str(trabajadores), ALMACEN="sqlite")
+    return await asyncio.create_subprocess_exec(
+        sys.executable, BOT, cwd=directorio, env=entorno, stdout=log, stderr=log,
+    )
+
+
+async def esperar_polling(telegram: TelegramFalso, bot: asyncio.subprocess.Process, timeout: float = 60.0):
+    """Espera al primer getUpdates del bot."""
+    limite = time.monotonic() + timeout
+    while not telegram.llamadas.get("getUpdates"):
+        if bot.returncode is not None or time.monotonic() > limite:
+            raise RuntimeError("El bot no ha llegado a hacer polling; revisa su log")
+        await asyncio.sleep(0.01)
+
+
+async def detener_bot(bot: asyncio.subprocess.Process, ruta_log: str):
+    """Lo para con SIGINT, como Ctrl+C; si no acaba bien, muestra el final de su log."""
+    if bot.returncode is None:
+        bot.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(bot.wait(), 30)
+        except asyncio.TimeoutError:
+            bot.kill()
+    if bot.returncode not in (0, -signal.SIGINT):
+        with open(ruta_log, encoding="utf-8", errors="replace") as log:
+            print("".join(log.readlines()[-20:]), file=sys.stderr)
+
+
+async def _main(args):
+    stub = StubLLM(latencia=args.latencia, latencia_token=args.latencia_token)
+    puerto_llm = await stub.iniciar()
+    telegram = TelegramFalso()
+    puerto_telegram = await telegram.iniciar()
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta_log = args.log or os.path.join(directorio, "bot.log")
+        with open(ruta_log, "wb") as log:
+            bot = await lanzar_bot(directorio, puerto_telegram, puerto_llm, log, args.limites_telegram, args.trabajadores)
+        try:
+            await esperar_polling(telegram, bot)
+            ids = itertools.count(1)
+            for nivel, chats in enumerate(args.chats):
+                primero = (nivel + 1) * 1_000_000
+                print(await _nivel(telegram, stub, bot.pid, list(range(primero, primero + chats)), ids, args.timeout))
+            print(f"Peticiones al stub del modelo: {stub.peticiones}; a Telegram: {sum(telegram.llamadas.values())}")
+        finally:
+            await detener_bot(bot, ruta_log)
+    await telegram.detener()
+    await stub.detener()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, nargs="+", default=[1, 100, 1000], help="chats simultáneos en cada ronda")
+    parser.add_argument("--latencia", type=float, default=0.5, help="latencia del stub del modelo (s)")
+    parser.add_argument("--latencia-token", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="espera máxima por paso (s)")
+    parser.add_argument("--limites-telegram", action="store_true", help="no levantar los límites de envío del bot")
+    parser.add_argument("--trabajadores", type=int, default=1, help="procesos trabajadores detrás del enrutador")
+    parser.add_argument("--log", help="dónde guardar el log del bot (por defecto, en el directorio temporal)")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""
+Compara la latencia de generación (p50/p99) y la tasa de error de ClienteLLM
+a secas frente a ClienteResiliente (reintentos + hedging), contra un stub
+que inyecta cola de latencia y errores 500. Después tumba el backend
+principal para comprobar que el circuito se abre y se pasa al respaldo.
+
+Uso:
+    python -m bench.resiliencia --n 1000 --prob-lenta 0.03 --prob-error 0.03
+"""
+import argparse
+import asyncio
+import time
+
+from bench.stub_llm import StubLLM
+from llm import ClienteLLM
+from resiliencia import Backend, ClienteResiliente
+
+MENSAJES = [
+    {"role": "system", "content": "Habla como Stub."},
+    {"role": "user", "content": "Genera un post de prueba."},
+]
+
+
+def _resumen(latencias: list, errores: int, duracion: float) -> str:
+    latencias = sorted(latencias)
+    p50 = latencias[len(latencias) // 2] if latencias else 0.0
+    p99 = latencias[int(len(latencias) * 0.99)] if latencias else 0.0
+    return f"p50 {p50:.2f}s, p99 {p99:.2f}s, errores {errores}, total {duracion:.1f}s"
+
+
+async def _carga(completar, n: int, concurrencia: int) -> str:
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias, errores = [], 0
+
+    async def una():
+        nonlocal errores
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                await completar()
+            except Exception:
+                errores += 1
+                return
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(n)))
+    return _resumen(latencias, errores, time.perf_counter() - inicio)
+
+
+def _stub(args, prob_error=None) -> StubLLM:
+    return StubLLM(
+        latencia=args.latencia, prob_lenta=args.prob_lenta, latencia_lenta=args.latencia_lenta,
+        prob_error=args.prob_error if prob_error is None else prob_error, semilla=args.semilla,
+    )
+
+
+async def _main(args):
+    stub = _stub(args)
+    url = f"http://127.0.0.1:{await stub.iniciar()}/v1"
+
+    directo = ClienteLLM(api_key="stub", base_url=url, max_concurrencia=args.concurrencia * 2, max_reintentos=0)
+    print(f"directo:    {await _carga(lambda: directo.completar(MENSAJES, 'stub'), args.n, args.concurrencia)}")
+
+    resiliente = ClienteResiliente(Backend("principal", directo, "stub"), reintentos=2)
+    print(f"resiliente: {await _carga(lambda: resiliente.completar(MENSAJES), args.n, args.concurrencia)}")
+    print(f"            {resiliente.estadisticas()}")
+
+    # Principal caído: tras unos fallos el circuito se abre y todo va al respaldo
+    caido = _stub(args, prob_error=1.0)
+    url_caido = f"http://127.0.0.1:{await caido.iniciar()}/v1"
+    principal = ClienteLLM(api_key="stub", base_url=url_caido, max_reintentos=0)
+    con_respaldo = ClienteResiliente(
+        Backend("principal", principal, "stub"), Backend("respaldo", directo, "stub"), reintentos=2,
+    )
+    print(f"failover:   {await _carga(lambda: con_respaldo.completar(MENSAJES), args.n // 4, args.concurrencia)}")
+    print(f"            {con_respaldo.estadisticas()}, peticiones al caído: {caido.peticiones}")
+
+    for cliente in (directo, principal):
+        await cliente.cerrar()
+    await stub.detener()
+    await caido.detener()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=1000)
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--latencia", type=float, default=0.2)
+    parser.add_argument("--latencia-lenta", type=float, default=3.0)
+    parser.add_argument("--prob-lenta", type=float, default=0.03)
+    parser.add_argument("--prob-error", type=float, default=0.03)
+    parser.add_argument("--semilla", type=int, default=1)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,75 @@
+"""
+Mide el despachador de mensajes salientes contra un Telegram falso que aplica
+flood control por chat: ráfagas de mensajes cortos (como aceptar_post + menú)
+en varios chats, enviadas directamente o a través de DespachadorSalida.
+
+Uso:
+    python -m bench.salida --chats 50 --mensajes 3 --rondas 5
+"""
+import argparse
+import asyncio
+import time
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+from bench.telegram_falso import TelegramFalso
+from salida import DespachadorSalida
+
+
+async def _directo(bot: Bot, args) -> dict:
+    perdidos = 0
+
+    async def chat(chat_id):
+        nonlocal perdidos
+        for ronda in range(args.rondas):
+            for i in range(args.mensajes):
+                try:
+                    await bot.send_message(chat_id, f"mensaje {ronda}.{i}")
+                except RetryAfter:
+                    perdidos += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(args.chats)))
+    return {"duracion_s": round(time.perf_counter() - inicio, 2), "perdidos": perdidos}
+
+
+async def _despachado(bot: Bot, args) -> dict:
+    despachador = DespachadorSalida(por_segundo=args.global_por_segundo, por_chat=args.por_chat, rafaga_chat=1)
+    despachador.iniciar(bot)
+    futuros = []
+    inicio = time.perf_counter()
+    for ronda in range(args.rondas):
+        for chat_id in range(args.chats):
+            for i in range(args.mensajes):
+                futuros.append(despachador.enviar(chat_id, f"mensaje {ronda}.{i}"))
+        await asyncio.sleep(args.pausa)
+    resultados = await asyncio.gather(*futuros, return_exceptions=True)
+    estadisticas = despachador.estadisticas()
+    estadisticas["duracion_s"] = round(time.perf_counter() - inicio, 2)
+    estadisticas["perdidos"] = sum(isinstance(r, Exception) for r in resultados)
+    return estadisticas
+
+
+async def _main(args):
+    for nombre, modo in (("directo", _directo), ("despachado", _despachado)):
+        telegram = TelegramFalso(max_por_chat=args.por_chat)
+        puerto = await telegram.iniciar()
+        bot = Bot("1:bench", base_url=f"http://127.0.0.1:{puerto}/bot")
+        async with bot:
+            resultado = await modo(bot, args)
+        await telegram.detener()
+        resultado["mensajes_entregados"] = len(telegram.enviados)
+        resultado["respuestas_429"] = telegram.rechazos_429
+        print(f"{nombre}: {resultado}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--mensajes", type=int, default=3, help="mensajes seguidos por chat y ronda")
+    parser.add_argument("--rondas", type=int, default=5)
+    parser.add_argument("--pausa", type=float, default=1.0, help="segundos entre rondas")
+    parser.add_argument("--por-chat", type=float, default=1.0)
+    parser.add_argument("--global-por-segundo", type=float, default=25.0)
+    asyncio.run(_main(parser.parse_args()))
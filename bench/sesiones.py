@@ -0,0 +1,130 @@
+"""
+Memoria y coste de las sesiones de conversación (ver sesiones.py):
+- memoria por cada 10k sesiones a mitad de conversación: el dict de
+  user_data de antes frente a Sesion, y GestorSesiones completo (tracemalloc
+  y RSS del proceso);
+- obtener() con la sesión en memoria, y el flush agrupado a SQLite;
+- reinicio: se reabre la base y se comprueba que cada chat sigue en su paso.
+
+Uso:
+    python -m bench.sesiones --sesiones 10000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from sesiones import Estado, GestorSesiones, Sesion
+
+TIPOS = ["promo", "consejo", "noticia", "evento"]
+ESTADOS = [Estado.TEMA_POST, Estado.EJEMPLO, Estado.EDITAR_EJEMPLO, Estado.NINGUNO]
+# Los textos son los mismos objetos en los dos formatos: se mide lo que cuesta cada sesión
+POST = "Texto del último post presentado, compartido por todas las sesiones del bench."
+
+
+def _user_data(chat: int) -> dict:
+    """Lo que guardaba user_data en el mismo punto de la conversación."""
+    tipo = TIPOS[chat % len(TIPOS)]
+    return {
+        "tipo_post": tipo,
+        "esperando_post_tema": True,
+        "tipo_editar": tipo,
+        "filtro_ejemplos": "",
+        "ultimo_post": POST,
+        "ultimo_tipo_post": tipo,
+        "ultimo_tema": POST,
+        "ultimo_ejemplo_index": chat % 50,
+    }
+
+
+def _sesion(sesion: Sesion) -> Sesion:
+    tipo = TIPOS[sesion.chat % len(TIPOS)]
+    sesion.esperar(ESTADOS[sesion.chat % len(ESTADOS)], tipo_post=tipo, tipo_editar=tipo, id_ejemplo=sesion.chat % 50)
+    sesion.ultimo_post = sesion.ultimo_tema = POST
+    sesion.ultimo_tipo_post = tipo
+    sesion.ultimo_ejemplo = sesion.chat % 50
+    return sesion
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def _memoria(crear, n: int) -> tuple:
+    """Bytes por sesión según tracemalloc y MB de RSS por cada 10k sesiones."""
+    gc.collect()
+    rss = _rss_mb()
+    tracemalloc.start()
+    objetos = crear(n)
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = _rss_mb() - rss
+    del objetos
+    return actual / n, rss * 10000 / n
+
+
+def _gestor(n: int) -> GestorSesiones:
+    gestor = GestorSesiones(max_sesiones=n)
+    for chat in range(n):
+        _sesion(gestor.obtener(chat))
+    return gestor
+
+
+def main(args):
+    n = args.sesiones
+    print(f"Memoria, {n} sesiones a mitad de conversación:")
+    for nombre, crear in (
+        ("user_data (dict)", lambda n: [_user_data(chat) for chat in range(n)]),
+        ("Sesion (__slots__)", lambda n: [_sesion(Sesion(chat)) for chat in range(n)]),
+        ("GestorSesiones", _gestor),
+    ):
+        por_sesion, rss = _memoria(crear, n)
+        print(f"{nombre:>20}: {por_sesion:6.0f} B/sesión, {por_sesion * 10000 / 2**20:5.2f} MB por 10k "
+              f"(RSS {rss:5.2f} MB por 10k)")
+
+    gestor = _gestor(n)
+    chats = iter(list(range(n)) * 1000)
+    obtener = min(timeit.repeat(lambda: gestor.obtener(next(chats)), number=10000, repeat=5)) / 10000
+    print(f"obtener() en memoria: {obtener * 1e6:.2f} µs")
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "sesiones.db")
+        gestor = GestorSesiones(ruta, max_sesiones=n)
+
+        async def cambiar_todas() -> float:
+            # Dentro del event loop guardar() solo anota: se escriben todas en el flush
+            for chat in range(n):
+                gestor.guardar(_sesion(gestor.obtener(chat)))
+            inicio = time.perf_counter()
+            gestor.cerrar()
+            return time.perf_counter() - inicio
+
+        flush = asyncio.run(cambiar_todas())
+        print(f"flush de {n} sesiones en una transacción: {flush * 1000:.0f} ms "
+              f"({flush / n * 1e6:.1f} µs/sesión), {os.path.getsize(ruta) / n:.0f} B/sesión en disco")
+
+        # Un reinicio con memoria para la mitad: el resto se lee de SQLite al volver
+        gestor = GestorSesiones(ruta, max_sesiones=n // 2)
+
+        async def retomar_todas() -> tuple:
+            inicio = time.perf_counter()
+            retomadas = sum(gestor.obtener(chat).estado is ESTADOS[chat % len(ESTADOS)] for chat in range(n))
+            segundos = time.perf_counter() - inicio
+            # El acceso también se guarda (la sesión sigue activa), en el flush de cerrar()
+            gestor.cerrar()
+            return retomadas, segundos
+
+        retomadas, segundos = asyncio.run(retomar_todas())
+        print(f"tras reiniciar: {retomadas}/{n} conversaciones en su paso, "
+              f"{segundos / n * 1e6:.1f} µs por sesión leída; {gestor.estadisticas()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sesiones", type=int, default=10000)
+    main(parser.parse_args())
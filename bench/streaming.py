@@ -0,0 +1,70 @@
+"""
+Compara cuándo ve el usuario el primer texto con y sin streaming.
+Sin streaming el post aparece al terminar la completion; con streaming
+aparece con el primer fragmento (más, como mucho, el intervalo de edición del bot).
+
+Uso:
+    python -m bench.streaming --latencia 1 --latencia-token 0.03 --palabras 200
+"""
+import argparse
+import asyncio
+import time
+
+from bench.stub_llm import StubLLM
+from formato import cerrar_html_parcial
+from llm import ClienteLLM
+
+MENSAJES = [
+    {"role": "system", "content": "Habla como Stub."},
+    {"role": "user", "content": "Genera un post de prueba."},
+]
+
+
+async def _main(args):
+    texto = " ".join(f"<b>palabra {i}</b>" if i % 10 == 0 else f"palabra{i}" for i in range(args.palabras))
+    stub = StubLLM(latencia=args.latencia, latencia_token=args.latencia_token, texto=texto)
+    puerto = await stub.iniciar()
+    cliente = ClienteLLM(api_key="stub", base_url=f"http://127.0.0.1:{puerto}/v1")
+    try:
+        inicio = time.perf_counter()
+        await cliente.completar(MENSAJES, "stub")
+        completo = time.perf_counter() - inicio
+
+        parciales = []
+        primer = None
+        inicio = time.perf_counter()
+
+        def al_fragmento(fragmento):
+            nonlocal primer
+            if primer is None:
+                primer = time.perf_counter() - inicio
+            parciales.append(fragmento)
+
+        respuesta = await cliente.completar_stream(MENSAJES, "stub", al_fragmento)
+        total = time.perf_counter() - inicio
+    finally:
+        await cliente.cerrar()
+        await stub.detener()
+
+    # Coste de preparar cada edición intermedia (se hace como mucho una vez por intervalo)
+    acumulado = "".join(parciales)
+    inicio = time.perf_counter()
+    for _ in range(100):
+        cerrar_html_parcial(acumulado)
+    cierre = (time.perf_counter() - inicio) / 100
+
+    print(f"Sin streaming, post visible a los: {completo:.2f}s")
+    print(f"Con streaming, primer texto a los: {primer:.2f}s (+ hasta {args.intervalo:.1f}s de intervalo de edición)")
+    print(f"Con streaming, post completo a los: {total:.2f}s")
+    print(f"Fragmentos: {len(parciales)}, ediciones como máximo: {int(total / args.intervalo) + 1}")
+    print(f"cerrar_html_parcial sobre el post completo: {cierre * 1000:.3f} ms")
+    print(f"Tokens de respuesta: {respuesta.tokens_completion}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=1.0)
+    parser.add_argument("--latencia-token", type=float, default=0.03)
+    parser.add_argument("--palabras", type=int, default=200)
+    parser.add_argument("--intervalo", type=float, default=1.0)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,148 @@
+"""
+Servidor local que imita el endpoint /v1/chat/completions de OpenAI.
+Responde tras una latencia fija para medir el bot sin gastar tokens ni red.
+Con `latencia_token` cada palabra tarda además ese tiempo en "generarse"; con
+"stream": true se envían según se generan, como eventos SSE.
+Para probar la capa de resiliencia puede inyectar cola de latencia
+(`prob_lenta` de las respuestas tardan `latencia_lenta`) y errores 500
+(`prob_error`), de forma reproducible con `semilla`.
+
+Uso:
+    python -m bench.stub_llm --puerto 8089 --latencia 2
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python bot.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+class StubLLM:
+    def __init__(self, latencia: float = 1.0, texto: str = "<b>Post</b> de prueba generado por el stub.",
+                 latencia_token: float = 0.0, prob_lenta: float = 0.0, latencia_lenta: float = 10.0,
+                 prob_error: float = 0.0, semilla: int = None):
+        self.latencia = latencia
+        self.prob_lenta = prob_lenta
+        self.latencia_lenta = latencia_lenta
+        self.prob_error = prob_error
+        self.errores = 0
+        self._azar = random.Random(semilla)
+        self.latencia_token = latencia_token
+        self.texto = texto
+        self.peticiones = 0
+        self._servidor = None
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 0) -> int:
+        self._servidor = await asyncio.start_server(self._atender, host, puerto)
+        return self._servidor.sockets[0].getsockname()[1]
+
+    async def detener(self):
+        self._servidor.close()
+        await self._servidor.wait_closed()
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Conexiones keep-alive: se atienden peticiones hasta que el cliente cierre
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                cabeceras = {}
+                while True:
+                    cabecera = await reader.readline()
+                    if cabecera in (b"\r\n", b"\n", b""):
+                        break
+                    nombre, _, valor = cabecera.decode("latin-1").partition(":")
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+                cuerpo = await reader.readexactly(int(cabeceras.get("content-length", 0)))
+                self.peticiones += 1
+                await self._responder(writer, json.loads(cuerpo or b"{}"))
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _responder(self, writer: asyncio.StreamWriter, peticion: dict):
+        lenta = self._azar.random() < self.prob_lenta
+        await asyncio.sleep(self.latencia_lenta if lenta else self.latencia)
+        if self._azar.random() < self.prob_error:
+            self.errores += 1
+            cuerpo = json.dumps({"error": {"message": "stub: error inyectado", "type": "server_error"}}).encode()
+            writer.write(
+                b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(cuerpo)}\r\n\r\n".encode()
+                + cuerpo
+            )
+            await writer.drain()
+            return
+        if peticion.get("stream"):
+            await self._responder_stream(writer, peticion)
+            return
+        await asyncio.sleep(self.latencia_token * (len(self.texto.split(" ")) - 1))
+        cuerpo = json.dumps({
+            "id": f"chatcmpl-stub-{self.peticiones}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": peticion.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.texto},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+        }).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(cuerpo)}\r\n\r\n".encode()
+            + cuerpo
+        )
+        await writer.drain()
+
+    async def _responder_stream(self, writer: asyncio.StreamWriter, peticion: dict):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        base = {
+            "id": f"chatcmpl-stub-{self.peticiones}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": peticion.get("model", "stub"),
+        }
+        palabras = self.texto.split(" ")
+        for i, palabra in enumerate(palabras):
+            if i:
+                await asyncio.sleep(self.latencia_token)
+            delta = {"content": palabra if i == 0 else " " + palabra}
+            self._enviar_evento(writer, {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            await writer.drain()
+        self._enviar_evento(writer, {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if peticion.get("stream_options", {}).get("include_usage"):
+            uso = {"prompt_tokens": 100, "completion_tokens": len(palabras), "total_tokens": 100 + len(palabras)}
+            self._enviar_evento(writer, {**base, "choices": [], "usage": uso})
+        self._enviar_trozo(writer, b"data: [DONE]\n\n")
+        self._enviar_trozo(writer, b"")
+        await writer.drain()
+
+    def _enviar_evento(self, writer: asyncio.StreamWriter, evento: dict):
+        self._enviar_trozo(writer, b"data: " + json.dumps(evento).encode() + b"\n\n")
+
+    def _enviar_trozo(self, writer: asyncio.StreamWriter, datos: bytes):
+        writer.write(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+
+
+async def _main(args):
+    stub = StubLLM(latencia=args.latencia, latencia_token=args.latencia_token)
+    puerto = await stub.iniciar(args.host, args.puerto)
+    print(f"Stub LLM escuchando en http://{args.host}:{puerto}/v1 (latencia {args.latencia}s)")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia", type=float, default=1.0)
+    parser.add_argument("--latencia-token", type=float, default=0.0)
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
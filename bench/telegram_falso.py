@@ -0,0 +1,239 @@
+"""
+Servidor local que imita la Bot API de Telegram lo justo para medir el bot:
+getMe, getUpdates con long polling, setWebhook/deleteWebhook y respuestas
+genéricas al resto de métodos. También puede enviar updates sintéticos a un
+webhook, como haría Telegram, y simular el flood control: con `max_por_chat`
+responde 429 con retry_after a los sendMessage que superen ese ritmo por chat.
+Lo que el bot envía o edita en cada chat se puede esperar con `esperar`, para
+guionizar conversaciones enteras (ver bench/recorridos.py).
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+
+def update_sintetico(update_id: int, texto: str = "hola", chat_id: int = 1000) -> dict:
+    mensaje = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+        "text": texto,
+    }
+    if texto.startswith("/"):
+        # Sin esta entidad CommandHandler no lo reconoce como comando
+        mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto.split()[0])}]
+    return {"update_id": update_id, "message": mensaje}
+
+
+def callback_sintetico(update_id: int, data: str, chat_id: int = 1000) -> dict:
+    """Pulsación de un botón inline con `data` sobre un mensaje anterior del bot."""
+    usuario = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": usuario,
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "Bench"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                "text": "menú",
+            },
+        },
+    }
+
+
+class _Flood:
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+
+class TelegramFalso:
+    def __init__(self, max_por_chat: float = 0.0):
+        self.max_por_chat = max_por_chat
+        self.enviados = []
+        self.rechazos_429 = 0
+        self._ultimo_envio = {}
+        self.pendientes = []
+        self.llamadas = {}
+        self._hay_updates = asyncio.Event()
+        self._servidor = None
+        self._mensajes = 0
+        self._bandejas = {}
+        self._leidos = {}
+        self._avisos = {}
+        self._botones = {}
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 0) -> int:
+        self._servidor = await asyncio.start_server(self._atender, host, puerto)
+        return self._servidor.sockets[0].getsockname()[1]
+
+    async def detener(self):
+        self._servidor.close()
+        self._hay_updates.set()
+        await self._servidor.wait_closed()
+
+    def publicar(self, update: dict):
+        """Deja un update para el próximo getUpdates (modo polling)."""
+        self.pendientes.append(update)
+        self._hay_updates.set()
+
+    async def esperar(self, chat_id: int, contiene, timeout: float = 30.0) -> str:
+        """
+        Espera a que el bot envíe (o edite) en `chat_id` un texto que contenga
+        `contiene` (o alguna de las cadenas de una tupla) y lo devuelve. Los
+        textos anteriores a él ya no se vuelven a mirar.
+        """
+        opciones = (contiene,) if isinstance(contiene, str) else contiene
+        bandeja = self._bandejas.setdefault(chat_id, [])
+        aviso = self._avisos.setdefault(chat_id, asyncio.Event())
+        limite = time.monotonic() + timeout
+        while True:
+            for indice in range(self._leidos.get(chat_id, 0), len(bandeja)):
+                if any(opcion in bandeja[indice] for opcion in opciones):
+                    self._leidos[chat_id] = indice + 1
+                    return bandeja[indice]
+            aviso.clear()
+            await asyncio.wait_for(aviso.wait(), max(0.0, limite - time.monotonic()))
+
+    def boton(self, chat_id: int, prefijo: str) -> str:
+        """callback_data del primer botón que empieza por `prefijo` en el último teclado enviado al chat."""
+        return next(data for data in self._botones.get(chat_id, ()) if data.startswith(prefijo))
+
+    def olvidar(self, chat_id: int):
+        for registro in (self._bandejas, self._leidos, self._avisos, self._botones):
+            registro.pop(chat_id, None)
+
+    def _guardar_teclado(self, chat_id: int, reply_markup):
+        if not reply_markup:
+            return
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        botones = [
+            boton["callback_data"] for fila in reply_markup.get("inline_keyboard", ()) for boton in fila
+            if "callback_data" in boton
+        ]
+        if botones:
+            self._botones[chat_id] = botones
+
+    def _entregar(self, chat_id: int, texto: str):
+        self._bandejas.setdefault(chat_id, []).append(texto)
+        if chat_id in self._avisos:
+            self._avisos[chat_id].set()
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                ruta = linea.decode("latin-1").split(" ")[1]
+                cabeceras = {}
+                while True:
+                    cabecera = await reader.readline()
+                    if cabecera in (b"\r\n", b"\n", b""):
+                        break
+                    nombre, _, valor = cabecera.decode("latin-1").partition(":")
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+                cuerpo = await reader.readexactly(int(cabeceras.get("content-length", 0)))
+                if "json" in cabeceras.get("content-type", ""):
+                    parametros = json.loads(cuerpo or b"{}")
+                else:
+                    parametros = dict(parse_qsl(cuerpo.decode()))
+                metodo = urlsplit(ruta).path.rsplit("/", 1)[-1]
+                resultado = await self._resolver(metodo, parametros)
+                if isinstance(resultado, _Flood):
+                    estado = "429 Too Many Requests"
+                    respuesta = json.dumps({
+                        "ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {resultado.retry_after}",
+                        "parameters": {"retry_after": resultado.retry_after},
+                    }).encode()
+                else:
+                    estado = "200 OK"
+                    respuesta = json.dumps({"ok": True, "result": resultado}).encode()
+                writer.write(
+                    f"HTTP/1.1 {estado}\r\nContent-Type: application/json\r\n".encode()
+                    + f"Content-Length: {len(respuesta)}\r\n\r\n".encode()
+                    + respuesta
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _resolver(self, metodo: str, parametros: dict):
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+        if metodo == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if metodo == "getUpdates":
+            offset = int(parametros.get("offset", 0))
+            self.pendientes = [u for u in self.pendientes if u["update_id"] >= offset]
+            if not self.pendientes:
+                self._hay_updates.clear()
+                try:
+                    await asyncio.wait_for(self._hay_updates.wait(), float(parametros.get("timeout", 0)))
+                except asyncio.TimeoutError:
+                    pass
+            return self.pendientes[:int(parametros.get("limit", 100))]
+        if metodo == "sendMessage":
+            chat_id = int(parametros.get("chat_id", 0))
+            ahora = time.monotonic()
+            if self.max_por_chat and ahora - self._ultimo_envio.get(chat_id, -1e9) < 1 / self.max_por_chat:
+                self.rechazos_429 += 1
+                return _Flood(1)
+            self._ultimo_envio[chat_id] = ahora
+            self.enviados.append((ahora, chat_id, parametros.get("text", "")))
+            self._guardar_teclado(chat_id, parametros.get("reply_markup"))
+            self._entregar(chat_id, parametros.get("text", ""))
+            self._mensajes += 1
+            return {
+                "message_id": self._mensajes,
+                "date": int(time.time()),
+                "chat": {"id": int(parametros.get("chat_id", 0)), "type": "private"},
+                "text": parametros.get("text", ""),
+            }
+        if metodo == "editMessageText" and "chat_id" in parametros:
+            self._guardar_teclado(int(parametros["chat_id"]), parametros.get("reply_markup"))
+            self._entregar(int(parametros["chat_id"]), parametros.get("text", ""))
+        return True
+
+
+async def enviar_webhook(host: str, puerto: int, ruta: str, updates: list, conexiones: int = 8,
+                         secreto: str = None, al_enviar=None):
+    """
+    POSTea los updates al webhook repartidos en varias conexiones keep-alive.
+    `al_enviar(update)` se llama justo antes de escribir cada uno.
+    """
+    cola = asyncio.Queue()
+    for update in updates:
+        cola.put_nowait(update)
+
+    async def conexion():
+        reader, writer = await asyncio.open_connection(host, puerto)
+        try:
+            while not cola.empty():
+                update = cola.get_nowait()
+                cuerpo = json.dumps(update).encode()
+                cabeceras = f"POST {ruta} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                if secreto:
+                    cabeceras += f"X-Telegram-Bot-Api-Secret-Token: {secreto}\r\n"
+                if al_enviar is not None:
+                    al_enviar(update)
+                writer.write(cabeceras.encode() + f"Content-Length: {len(cuerpo)}\r\n\r\n".encode() + cuerpo)
+                await writer.drain()
+                estado = await reader.readline()
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                if b" 200 " not in estado:
+                    raise RuntimeError(f"El webhook respondió {estado!r}")
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(conexion() for _ in range(conexiones)))
@@ -0,0 +1,105 @@
+"""
+Compara la latencia de extremo a extremo de un update (desde que Telegram lo
+tiene hasta que llega al handler) y los updates por segundo en polling y en
+webhook, contra un Telegram falso local.
+
+Uso:
+    python -m bench.webhook --n 2000 --conexiones 8
+"""
+import argparse
+import asyncio
+import time
+
+from telegram.ext import Application, MessageHandler, filters
+
+from bench.telegram_falso import TelegramFalso, enviar_webhook, update_sintetico
+from webhook import ServidorWebhook
+
+
+class _Medidor:
+    def __init__(self, n: int):
+        self.n = n
+        self.enviados = {}
+        self.latencias = []
+        self.completo = asyncio.Event()
+
+    async def handler(self, update, context):
+        self.latencias.append(time.perf_counter() - self.enviados[update.update_id])
+        if len(self.latencias) == self.n:
+            self.completo.set()
+
+    def resumen(self, duracion: float) -> str:
+        latencias = sorted(self.latencias)
+        return (
+            f"{self.n / duracion:8.0f} updates/s, latencia p50 {latencias[len(latencias) // 2] * 1000:6.1f} ms, "
+            f"p99 {latencias[int(len(latencias) * 0.99)] * 1000:6.1f} ms"
+        )
+
+
+def _aplicacion(puerto_telegram: int, medidor: _Medidor) -> Application:
+    app = (
+        Application.builder()
+        .token("1:bench")
+        .base_url(f"http://127.0.0.1:{puerto_telegram}/bot")
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.ALL, medidor.handler))
+    return app
+
+
+async def _polling(args) -> str:
+    telegram = TelegramFalso()
+    puerto = await telegram.iniciar()
+    medidor = _Medidor(args.n)
+    app = _aplicacion(puerto, medidor)
+    async with app:
+        await app.start()
+        await app.updater.start_polling(poll_interval=0.0, timeout=10)
+        inicio = time.perf_counter()
+        for i in range(1, args.n + 1):
+            medidor.enviados[i] = time.perf_counter()
+            telegram.publicar(update_sintetico(i))
+            if i % args.rafaga == 0:
+                await asyncio.sleep(0)
+        await medidor.completo.wait()
+        duracion = time.perf_counter() - inicio
+        await app.updater.stop()
+        await app.stop()
+    await telegram.detener()
+    return medidor.resumen(duracion)
+
+
+async def _webhook(args) -> str:
+    telegram = TelegramFalso()
+    puerto = await telegram.iniciar()
+    medidor = _Medidor(args.n)
+    app = _aplicacion(puerto, medidor)
+    servidor = ServidorWebhook(app, secreto="bench")
+    async with app:
+        await app.start()
+        puerto_webhook = await servidor.iniciar("127.0.0.1", 0)
+        updates = [update_sintetico(i) for i in range(1, args.n + 1)]
+        inicio = time.perf_counter()
+        await enviar_webhook(
+            "127.0.0.1", puerto_webhook, "/telegram", updates, args.conexiones, secreto="bench",
+            al_enviar=lambda update: medidor.enviados.__setitem__(update["update_id"], time.perf_counter()),
+        )
+        await medidor.completo.wait()
+        duracion = time.perf_counter() - inicio
+        await servidor.detener()
+        await app.stop()
+    await telegram.detener()
+    return medidor.resumen(duracion)
+
+
+async def _main(args):
+    print(f"polling: {await _polling(args)}")
+    print(f"webhook: {await _webhook(args)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=2000)
+    parser.add_argument("--conexiones", type=int, default=8, help="conexiones paralelas del webhook")
+    parser.add_argument("--rafaga", type=int, default=1, help="updates publicados entre cada cesión del bucle en polling")
+    asyncio.run(_main(parser.parse_args()))
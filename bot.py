@@ -1,167 +1,403 @@
-import json
-import openai
-import os
+import asyncio
+import html
+import logging
 import random
-from dotenv import load_dotenv
+import sys
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     ContextTypes, filters
 )
-import logging
 
-# Configuración de logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+from ajustes import Ajustes
+from almacen import Almacen, AlmacenJSON, AlmacenSQLite
+from cache import CacheCompletions, clave_completion
+from candidatos import Candidato, GestorCandidatos
+from duplicados import IndiceDuplicados
+from enrutador import ejecutar_enrutador, es_mio
+from formato import convert_entities_to_html
+from generaciones import GeneracionesEnVuelo
+from llm import ErrorGeneracion
+from lotes import GestorLotes, leer_temas
+from metricas import Registro, ServidorMetricas
+from perezoso import Perezoso
+from perfilador import PerfiladorMuestreo
+from progresivo import EdicionesProgresivas
+from prompts import CompiladorPrompts
+from recuperacion import IndiceBM25
+from persistencia import DiarioConfig
+from planificador import ProcesadorPorChat
+from salida import DespachadorSalida
+from sesiones import Estado, GestorSesiones, Sesion
+from webhook import ejecutar_webhook
+
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno
-load_dotenv()
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not TELEGRAM_BOT_TOKEN or not OPENAI_API_KEY:
-    logger.error("Falta TELEGRAM_BOT_TOKEN u OPENAI_API_KEY")
-    exit(1)
-openai.api_key = OPENAI_API_KEY
+# Ajustes con los que se construyen los componentes; los fija create_app.
+# Todo lo que depende de ellos es Perezoso y se construye en su primer uso:
+# importar este módulo no lee config.json, no abre conexiones ni importa openai.
+ajustes = Ajustes()
 
-CONFIG_FILE = "config.json"
+# --- Cliente LLM: principal, respaldo opcional y capa de reintentos y hedging ---
+def crear_completador():
+    # resiliencia importa openai y httpx: se cargan con la primera completion
+    from llm import ClienteLLM
+    from resiliencia import Backend, ClienteResiliente
 
-# Funciones para cargar y guardar la configuración en JSON
-def cargar_config():
-    try:
-        with open(CONFIG_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {
-            "configuracion": {
-                "nombre": "",
-                "etiqueta": "",
-                "personalidad": "",
-                "servicios": [],
-                "idioma": ""
-            },
-            "tipos_de_post": {}
-        }
-
-def guardar_config(config):
-    with open(CONFIG_FILE, "w", encoding="utf-8") as file:
-        json.dump(config, file, indent=4, ensure_ascii=False)
-
-config = cargar_config()
-
-# --- Conversión de formato a HTML ---
-def utf16_offset_to_index(text: str, utf16_offset: int) -> int:
-    """
-    Convierte un offset (en UTF-16 code units) al índice correcto en la cadena de Python.
-    Telegram reporta los offsets basados en UTF-16.
-    """
-    count = 0
-    for i, ch in enumerate(text):
-        if ord(ch) >= 0x10000:
-            count += 2
-        else:
-            count += 1
-        if count >= utf16_offset:
-            return i + 1
-    return len(text)
+    def cliente(api_key: str, base_url: str) -> ClienteLLM:
+        return ClienteLLM(
+            api_key=api_key,
+            base_url=base_url,
+            max_concurrencia=ajustes.llm_max_concurrencia,
+            max_conexiones=ajustes.llm_max_conexiones,
+            timeout_peticion=ajustes.llm_timeout_peticion,
+            timeout_total=ajustes.llm_timeout_total,
+            max_reintentos=0,  # los reintentos los hace ClienteResiliente
+        )
 
-def convert_entities_to_html(message) -> str:
-    """
-    Reconstruye el texto formateado en HTML a partir de las entidades que envía Telegram.
-    Se ordenan las entidades (usando offsets convertidos) en orden inverso para no afectar los índices.
-    """
-    if not message.entities:
-        return message.text
-
-    text = message.text
-    # Ordenamos de menor a mayor (según índice convertido)
-    entities = sorted(message.entities, key=lambda ent: utf16_offset_to_index(text, ent.offset))
-    for ent in reversed(entities):
-        start = utf16_offset_to_index(text, ent.offset)
-        end = utf16_offset_to_index(text, ent.offset + ent.length)
-        substring = text[start:end]
-        if ent.type == "bold":
-            formatted = f"<b>{substring}</b>"
-        elif ent.type == "italic":
-            formatted = f"<i>{substring}</i>"
-        elif ent.type == "underline":
-            formatted = f"<u>{substring}</u>"
-        elif ent.type == "strikethrough":
-            formatted = f"<s>{substring}</s>"
-        elif ent.type == "code":
-            formatted = f"<code>{substring}</code>"
-        elif ent.type == "pre":
-            formatted = f"<pre>{substring}</pre>"
-        elif ent.type == "text_link":
-            formatted = f'<a href="{ent.url}">{substring}</a>'
+    respaldo = None
+    if ajustes.openai_model_respaldo:
+        respaldo = Backend(
+            "respaldo",
+            cliente(
+                ajustes.openai_api_key_respaldo or ajustes.openai_api_key,
+                ajustes.openai_base_url_respaldo or ajustes.openai_base_url,
+            ),
+            ajustes.openai_model_respaldo,
+        )
+    return ClienteResiliente(
+        Backend("principal", cliente(ajustes.openai_api_key, ajustes.openai_base_url), ajustes.openai_model),
+        respaldo,
+        reintentos=ajustes.llm_reintentos,
+        percentil_cobertura=ajustes.llm_percentil_cobertura,
+        max_coberturas=ajustes.llm_max_coberturas,
+        fallos_para_abrir=ajustes.llm_fallos_circuito,
+        enfriamiento=ajustes.llm_enfriamiento_circuito,
+    )
+
+completador = Perezoso(crear_completador)
+
+# --- Métricas: histogramas de handlers y del modelo, más las estadísticas de cada componente ---
+# METRICAS_PUERTO expone /metrics (Prometheus); PERFILADOR=1 habilita /perfil y el comando /perfil
+metricas = Registro()
+perfilador = PerfiladorMuestreo()
+servidor_metricas = Perezoso(lambda: ServidorMetricas(metricas, perfilador if ajustes.perfilador else None))
+
+def estadisticas_de(componente: Perezoso):
+    """Colector que no construye el componente solo para leer sus estadísticas."""
+    return lambda: componente.estadisticas() if componente.creado else {}
+
+# Índices en memoria de los ejemplos de cada tipo de post:
+# - duplicados exactos y casi idénticos (UMBRAL_SIMILITUD: Jaccard estimada)
+# - BM25 para elegir los ejemplos más relevantes para el tema
+# Los dos van por el ID estable de cada ejemplo, así que borrar uno no mueve a los demás.
+indice_duplicados = Perezoso(lambda: IndiceDuplicados(umbral=ajustes.umbral_similitud))
+indice_ejemplos = Perezoso(IndiceBM25)
+indices_ejemplos = (indice_duplicados, indice_ejemplos)
+
+def actualizar_indices(metodo: str, *args):
+    for indice in indices_ejemplos:
+        getattr(indice, metodo)(*args)
+
+def reconstruir_indices(tipo: str):
+    actualizar_indices("reconstruir", tipo, almacen.ejemplos_con_id(tipo))
+
+# Almacenamiento de la configuración: "json" (config.json + diario de cambios, por
+# defecto) o "sqlite" (ALMACEN_SQLITE, que migra config.json la primera vez).
+def cargar_config() -> Almacen:
+    if ajustes.almacen == "sqlite":
+        almacen = AlmacenSQLite(ajustes.almacen_sqlite)
+        almacen.migrar_desde_json(ajustes.config_file)
+    else:
+        almacen = AlmacenJSON(DiarioConfig(
+            ajustes.config_file,
+            intervalo_flush=ajustes.config_intervalo_flush,
+            compactar_cada=ajustes.config_compactar_cada,
+        ))
+    almacen.observar_escrituras(
+        lambda operacion, segundos: metricas.histograma(
+            "config_escritura_segundos", "Duración de las escrituras de la configuración a disco", operacion=operacion
+        ).observar(segundos)
+    )
+    # Con el almacén local: el global aún se está construyendo
+    for tipo in almacen.tipos():
+        actualizar_indices("reconstruir", tipo, almacen.ejemplos_con_id(tipo))
+    return almacen
+
+almacen = Perezoso(cargar_config)
+
+def sincronizar_indices():
+    """Con varios trabajadores, lleva a los índices las escrituras que hicieron los demás."""
+    for tipo, ids in almacen.sincronizar().items():
+        if not almacen.existe_tipo(tipo):
+            actualizar_indices("eliminar_tipo", tipo)
+        elif ids is None:
+            reconstruir_indices(tipo)
         else:
-            formatted = substring
-        text = text[:start] + formatted + text[end:]
-    return text
+            # Solo los ejemplos escritos: se quitan y se vuelven a indexar si siguen ahí
+            for id_ejemplo in ids:
+                actualizar_indices("quitar", tipo, id_ejemplo)
+                try:
+                    texto = almacen.ejemplo_por_id(tipo, id_ejemplo)
+                except IndexError:
+                    continue
+                actualizar_indices("agregar", tipo, id_ejemplo, texto)
+
+# Con updates concurrentes, las operaciones que leen y luego escriben el almacén
+# (comprobar duplicados y agregar, recalcular y borrar...) se hacen bajo este bloqueo
+bloqueo_config = asyncio.Lock()
 
+# --- Conversión de formato a HTML (ver formato.py) ---
 def process_example_text(text: str) -> str:
     """
     Si el texto no tiene entidades, se asume que ya tiene el formato deseado (HTML) o se guarda tal cual.
     """
     return text
 
+# --- Mensajes salientes: se encolan y se envían respetando los límites de Telegram ---
+despachador = Perezoso(lambda: DespachadorSalida(
+    por_segundo=ajustes.salida_por_segundo,
+    por_chat=ajustes.salida_por_chat,
+    rafaga_chat=ajustes.salida_rafaga_chat,
+))
+
+def responder(update: Update, texto: str, reply_markup=None, fusionable: bool = True):
+    """Encola un mensaje HTML para el chat del update. Devuelve un futuro con el Message."""
+    return despachador.enviar(update.effective_chat.id, texto, reply_markup=reply_markup, fusionable=fusionable)
+
+def editar_mensaje(mensaje, texto: str, reply_markup=None):
+    """Encola la edición de un mensaje ya enviado; también pasa por el despachador."""
+    return despachador.editar(mensaje.chat_id, mensaje.message_id, texto, reply_markup=reply_markup)
+
+# --- Generación en lote ---
+gestor_lotes = Perezoso(lambda: GestorLotes(
+    directorio=ajustes.lotes_directorio,
+    concurrencia=ajustes.lote_concurrencia,
+))
+tareas_lotes = set()
+
+def texto_progreso(lote) -> str:
+    texto = f"📦 Generando {len(lote.temas)} posts de '{lote.tipo_post}': {lote.completados}/{len(lote.temas)}"
+    if lote.errores:
+        texto += f" ({lote.errores} con error)"
+    return texto
+
+async def iniciar_lote(update: Update, context: ContextTypes.DEFAULT_TYPE, tipo_post: str, temas: list):
+    if not temas:
+        responder(update, "No encontré ningún tema. Envía un tema por línea o un CSV con los temas en la primera columna.")
+        return
+    if not almacen.contar_ejemplos(tipo_post):
+        responder(update, "No hay ejemplos en esta categoría. Agrega algunos antes de generar un post.")
+        return
+    lote = gestor_lotes.crear(update.effective_chat.id, tipo_post, temas)
+    mensaje = await responder(update, texto_progreso(lote), fusionable=False)
+    lote.mensaje_id = mensaje.message_id
+    await gestor_lotes.guardar(lote)
+    lanzar_lote(lote)
+
+def lanzar_lote(lote):
+    # El lote corre en segundo plano para no bloquear el resto de updates del chat
+    tarea = asyncio.create_task(ejecutar_lote(lote))
+    tareas_lotes.add(tarea)
+    tarea.add_done_callback(tareas_lotes.discard)
+
+async def ejecutar_lote(lote):
+    ultimo_progreso = 0.0
+
+    async def generar(tema: str) -> str:
+        if not almacen.existe_tipo(lote.tipo_post) or not almacen.contar_ejemplos(lote.tipo_post):
+            raise ValueError(f"El tipo de post '{lote.tipo_post}' ya no tiene ejemplos")
+        return await generar_texto(lote.tipo_post, tema, elegir_ejemplo(lote.tipo_post, tema))
+
+    async def al_progreso(lote):
+        nonlocal ultimo_progreso
+        if lote.mensaje_id is None or time.monotonic() - ultimo_progreso < ajustes.lote_intervalo_progreso:
+            return
+        ultimo_progreso = time.monotonic()
+        try:
+            await despachador.editar(lote.chat_id, lote.mensaje_id, texto_progreso(lote), parse_mode=None)
+        except Exception as e:
+            logger.debug("No se pudo actualizar el progreso del lote %s: %s", lote.id, e)
+
+    try:
+        await gestor_lotes.ejecutar(lote, generar, al_progreso)
+        resumen = (
+            f"✅ Lote terminado: {lote.completados - lote.errores} posts, {lote.errores} errores. "
+            f"Tiempo: {lote.segundos:.0f}s (uno a uno habrían sido ~{lote.segundos_en_serie:.0f}s)."
+        )
+        if lote.mensaje_id is not None:
+            await despachador.editar(lote.chat_id, lote.mensaje_id, resumen, parse_mode=None)
+        if ajustes.lote_formato == "json":
+            documento, nombre = gestor_lotes.documento_json(lote), f"posts_{lote.id}.json"
+        else:
+            documento, nombre = gestor_lotes.documento_html(lote), f"posts_{lote.id}.html"
+        await despachador.enviar_documento(lote.chat_id, documento, nombre)
+        gestor_lotes.borrar(lote)
+        logger.info("Lote %s: %d filas en %.1fs (en serie %.1fs)", lote.id, len(lote.temas), lote.segundos, lote.segundos_en_serie)
+    except asyncio.CancelledError:
+        # Al apagar se deja el lote en disco para retomarlo en el siguiente arranque
+        raise
+    except Exception as e:
+        logger.error("Error en el lote %s: %s", lote.id, e)
+
+# --- Estado de las conversaciones ---
+# Una Sesion por chat (ver sesiones.py). Los updates de un chat se procesan uno
+# detrás de otro y, con varios trabajadores, siempre en el mismo proceso, así
+# que la sesión en memoria es la buena; SQLite solo sirve para retomarla
+sesiones = Perezoso(lambda: GestorSesiones(
+    ajustes.sesiones_sqlite,
+    max_sesiones=ajustes.sesiones_max,
+    ttl=ajustes.sesiones_ttl,
+))
+
+def sesion_de(update: Update) -> Sesion:
+    chat = update.effective_chat or update.effective_user
+    return sesiones.obtener(chat.id)
+
+def con_estado_compartido(handler):
+    """Envuelve un handler para trabajar con la configuración al día y guardar su sesión."""
+    async def envoltorio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        sincronizar_indices()
+        # sesion_de() ya la anota para el próximo flush; se vuelve a anotar al terminar
+        # (sin comparar) por si el flush llegó mientras el handler esperaba algo
+        sesion = sesion_de(update)
+        try:
+            return await handler(update, context)
+        finally:
+            sesiones.guardar(sesion)
+    return envoltorio
+
 # --- Flujo de configuración inicial ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not config["configuracion"]["nombre"]:
-        await update.message.reply_text(
-            "¡Hola! Vamos a configurar tu bot.\nPrimero, ¿cómo se llama tu personaje?",
-            parse_mode="HTML"
-        )
-        context.user_data["esperando_nombre"] = True
+    if not almacen.configuracion()["nombre"]:
+        responder(update, "¡Hola! Vamos a configurar tu bot.\nPrimero, ¿cómo se llama tu personaje?")
+        sesion_de(update).esperar(Estado.NOMBRE)
     else:
-        await update.message.reply_text("La configuración ya existe. Usa /menu para ver las opciones.", parse_mode="HTML")
+        responder(update, "La configuración ya existe. Usa /menu para ver las opciones.")
 
 # --- Generación de Post con ChatGPT ---
-async def generate_post(tipo_post: str, tema: str, idioma: str, previous_index: int = None):
-    ejemplos = config["tipos_de_post"][tipo_post]["ejemplos"]
-    if not ejemplos:
+estadisticas_posts = {"creados": 0, "reescrituras": 0}
+
+def estadisticas_de_posts() -> dict:
+    """Posts creados, reescrituras y su tasa, para comparar los modos de selección."""
+    creados = estadisticas_posts["creados"]
+    return {**estadisticas_posts, "tasa_reescritura": estadisticas_posts["reescrituras"] / creados if creados else 0.0}
+
+def elegir_ejemplo(tipo_post: str, tema: str, excluir=()) -> int:
+    """
+    ID de un ejemplo elegido al azar entre los RECUPERACION_TOP_K más relevantes para
+    el tema (sin repetir los de `excluir`); si ninguno comparte términos, entre todos.
+    """
+    if ajustes.seleccion_ejemplos == "bm25":
+        mejores = indice_ejemplos.mejores(tipo_post, tema, ajustes.recuperacion_top_k, excluir)
+        if mejores:
+            return random.choice(mejores)[0]
+    ids = almacen.ids_ejemplos(tipo_post)
+    disponibles = [i for i in ids if i not in excluir]
+    return random.choice(disponibles or ids)
+
+# Plantillas de prompt y presupuesto de tokens para los ejemplos
+compilador_prompts = Perezoso(lambda: CompiladorPrompts(
+    ajustes.openai_model,
+    presupuesto_ejemplos=ajustes.prompt_presupuesto_ejemplos,
+    max_ejemplos=ajustes.prompt_max_ejemplos,
+))
+
+def construir_mensajes(tipo_post: str, tema: str, elegido: int) -> list:
+    ejemplos = [almacen.ejemplo_por_id(tipo_post, elegido)]
+    if compilador_prompts.max_ejemplos > 1:
+        extra = indice_ejemplos.mejores(tipo_post, tema, compilador_prompts.max_ejemplos - 1, excluir={elegido})
+        ejemplos += [almacen.ejemplo_por_id(tipo_post, clave) for clave, _ in extra]
+    return compilador_prompts.mensajes(almacen.configuracion(), tema, ejemplos)
+
+async def completar_llm(mensajes: list, al_fragmento=None):
+    kwargs = {"max_tokens": ajustes.llm_max_tokens_respuesta} if ajustes.llm_max_tokens_respuesta else {}
+    modo = "stream" if al_fragmento is not None else "completo"
+    with metricas.medir("llm_segundos", "Duración de las llamadas al modelo, reintentos incluidos", modo=modo):
+        if al_fragmento is not None:
+            respuesta = await completador.completar_stream(mensajes, al_fragmento, **kwargs)
+        else:
+            respuesta = await completador.completar(mensajes, **kwargs)
+    compilador_prompts.registrar_uso(respuesta.tokens_prompt, respuesta.tokens_completion)
+    metricas.contador("llm_tokens_total", "Tokens consumidos", tipo="prompt").sumar(respuesta.tokens_prompt)
+    metricas.contador("llm_tokens_total", "Tokens consumidos", tipo="completion").sumar(respuesta.tokens_completion)
+    return respuesta
+
+# Caché de completions. CACHE_DISCO activa la capa persistente en SQLite
+cache_completions = Perezoso(lambda: CacheCompletions(
+    max_entradas=ajustes.cache_max_entradas,
+    ttl=ajustes.cache_ttl,
+    ruta_disco=ajustes.cache_disco,
+))
+
+async def completar_con_cache(mensajes: list, al_fragmento=None):
+    clave = clave_completion(ajustes.openai_model, mensajes)
+    respuesta = await cache_completions.obtener(clave)
+    if respuesta is None:
+        respuesta = await completar_llm(mensajes, al_fragmento)
+        await cache_completions.guardar(clave, respuesta)
+    return respuesta
+
+async def generar_texto(tipo_post: str, tema: str, elegido: int, reescritura: bool = False, al_fragmento=None) -> str:
+    mensajes = construir_mensajes(tipo_post, tema, elegido)
+    # Una reescritura pide explícitamente un texto nuevo: no pasa por la caché
+    if not reescritura:
+        respuesta = await completar_con_cache(mensajes, al_fragmento)
+    else:
+        respuesta = await completar_llm(mensajes, al_fragmento)
+    return respuesta.texto
+
+async def generate_post(tipo_post: str, tema: str, idioma: str, previous_index: int = None, al_fragmento=None):
+    if not almacen.contar_ejemplos(tipo_post):
         return None, None
 
-    indices_disponibles = list(range(len(ejemplos)))
-    if previous_index is not None and len(ejemplos) > 1:
-        indices_disponibles = [i for i in indices_disponibles if i != previous_index]
-    elegido = random.choice(indices_disponibles)
-    ejemplo_text = ejemplos[elegido]
-
-    prompt = (
-    f"Genera un post para Telegram en {config['configuracion']['idioma']} utilizando HTML para el formato "
-    f"(por ejemplo, <b> para negrita, <i> para cursiva, <u> para subrayado, etc.).\n"
-    f"El post debe inspirarse en el siguiente ejemplo para mantener un estilo y extensión similares, "
-    f"pero el contenido final debe ser 100% original y adaptado a la idea principal que se proporciona a continuación.\n\n"
-    f"Idea principal (interpreta y corrige posibles errores ortográficos o de redacción):\n\"{tema}\"\n\n"
-    f"Ejemplo (solo para inspirarte en el formato y la extensión):\n{ejemplo_text}\n\n"
-    f"Utiliza internamente los siguientes datos para adaptar el tono y estilo, pero no los muestres directamente en el resultado final:\n"
-    f"- Personalidad del personaje: {config['configuracion']['personalidad']}\n"
-    f"- Servicios o productos que ofrece: {', '.join(config['configuracion']['servicios'])}\n\n"
-    f"En el post, incorpora de forma natural la etiqueta \"{config['configuracion']['etiqueta']}\" en el llamado a la acción (CTA), "
-    f"asegurándote de que el CTA sea breve.\n\n"
-    f"⚠️ **Importante:** Redacta únicamente el contenido final del post para Telegram, sin encabezados ni detalles internos "
-    f"(no incluyas palabras como 'Idea principal:', 'Ejemplo:', 'Personalidad:' o 'Servicios:'). No uses hashtags ni puntos finales innecesarios. "
-    f"El post debe basarse en la idea proporcionada, interpretándola de forma coherente (por ejemplo, si la idea es 'Hoy ganaremos', "
-    f"el texto debe transmitir que 'hoy se ganará')."
+    excluir = () if previous_index is None else (previous_index,)
+    elegido = elegir_ejemplo(tipo_post, tema, excluir)
+    # Si falla, ErrorGeneracion llega hasta quien la muestra; nunca se presenta como post
+    with metricas.medir("generate_post_segundos", "Duración de generate_post, de la elección del ejemplo al texto"):
+        texto = await generar_texto(tipo_post, tema, elegido, previous_index is not None, al_fragmento)
+    return texto, elegido
+
+# --- Pregeneración de candidatos para "Reescribir" ---
+candidatos = Perezoso(lambda: GestorCandidatos(
+    tamano=ajustes.candidatos_k,
+    ttl=ajustes.candidatos_ttl,
+    max_concurrencia=ajustes.candidatos_max_concurrencia,
+))
+
+def precargar_candidatos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    sesion = sesion_de(update)
+    tipo_post = sesion.ultimo_tipo_post
+    tema = sesion.ultimo_tema
+    if not almacen.existe_tipo(tipo_post) or not almacen.contar_ejemplos(tipo_post):
+        return
+    mostrado = sesion.ultimo_ejemplo
+
+    async def generar(id_ejemplo: int) -> Candidato:
+        respuesta = await completar_llm(construir_mensajes(tipo_post, tema, id_ejemplo))
+        return Candidato(respuesta.texto, id_ejemplo, respuesta.tokens_prompt + respuesta.tokens_completion)
+
+    candidatos.precargar(
+        update.effective_chat.id,
+        (tipo_post, tema),
+        generar,
+        lambda usados: elegir_ejemplo(tipo_post, tema, usados | {mostrado}),
+    )
+
+# --- Generación en streaming con ediciones progresivas ---
+ediciones = Perezoso(lambda: EdicionesProgresivas(intervalo=ajustes.streaming_intervalo))
+
+async def iniciar_editor(update: Update):
+    """Con STREAMING activo responde al momento con un marcador que se irá editando."""
+    if not ajustes.streaming:
+        return None
+    return await ediciones.iniciar(
+        lambda texto, reply_markup=None: responder(update, texto, reply_markup=reply_markup, fusionable=False),
+        editar_mensaje,
     )
-    
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": f"Habla como {config['configuracion']['nombre']}. No incluyas datos internos; responde solo con el contenido final del post."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        post_text = response["choices"][0]["message"]["content"].strip()
-        return post_text, elegido
-    except Exception as e:
-        return f"Ocurrió un error al generar el post: {e}", elegido
 
-async def presentar_post(update: Update, context: ContextTypes.DEFAULT_TYPE, post_text: str):
+async def presentar_post(update: Update, context: ContextTypes.DEFAULT_TYPE, post_text: str, editor=None):
     keyboard = [
         [
             InlineKeyboardButton("✅ Aceptar", callback_data="aceptar_post"),
@@ -169,169 +405,244 @@ async def presentar_post(update: Update, context: ContextTypes.DEFAULT_TYPE, pos
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.effective_message.reply_text(post_text, reply_markup=reply_markup, parse_mode="HTML")
+    if editor is not None:
+        await editor.finalizar(post_text, reply_markup=reply_markup)
+    else:
+        responder(update, post_text, reply_markup=reply_markup)
+    # Mientras el usuario lee el post se preparan las siguientes reescrituras
+    precargar_candidatos(update, context)
+
+# --- Generaciones en segundo plano: una por chat, las idénticas se unen y las nuevas sustituyen ---
+generaciones = GeneracionesEnVuelo()
+
+def lanzar_generacion(update: Update, context: ContextTypes.DEFAULT_TYPE, clave: tuple, generar, al_presentar):
+    """
+    Lanza `await generar(iniciar)`, que devuelve (post, índice de ejemplo), y
+    presenta el resultado si nadie la ha sustituido, después de anotarlo en
+    la sesión con `al_presentar(sesion, post, índice)`. `iniciar()` crea el
+    editor progresivo, solo cuando de verdad se va a llamar al modelo.
+    Si la generación falla, el usuario recibe un aviso en lugar del post.
+    """
+    vuelo = {"editor": None}
+
+    async def iniciar():
+        vuelo["editor"] = await iniciar_editor(update)
+        return vuelo["editor"]
+
+    async def generar_o_error():
+        try:
+            return await generar(iniciar)
+        except ErrorGeneracion as e:
+            logger.warning("No se pudo generar el post: %s", e)
+            return e
+        except Exception as e:
+            # P. ej. otro chat borró o renombró el tipo de post a mitad: también recibe el aviso
+            logger.exception("Error inesperado generando el post")
+            return ErrorGeneracion(str(e))
+
+    async def presentar(resultado):
+        editor = vuelo["editor"]
+        if isinstance(resultado, ErrorGeneracion) or resultado[0] is None:
+            if isinstance(resultado, ErrorGeneracion):
+                aviso = "⚠️ No se pudo generar el post ahora mismo. Inténtalo de nuevo en unos segundos."
+            else:
+                aviso = "No hay ejemplos en esta categoría. Agrega algunos antes de generar un post."
+            if editor is not None:
+                await editor.finalizar(aviso)
+            else:
+                responder(update, aviso)
+            return
+        post_text, id_ejemplo = resultado
+        # Termina después del handler que la lanzó: la sesión se guarda aquí
+        sesion = sesion_de(update)
+        al_presentar(sesion, post_text, id_ejemplo)
+        sesiones.guardar(sesion)
+        await presentar_post(update, context, post_text, editor)
+
+    async def al_cancelar():
+        if vuelo["editor"] is not None:
+            await vuelo["editor"].cancelar("⏹️ Sustituido por una petición más reciente.")
+
+    generaciones.lanzar(update.effective_chat.id, clave, generar_o_error, presentar, al_cancelar)
 
 # --- Manejo de mensajes según el estado ---
 async def recibir_mensaje(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
+    sesion = sesion_de(update)
+    estado = sesion.estado
 
-    # Si se espera el tema para generar el post, tiene prioridad
-    if context.user_data.get("esperando_post_tema"):
-        tipo_post = context.user_data.get("tipo_post")
+    # Si se espera el tema para generar el post
+    if estado is Estado.TEMA_POST:
+        tipo_post = sesion.tipo_post
         tema = text
-        idioma = config["configuracion"].get("idioma", "Español")
-        context.user_data.pop("esperando_post_tema")
-        context.user_data.pop("esperando_ejemplo", None)
+        idioma = almacen.configuracion().get("idioma", "Español")
+        sesion.terminar()
+        candidatos.cancelar(update.effective_chat.id)
 
-        post_text, indice_ejemplo = await generate_post(tipo_post, tema, idioma)
-        if post_text is None:
-            await update.message.reply_text("No hay ejemplos en esta categoría. Agrega algunos antes de generar un post.", parse_mode="HTML")
-            return
-        context.user_data["ultimo_tipo_post"] = tipo_post
-        context.user_data["ultimo_tema"] = tema
-        context.user_data["ultimo_ejemplo_index"] = indice_ejemplo
-        context.user_data["ultimo_post"] = post_text
-        await presentar_post(update, context, post_text)
+        async def generar(iniciar):
+            editor = await iniciar()
+            return await generate_post(tipo_post, tema, idioma, al_fragmento=editor.agregar if editor else None)
+
+        def al_presentar(sesion, post_text, id_ejemplo):
+            estadisticas_posts["creados"] += 1
+            sesion.ultimo_tipo_post = tipo_post
+            sesion.ultimo_tema = tema
+            sesion.ultimo_ejemplo = id_ejemplo
+            sesion.ultimo_post = post_text
+
+        lanzar_generacion(update, context, ("crear", tipo_post, tema), generar, al_presentar)
+        return
+
+    if estado is Estado.TEMAS_LOTE:
+        tipo_post = sesion.tipo_post
+        sesion.terminar()
+        await iniciar_lote(update, context, tipo_post, leer_temas(update.message.text))
         return
 
     # Si se espera un ejemplo para agregar
-    if context.user_data.get("esperando_ejemplo"):
-        tipo_post = context.user_data.get("tipo_post")
+    if estado is Estado.EJEMPLO:
+        tipo_post = sesion.tipo_post
+        sesion.terminar()
         if not tipo_post:
-            await update.message.reply_text("Error: No se ha seleccionado un tipo de post.", parse_mode="HTML")
-            context.user_data.pop("esperando_ejemplo", None)
+            responder(update, "Error: No se ha seleccionado un tipo de post.")
             return
         if update.message.entities:
             processed_text = convert_entities_to_html(update.message)
         else:
             processed_text = process_example_text(text)
-        if processed_text in config["tipos_de_post"][tipo_post]["ejemplos"]:
-            await update.message.reply_text("Este ejemplo ya existe. No se ha agregado duplicado.", parse_mode="HTML")
-            context.user_data.pop("esperando_ejemplo", None)
+        async with bloqueo_config:
+            # Exacto es el mismo texto normalizado (lo busca el índice, sin recorrer los
+            # ejemplos); una similitud estimada de 1.0 no basta
+            exacto = indice_duplicados.exacto(tipo_post, processed_text) is not None
+            duplicado = None if exacto else indice_duplicados.buscar(tipo_post, processed_text)
+            if duplicado:
+                numero = almacen.posicion_ejemplo(tipo_post, duplicado[0]) + 1
+            elif not exacto:
+                id_ejemplo = almacen.agregar_ejemplo(tipo_post, processed_text)
+                actualizar_indices("agregar", tipo_post, id_ejemplo, processed_text)
+        if exacto:
+            responder(update, "Este ejemplo ya existe. No se ha agregado duplicado.")
+            return
+        if duplicado:
+            responder(
+                update,
+                f"Este ejemplo es casi idéntico al ejemplo {numero} ({duplicado[1]:.0%} de similitud). No se ha agregado.",
+            )
             return
-        config["tipos_de_post"][tipo_post]["ejemplos"].append(processed_text)
-        guardar_config(config)
-        await update.message.reply_text(f"Ejemplo agregado al tipo de post '{tipo_post}'.", parse_mode="HTML")
-        context.user_data.pop("esperando_ejemplo", None)
+        responder(update, f"Ejemplo agregado al tipo de post '{tipo_post}'.")
         return
 
     # Flujo de configuración del personaje
-    if context.user_data.get("esperando_nombre"):
-        config["configuracion"]["nombre"] = text
-        guardar_config(config)
-        context.user_data.pop("esperando_nombre")
-        await update.message.reply_text("Perfecto. Ahora ingresa la etiqueta (ejemplo: @ejemplo):", parse_mode="HTML")
-        context.user_data["esperando_etiqueta"] = True
+    if estado is Estado.NOMBRE:
+        almacen.actualizar_configuracion("nombre", text)
+        responder(update, "Perfecto. Ahora ingresa la etiqueta (ejemplo: @ejemplo):")
+        sesion.esperar(Estado.ETIQUETA)
         return
 
-    if context.user_data.get("esperando_etiqueta"):
-        config["configuracion"]["etiqueta"] = text
-        guardar_config(config)
-        context.user_data.pop("esperando_etiqueta")
-        await update.message.reply_text("Muy bien. Escribe una breve descripción de la personalidad del personaje:", parse_mode="HTML")
-        context.user_data["esperando_personalidad"] = True
+    if estado is Estado.ETIQUETA:
+        almacen.actualizar_configuracion("etiqueta", text)
+        responder(update, "Muy bien. Escribe una breve descripción de la personalidad del personaje:")
+        sesion.esperar(Estado.PERSONALIDAD)
         return
 
-    if context.user_data.get("esperando_personalidad"):
-        config["configuracion"]["personalidad"] = text
-        guardar_config(config)
-        context.user_data.pop("esperando_personalidad")
-        await update.message.reply_text("Por último, ingresa los servicios o productos que ofrece (separados por comas):", parse_mode="HTML")
-        context.user_data["esperando_servicios"] = True
+    if estado is Estado.PERSONALIDAD:
+        almacen.actualizar_configuracion("personalidad", text)
+        responder(update, "Por último, ingresa los servicios o productos que ofrece (separados por comas):")
+        sesion.esperar(Estado.SERVICIOS)
         return
 
-    if context.user_data.get("esperando_servicios"):
+    if estado is Estado.SERVICIOS:
         servicios = [s.strip() for s in text.split(",") if s.strip()]
-        config["configuracion"]["servicios"] = servicios
-        guardar_config(config)
-        context.user_data.pop("esperando_servicios")
-        await update.message.reply_text("Ahora, ingresa el idioma en el que deseas redactar los posts (ejemplo: Español, Inglés, etc.):", parse_mode="HTML")
-        context.user_data["esperando_idioma"] = True
+        almacen.actualizar_configuracion("servicios", servicios)
+        responder(update, "Ahora, ingresa el idioma en el que deseas redactar los posts (ejemplo: Español, Inglés, etc.):")
+        sesion.esperar(Estado.IDIOMA)
         return
 
-    if context.user_data.get("esperando_idioma"):
-        config["configuracion"]["idioma"] = text
-        guardar_config(config)
-        context.user_data.pop("esperando_idioma")
-        await update.message.reply_text("¡Configuración completada! Usa /menu para ver las opciones.", parse_mode="HTML")
+    if estado is Estado.IDIOMA:
+        almacen.actualizar_configuracion("idioma", text)
+        sesion.terminar()
+        responder(update, "¡Configuración completada! Usa /menu para ver las opciones.")
         return
 
     # Agregar Tipo de Post
-    if context.user_data.get("esperando_tipo_post"):
+    if estado is Estado.NUEVO_TIPO:
         tipo_post = text.lower()
-        if tipo_post in config["tipos_de_post"]:
-            await update.message.reply_text("Ese tipo de post ya existe. Prueba con otro nombre.", parse_mode="HTML")
+        if almacen.existe_tipo(tipo_post):
+            responder(update, "Ese tipo de post ya existe. Prueba con otro nombre.")
             return
-        config["tipos_de_post"][tipo_post] = {"ejemplos": []}
-        guardar_config(config)
-        context.user_data.pop("esperando_tipo_post")
-        await update.message.reply_text(f"Tipo de post '{tipo_post}' agregado correctamente.", parse_mode="HTML")
+        almacen.crear_tipo(tipo_post)
+        sesion.terminar()
+        responder(update, f"Tipo de post '{tipo_post}' agregado correctamente.")
         return
 
     # Edición de la configuración del personaje
-    if context.user_data.get("edit_nombre"):
-        config["configuracion"]["nombre"] = text
-        guardar_config(config)
-        context.user_data.pop("edit_nombre")
-        await update.message.reply_text("Nombre actualizado.", parse_mode="HTML")
+    if estado is Estado.EDITAR_NOMBRE:
+        almacen.actualizar_configuracion("nombre", text)
+        sesion.terminar()
+        responder(update, "Nombre actualizado.")
         return
 
-    if context.user_data.get("edit_etiqueta"):
-        config["configuracion"]["etiqueta"] = text
-        guardar_config(config)
-        context.user_data.pop("edit_etiqueta")
-        await update.message.reply_text("Etiqueta actualizada.", parse_mode="HTML")
+    if estado is Estado.EDITAR_ETIQUETA:
+        almacen.actualizar_configuracion("etiqueta", text)
+        sesion.terminar()
+        responder(update, "Etiqueta actualizada.")
         return
 
-    if context.user_data.get("edit_personalidad"):
-        config["configuracion"]["personalidad"] = text
-        guardar_config(config)
-        context.user_data.pop("edit_personalidad")
-        await update.message.reply_text("Personalidad actualizada.", parse_mode="HTML")
+    if estado is Estado.EDITAR_PERSONALIDAD:
+        almacen.actualizar_configuracion("personalidad", text)
+        sesion.terminar()
+        responder(update, "Personalidad actualizada.")
         return
 
-    if context.user_data.get("edit_servicios"):
+    if estado is Estado.EDITAR_SERVICIOS:
         servicios = [s.strip() for s in text.split(",") if s.strip()]
-        config["configuracion"]["servicios"] = servicios
-        guardar_config(config)
-        context.user_data.pop("edit_servicios")
-        await update.message.reply_text("Servicios actualizados.", parse_mode="HTML")
+        almacen.actualizar_configuracion("servicios", servicios)
+        sesion.terminar()
+        responder(update, "Servicios actualizados.")
         return
 
-    if context.user_data.get("edit_idioma"):
-        config["configuracion"]["idioma"] = text
-        guardar_config(config)
-        context.user_data.pop("edit_idioma")
-        await update.message.reply_text("Idioma actualizado.", parse_mode="HTML")
+    if estado is Estado.EDITAR_IDIOMA:
+        almacen.actualizar_configuracion("idioma", text)
+        sesion.terminar()
+        responder(update, "Idioma actualizado.")
         return
 
     # Edición de Tipo de Post (renombrar)
-    if context.user_data.get("edit_nombre_tipo"):
-        tipo_actual = context.user_data.get("tipo_editar")
-        if tipo_actual not in config["tipos_de_post"]:
-            await update.message.reply_text("Error: Tipo de post no encontrado.", parse_mode="HTML")
-            context.user_data.pop("edit_nombre_tipo")
+    if estado is Estado.RENOMBRAR_TIPO:
+        tipo_actual = sesion.tipo_editar
+        sesion.terminar()
+        if not almacen.existe_tipo(tipo_actual):
+            responder(update, "Error: Tipo de post no encontrado.")
             return
-        config["tipos_de_post"][text] = config["tipos_de_post"].pop(tipo_actual)
-        guardar_config(config)
-        context.user_data.pop("edit_nombre_tipo")
-        await update.message.reply_text(f"El tipo de post se ha renombrado a '{text}'.", parse_mode="HTML")
+        almacen.renombrar_tipo(tipo_actual, text)
+        actualizar_indices("renombrar_tipo", tipo_actual, text)
+        sesion.tipo_editar = text
+        responder(update, f"El tipo de post se ha renombrado a '{text}'.")
+        return
+
+    # Búsqueda de ejemplos por su comienzo
+    if estado is Estado.BUSCAR_EJEMPLO:
+        sesion.terminar()
+        sesion.filtro_ejemplos = text
+        mostrar_ejemplos(update, sesion)
         return
 
     # Edición de Ejemplo
-    if context.user_data.get("editar_ejemplo_indice") is not None:
-        indice = context.user_data.get("editar_ejemplo_indice")
-        tipo_post = context.user_data.get("tipo_editar")
+    if estado is Estado.EDITAR_EJEMPLO:
+        id_ejemplo = sesion.id_ejemplo
+        tipo_post = sesion.tipo_editar
+        sesion.terminar()
         try:
-            config["tipos_de_post"][tipo_post]["ejemplos"][indice] = process_example_text(text)
-            guardar_config(config)
-            await update.message.reply_text("Ejemplo actualizado correctamente.", parse_mode="HTML")
+            nuevo = process_example_text(text)
+            almacen.actualizar_ejemplo(tipo_post, id_ejemplo, nuevo)
+            actualizar_indices("quitar", tipo_post, id_ejemplo)
+            actualizar_indices("agregar", tipo_post, id_ejemplo, nuevo)
+            responder(update, "Ejemplo actualizado correctamente.")
         except IndexError:
-            await update.message.reply_text("Error al actualizar el ejemplo.", parse_mode="HTML")
-        context.user_data.pop("editar_ejemplo_indice")
+            responder(update, "Error al actualizar el ejemplo.")
         return
 
-    await update.message.reply_text("No se reconoce la acción. Usa /menu para ver las opciones.", parse_mode="HTML")
+    responder(update, "No se reconoce la acción. Usa /menu para ver las opciones.")
 
 # --- Menú Principal ---
 async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -339,53 +650,119 @@ async def menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("➕ Agregar Tipo de Post", callback_data="add_tipo_post")],
         [InlineKeyboardButton("➕ Agregar Ejemplo", callback_data="add_ejemplo")],
         [InlineKeyboardButton("📝 Crear Post", callback_data="crear_post")],
+        [InlineKeyboardButton("📦 Crear Posts en Lote", callback_data="crear_lote")],
         [InlineKeyboardButton("✏️ Editar Configuración", callback_data="editar_config")],
         [InlineKeyboardButton("🌐 Configurar Idioma", callback_data="configurar_idioma")],
         [InlineKeyboardButton("✏️ Editar Tipos de Post", callback_data="editar_tipos")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.effective_message.reply_text("Selecciona una opción:", reply_markup=reply_markup, parse_mode="HTML")
+    responder(update, "Selecciona una opción:", reply_markup=reply_markup)
+
+# --- Navegación por los ejemplos de un tipo ---
+# Los botones llevan el ID estable del ejemplo, no su posición, y cada página se
+# construye solo con los ejemplos que muestra: "pag_ej_>ID" son los siguientes a
+# ID y "pag_ej_<ID" los anteriores. El filtro por prefijo vive en la sesión.
+def pagina_ejemplos(tipo_post: str, prefijo: str = "", despues: int = None, antes: int = None):
+    """Texto y teclado de una página de ejemplos; (None, None) si no hay ninguno que mostrar."""
+    limite = ajustes.ejemplos_por_pagina
+    # Se pide uno más para saber si hay otra página en ese sentido
+    filas = almacen.pagina_ejemplos(tipo_post, despues=despues, antes=antes, limite=limite + 1, prefijo=prefijo)
+    if antes is not None:
+        hay_anteriores, hay_siguientes = len(filas) > limite, True
+        filas = filas[-limite:]
+    else:
+        hay_anteriores, hay_siguientes = despues is not None, len(filas) > limite
+        filas = filas[:limite]
+    if not filas:
+        return None, None
+    keyboard = [
+        [InlineKeyboardButton(f"{posicion + 1}. {ej[:20]}{'...' if len(ej) > 20 else ''}", callback_data=f"ver_ej_{id_ejemplo}")]
+        for id_ejemplo, posicion, ej in filas
+    ]
+    navegacion = []
+    if hay_anteriores:
+        navegacion.append(InlineKeyboardButton("⬅️ Anteriores", callback_data=f"pag_ej_<{filas[0][0]}"))
+    if hay_siguientes:
+        navegacion.append(InlineKeyboardButton("Siguientes ➡️", callback_data=f"pag_ej_>{filas[-1][0]}"))
+    if navegacion:
+        keyboard.append(navegacion)
+    if prefijo:
+        keyboard.append([InlineKeyboardButton("✖️ Quitar filtro", callback_data="ver_ejemplos")])
+        texto = f"Ejemplos que empiezan por «{html.escape(prefijo)}». Selecciona el ejemplo a editar/eliminar:"
+    else:
+        keyboard.append([InlineKeyboardButton("🔎 Buscar por el comienzo", callback_data="buscar_ejemplo")])
+        texto = (
+            f"Ejemplos {filas[0][1] + 1}-{filas[-1][1] + 1} de {almacen.contar_ejemplos(tipo_post)}. "
+            "Selecciona el ejemplo a editar/eliminar:"
+        )
+    return texto, InlineKeyboardMarkup(keyboard)
+
+def mostrar_ejemplos(update: Update, sesion: Sesion):
+    prefijo = sesion.filtro_ejemplos
+    texto, reply_markup = pagina_ejemplos(sesion.tipo_editar, prefijo)
+    if texto is None:
+        if prefijo:
+            responder(update, f"Ningún ejemplo empieza por «{html.escape(prefijo)}».")
+        else:
+            responder(update, "No hay ejemplos para este tipo de post.")
+        return
+    responder(update, texto, reply_markup=reply_markup)
 
 # --- Manejo de botones (CallbackQuery) ---
 async def botones(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
+    sesion = sesion_de(update)
 
     if data == "add_tipo_post":
-        await query.message.reply_text("Escribe el nombre del nuevo tipo de post:", parse_mode="HTML")
-        context.user_data["esperando_tipo_post"] = True
+        responder(update, "Escribe el nombre del nuevo tipo de post:")
+        sesion.esperar(Estado.NUEVO_TIPO)
 
     elif data == "add_ejemplo":
-        tipos = list(config["tipos_de_post"].keys())
+        tipos = almacen.tipos()
         if not tipos:
-            await query.message.reply_text("No hay tipos de post registrados. Agrégalo con /menu.", parse_mode="HTML")
+            responder(update, "No hay tipos de post registrados. Agrégalo con /menu.")
             return
         keyboard = [[InlineKeyboardButton(t, callback_data=f"ejemplo_{t}")] for t in tipos]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Selecciona el tipo de post para agregar un ejemplo:", reply_markup=reply_markup, parse_mode="HTML")
+        responder(update, "Selecciona el tipo de post para agregar un ejemplo:", reply_markup=reply_markup)
 
     elif data.startswith("ejemplo_"):
         tipo_post = data.split("_", 1)[1]
-        context.user_data["tipo_post"] = tipo_post
-        context.user_data["esperando_ejemplo"] = True
-        await query.message.reply_text(f"Envíame un ejemplo para el tipo de post '{tipo_post}':", parse_mode="HTML")
+        sesion.esperar(Estado.EJEMPLO, tipo_post=tipo_post)
+        responder(update, f"Envíame un ejemplo para el tipo de post '{tipo_post}':")
 
     elif data == "crear_post":
-        tipos = list(config["tipos_de_post"].keys())
+        tipos = almacen.tipos()
         if not tipos:
-            await query.message.reply_text("No hay tipos de post registrados. Agrégalo con /menu.", parse_mode="HTML")
+            responder(update, "No hay tipos de post registrados. Agrégalo con /menu.")
             return
         keyboard = [[InlineKeyboardButton(t, callback_data=f"post_{t}")] for t in tipos]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Selecciona el tipo de post:", reply_markup=reply_markup, parse_mode="HTML")
+        responder(update, "Selecciona el tipo de post:", reply_markup=reply_markup)
+
+    elif data == "crear_lote":
+        tipos = almacen.tipos()
+        if not tipos:
+            responder(update, "No hay tipos de post registrados. Agrégalo con /menu.")
+            return
+        keyboard = [[InlineKeyboardButton(t, callback_data=f"lote_{t}")] for t in tipos]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        responder(update, "Selecciona el tipo de post para el lote:", reply_markup=reply_markup)
+
+    elif data.startswith("lote_"):
+        tipo_post = data.split("_", 1)[1]
+        sesion.esperar(Estado.TEMAS_LOTE, tipo_post=tipo_post)
+        responder(
+            update,
+            f"Envía los temas para '{tipo_post}': uno por línea, o un archivo .txt o .csv (un tema por fila).",
+        )
 
     elif data.startswith("post_"):
         tipo_post = data.split("_", 1)[1]
-        context.user_data["tipo_post"] = tipo_post
-        context.user_data["esperando_post_tema"] = True
-        context.user_data.pop("esperando_ejemplo", None)
-        await query.message.reply_text(f"Escribe el tema para el post de tipo '{tipo_post}':", parse_mode="HTML")
+        sesion.esperar(Estado.TEMA_POST, tipo_post=tipo_post)
+        responder(update, f"Escribe el tema para el post de tipo '{tipo_post}':")
 
     elif data == "editar_config":
         keyboard = [
@@ -395,164 +772,457 @@ async def botones(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("Servicios", callback_data="edit_servicios_menu")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Selecciona el campo a editar:", reply_markup=reply_markup, parse_mode="HTML")
+        responder(update, "Selecciona el campo a editar:", reply_markup=reply_markup)
 
     elif data == "edit_nombre_menu":
-        context.user_data["edit_nombre"] = True
-        await query.message.reply_text("Ingresa el nuevo nombre:", parse_mode="HTML")
+        sesion.esperar(Estado.EDITAR_NOMBRE)
+        responder(update, "Ingresa el nuevo nombre:")
     elif data == "edit_etiqueta_menu":
-        context.user_data["edit_etiqueta"] = True
-        await query.message.reply_text("Ingresa la nueva etiqueta:", parse_mode="HTML")
+        sesion.esperar(Estado.EDITAR_ETIQUETA)
+        responder(update, "Ingresa la nueva etiqueta:")
     elif data == "edit_personalidad_menu":
-        context.user_data["edit_personalidad"] = True
-        await query.message.reply_text("Ingresa la nueva descripción de personalidad:", parse_mode="HTML")
+        sesion.esperar(Estado.EDITAR_PERSONALIDAD)
+        responder(update, "Ingresa la nueva descripción de personalidad:")
     elif data == "edit_servicios_menu":
-        context.user_data["edit_servicios"] = True
-        await query.message.reply_text("Ingresa los nuevos servicios (separados por comas):", parse_mode="HTML")
+        sesion.esperar(Estado.EDITAR_SERVICIOS)
+        responder(update, "Ingresa los nuevos servicios (separados por comas):")
 
     elif data == "configurar_idioma":
-        context.user_data["edit_idioma"] = True
-        await query.message.reply_text("Ingresa el idioma en el que deseas redactar los posts:", parse_mode="HTML")
+        sesion.esperar(Estado.EDITAR_IDIOMA)
+        responder(update, "Ingresa el idioma en el que deseas redactar los posts:")
 
     elif data == "editar_tipos":
-        if not config["tipos_de_post"]:
-            await query.message.reply_text("No hay tipos de post para editar.", parse_mode="HTML")
+        tipos = almacen.tipos()
+        if not tipos:
+            responder(update, "No hay tipos de post para editar.")
             return
         keyboard = []
-        for t in config["tipos_de_post"]:
+        for t in tipos:
             keyboard.append([InlineKeyboardButton(t, callback_data=f"edit_tipo_{t}")])
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Selecciona el tipo de post a editar:", reply_markup=reply_markup, parse_mode="HTML")
+        responder(update, "Selecciona el tipo de post a editar:", reply_markup=reply_markup)
 
     elif data.startswith("edit_tipo_"):
         tipo_post = data.split("_", 2)[2]
-        context.user_data["tipo_editar"] = tipo_post
+        sesion.tipo_editar = tipo_post
         keyboard = [
             [InlineKeyboardButton("Editar nombre", callback_data="editar_nombre_tipo")],
             [InlineKeyboardButton("Eliminar tipo", callback_data="eliminar_tipo")],
-            [InlineKeyboardButton("Ver ejemplos", callback_data="ver_ejemplos")]
+            [InlineKeyboardButton("Ver ejemplos", callback_data="ver_ejemplos")],
+            [InlineKeyboardButton("Eliminar duplicados", callback_data="deduplicar_tipo")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text(f"Opciones para el tipo '{tipo_post}':", reply_markup=reply_markup, parse_mode="HTML")
+        responder(update, f"Opciones para el tipo '{tipo_post}':", reply_markup=reply_markup)
 
     elif data == "editar_nombre_tipo":
-        context.user_data["edit_nombre_tipo"] = True
-        await query.message.reply_text("Ingresa el nuevo nombre para este tipo de post:", parse_mode="HTML")
+        sesion.esperar(Estado.RENOMBRAR_TIPO)
+        responder(update, "Ingresa el nuevo nombre para este tipo de post:")
 
     elif data == "eliminar_tipo":
-        tipo_post = context.user_data.get("tipo_editar")
+        tipo_post = sesion.tipo_editar
         keyboard = [
             [InlineKeyboardButton("Sí, eliminar", callback_data="confirm_eliminar_tipo")],
             [InlineKeyboardButton("No", callback_data="cancel_eliminar_tipo")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text(
+        responder(
+            update,
             f"¿Estás seguro de eliminar el tipo de post '{tipo_post}'? Se borrarán también todos sus ejemplos.",
             reply_markup=reply_markup,
-            parse_mode="HTML"
         )
 
     elif data == "confirm_eliminar_tipo":
-        tipo_post = context.user_data.get("tipo_editar")
-        if tipo_post in config["tipos_de_post"]:
-            del config["tipos_de_post"][tipo_post]
-            guardar_config(config)
-            await query.message.reply_text(f"Tipo de post '{tipo_post}' eliminado.", parse_mode="HTML")
+        tipo_post = sesion.tipo_editar
+        if almacen.existe_tipo(tipo_post):
+            almacen.eliminar_tipo(tipo_post)
+            actualizar_indices("eliminar_tipo", tipo_post)
+            responder(update, f"Tipo de post '{tipo_post}' eliminado.")
         else:
-            await query.message.reply_text("Error: Tipo de post no encontrado.", parse_mode="HTML")
-        context.user_data.pop("tipo_editar", None)
+            responder(update, "Error: Tipo de post no encontrado.")
+        sesion.tipo_editar = None
 
     elif data == "cancel_eliminar_tipo":
-        await query.message.reply_text("Eliminación cancelada.", parse_mode="HTML")
-        context.user_data.pop("tipo_editar", None)
+        responder(update, "Eliminación cancelada.")
+        sesion.tipo_editar = None
 
-    elif data == "ver_ejemplos":
-        tipo_post = context.user_data.get("tipo_editar")
-        ejemplos = config["tipos_de_post"][tipo_post]["ejemplos"]
-        if not ejemplos:
-            await query.message.reply_text("No hay ejemplos para este tipo de post.", parse_mode="HTML")
+    elif data == "deduplicar_tipo":
+        tipo_post = sesion.tipo_editar
+        if not almacen.existe_tipo(tipo_post):
+            responder(update, "Error: Tipo de post no encontrado.")
             return
-        keyboard = []
-        for idx, ej in enumerate(ejemplos, start=1):
-            boton_text = f"{idx}. {ej[:20]}{'...' if len(ej) > 20 else ''}"
-            keyboard.append([InlineKeyboardButton(boton_text, callback_data=f"editar_ejemplos_{idx-1}")])
+        sobrantes = indice_duplicados.duplicados(tipo_post)
+        if not sobrantes:
+            responder(update, "No se encontraron ejemplos duplicados.")
+            return
+        keyboard = [
+            [InlineKeyboardButton("Sí, eliminar", callback_data="confirm_deduplicar")],
+            [InlineKeyboardButton("No", callback_data="cancel_deduplicar")]
+        ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("Selecciona el ejemplo a editar/eliminar:", reply_markup=reply_markup, parse_mode="HTML")
+        responder(
+            update,
+            f"Hay {len(sobrantes)} ejemplos duplicados o casi idénticos en '{tipo_post}'. "
+            f"¿Eliminarlos? Se conservará el más antiguo de cada grupo.",
+            reply_markup=reply_markup,
+        )
+
+    elif data == "confirm_deduplicar":
+        tipo_post = sesion.tipo_editar
+        if not almacen.existe_tipo(tipo_post):
+            responder(update, "Error: Tipo de post no encontrado.")
+            return
+        # Se recalcula por si los ejemplos han cambiado desde la pregunta
+        async with bloqueo_config:
+            sobrantes = indice_duplicados.duplicados(tipo_post)
+            for id_ejemplo in sobrantes:
+                almacen.borrar_ejemplo(tipo_post, id_ejemplo)
+                actualizar_indices("quitar", tipo_post, id_ejemplo)
+        responder(update, f"Se eliminaron {len(sobrantes)} ejemplos duplicados.")
 
-    elif data.startswith("editar_ejemplos_"):
-        indice = int(data.split("_")[-1])
-        tipo_post = context.user_data.get("tipo_editar")
+    elif data == "cancel_deduplicar":
+        responder(update, "Eliminación de duplicados cancelada.")
+
+    elif data == "ver_ejemplos":
+        sesion.filtro_ejemplos = ""
+        mostrar_ejemplos(update, sesion)
+
+    elif data == "buscar_ejemplo":
+        sesion.esperar(Estado.BUSCAR_EJEMPLO)
+        responder(update, "Escribe el comienzo del ejemplo que buscas:")
+
+    elif data.startswith("pag_ej_"):
+        referencia = int(data[len("pag_ej_") + 1:])
+        sentido = {"despues": referencia} if data[len("pag_ej_")] == ">" else {"antes": referencia}
+        texto, reply_markup = pagina_ejemplos(sesion.tipo_editar, sesion.filtro_ejemplos, **sentido)
+        if texto is None:
+            responder(update, "No hay más ejemplos en ese sentido.")
+            return
+        # La página se cambia sobre el mismo mensaje
+        editar_mensaje(query.message, texto, reply_markup=reply_markup)
+
+    elif data.startswith("ver_ej_"):
+        id_ejemplo = int(data.split("_")[-1])
+        tipo_post = sesion.tipo_editar
         try:
-            ejemplo = config["tipos_de_post"][tipo_post]["ejemplos"][indice]
+            ejemplo = almacen.ejemplo_por_id(tipo_post, id_ejemplo)
         except IndexError:
-            await query.message.reply_text("Ejemplo no encontrado.", parse_mode="HTML")
+            responder(update, "Ejemplo no encontrado.")
             return
-        await query.message.reply_text(f"Ejemplo seleccionado:\n{ejemplo}", parse_mode="HTML")
+        responder(update, f"Ejemplo seleccionado:\n{ejemplo}")
         keyboard = [
-            [InlineKeyboardButton("Editar", callback_data=f"modificar_ejemplo_{indice}")],
-            [InlineKeyboardButton("Eliminar", callback_data=f"borrar_ejemplo_{indice}")]
+            [InlineKeyboardButton("Editar", callback_data=f"mod_ej_{id_ejemplo}")],
+            [InlineKeyboardButton("Eliminar", callback_data=f"borrar_ej_{id_ejemplo}")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.reply_text("¿Qué deseas hacer con este ejemplo?", reply_markup=reply_markup, parse_mode="HTML")
+        responder(update, "¿Qué deseas hacer con este ejemplo?", reply_markup=reply_markup)
 
-    elif data.startswith("modificar_ejemplo_"):
-        indice = int(data.split("_")[-1])
-        context.user_data["editar_ejemplo_indice"] = indice
-        await query.message.reply_text("Envía el nuevo texto para este ejemplo:", parse_mode="HTML")
+    elif data.startswith("mod_ej_"):
+        sesion.esperar(Estado.EDITAR_EJEMPLO, id_ejemplo=int(data.split("_")[-1]))
+        responder(update, "Envía el nuevo texto para este ejemplo:")
 
-    elif data.startswith("borrar_ejemplos_") or data.startswith("borrar_ejemplo_"):
-        indice = int(data.split("_")[-1])
-        tipo_post = context.user_data.get("tipo_editar")
+    elif data.startswith("borrar_ej_"):
+        id_ejemplo = int(data.split("_")[-1])
+        tipo_post = sesion.tipo_editar
         try:
-            borrado = config["tipos_de_post"][tipo_post]["ejemplos"].pop(indice)
-            guardar_config(config)
-            await query.message.reply_text(f"Ejemplo borrado:\n{borrado}", parse_mode="HTML")
+            async with bloqueo_config:
+                borrado = almacen.borrar_ejemplo(tipo_post, id_ejemplo)
+                # Los índices van por ID: solo se quita este ejemplo
+                actualizar_indices("quitar", tipo_post, id_ejemplo)
+            responder(update, f"Ejemplo borrado:\n{borrado}")
         except IndexError:
-            await query.message.reply_text("Error al borrar el ejemplo.", parse_mode="HTML")
+            responder(update, "Error al borrar el ejemplo.")
+
+    elif data.startswith(("editar_ejemplos_", "modificar_ejemplo_", "borrar_ejemplos_", "borrar_ejemplo_")):
+        # Botones de antes de los IDs estables: su posición puede ser ya de otro ejemplo
+        responder(update, "Este listado de ejemplos está desactualizado. Vuelve a abrir «Ver ejemplos».")
 
     # Aceptar Post: al aceptar, se muestran los mensajes finales y se muestra el menú
     elif data == "aceptar_post":
-        post = context.user_data.get("ultimo_post", "")
-        await query.message.reply_text("Post aceptado:", parse_mode="HTML")
-        await query.message.reply_text(post, parse_mode="HTML")
-        context.user_data.pop("ultimo_post", None)
-        context.user_data.pop("ultimo_tipo_post", None)
-        context.user_data.pop("ultimo_tema", None)
-        context.user_data.pop("ultimo_ejemplo_index", None)
+        post = sesion.ultimo_post or ""
+        responder(update, "Post aceptado:", fusionable=False)
+        # El post va solo en su mensaje para poder reenviarlo tal cual
+        responder(update, post, fusionable=False)
+        sesion.olvidar_post()
+        candidatos.cancelar(update.effective_chat.id)
+        generaciones.cancelar(update.effective_chat.id)
         # Mostrar el menú automáticamente
         await menu(update, context)
 
     elif data == "reescribir_post":
-        tipo_post = context.user_data.get("ultimo_tipo_post")
-        tema = context.user_data.get("ultimo_tema")
-        idioma = config["configuracion"].get("idioma", "Español")
-        prev_index = context.user_data.get("ultimo_ejemplo_index")
-        new_post, new_index = await generate_post(tipo_post, tema, idioma, previous_index=prev_index)
-        context.user_data["ultimo_post"] = new_post
-        context.user_data["ultimo_ejemplo_index"] = new_index
-        await presentar_post(update, context, new_post)
+        tipo_post = sesion.ultimo_tipo_post
+        tema = sesion.ultimo_tema
+        idioma = almacen.configuracion().get("idioma", "Español")
+        prev_index = sesion.ultimo_ejemplo
+
+        async def generar(iniciar):
+            candidato = await candidatos.tomar(update.effective_chat.id, (tipo_post, tema))
+            if candidato is not None:
+                return candidato.texto, candidato.id_ejemplo
+            editor = await iniciar()
+            return await generate_post(
+                tipo_post, tema, idioma, previous_index=prev_index,
+                al_fragmento=editor.agregar if editor else None,
+            )
+
+        def al_presentar(sesion, new_post, new_index):
+            estadisticas_posts["reescrituras"] += 1
+            sesion.ultimo_post = new_post
+            sesion.ultimo_ejemplo = new_index
+
+        # Un doble toque sobre el mismo post se une a la reescritura en curso
+        lanzar_generacion(update, context, ("reescribir", tipo_post, tema, prev_index), generar, al_presentar)
 
 # --- Manejo adicional para editar textos (mensaje) ---
 async def editar_textos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if context.user_data.get("edit_nombre_tipo"):
-        tipo_actual = context.user_data.get("tipo_editar")
-        if tipo_actual not in config["tipos_de_post"]:
-            await update.message.reply_text("Error: Tipo de post no encontrado.", parse_mode="HTML")
-            context.user_data.pop("edit_nombre_tipo")
+    sesion = sesion_de(update)
+    if sesion.estado is Estado.RENOMBRAR_TIPO:
+        tipo_actual = sesion.tipo_editar
+        sesion.terminar()
+        if not almacen.existe_tipo(tipo_actual):
+            responder(update, "Error: Tipo de post no encontrado.")
             return
-        config["tipos_de_post"][update.message.text.strip()] = config["tipos_de_post"].pop(tipo_actual)
-        guardar_config(config)
-        context.user_data.pop("edit_nombre_tipo")
-        await update.message.reply_text(f"El tipo de post se ha renombrado a '{update.message.text.strip()}'.", parse_mode="HTML")
+        almacen.renombrar_tipo(tipo_actual, update.message.text.strip())
+        actualizar_indices("renombrar_tipo", tipo_actual, update.message.text.strip())
+        sesion.tipo_editar = update.message.text.strip()
+        responder(update, f"El tipo de post se ha renombrado a '{update.message.text.strip()}'.")
         return
     await recibir_mensaje(update, context)
 
+# --- Documentos: lista de temas para un lote ---
+async def recibir_documento(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    sesion = sesion_de(update)
+    if sesion.estado is not Estado.TEMAS_LOTE:
+        responder(update, "No se reconoce la acción. Usa /menu para ver las opciones.")
+        return
+    tipo_post = sesion.tipo_post
+    sesion.terminar()
+    documento = update.message.document
+    archivo = await documento.get_file()
+    contenido = await archivo.download_as_bytearray()
+    try:
+        texto = bytes(contenido).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        responder(update, "El archivo debe estar en UTF-8.")
+        return
+    await iniciar_lote(update, context, tipo_post, leer_temas(texto, documento.file_name or ""))
+
+# --- Métricas por handler y comandos de administración ---
+# Los callbacks que llevan un nombre de tipo o un índice se agrupan por su prefijo
+PREFIJOS_CALLBACK = (
+    "ejemplo_", "post_", "lote_", "edit_tipo_", "ver_ej_", "mod_ej_", "borrar_ej_", "pag_ej_",
+    "editar_ejemplos_", "modificar_ejemplo_", "borrar_ejemplos_", "borrar_ejemplo_",
+)
+
+def etiqueta_callback(data: str) -> str:
+    for prefijo in PREFIJOS_CALLBACK:
+        if data.startswith(prefijo):
+            return prefijo.rstrip("_")
+    return data[:40]
+
+def medido(nombre: str, handler, etiquetar=None):
+    """Envuelve un handler para observar su duración en handler_segundos."""
+    async def envoltorio(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        etiquetas = {"handler": nombre}
+        if etiquetar is not None:
+            etiquetas["accion"] = etiquetar(update)
+        with metricas.medir("handler_segundos", "Duración de los handlers de Telegram", **etiquetas):
+            return await handler(update, context)
+    return envoltorio
+
+def es_admin(update: Update) -> bool:
+    return update.effective_user is not None and update.effective_user.id in ajustes.admin_ids
+
+def texto_estadisticas() -> str:
+    lineas = ["<b>Latencias (p50 / p99, s)</b>"]
+    for nombre in ("handler_segundos", "generate_post_segundos", "llm_segundos", "config_escritura_segundos"):
+        for etiquetas, histograma in sorted(metricas.histogramas(nombre), key=lambda par: -par[1].total):
+            detalle = html.escape(" ".join(str(valor) for _, valor in sorted(etiquetas.items())) or nombre)
+            lineas.append(
+                f"{detalle}: {histograma.cuantil(0.5):g} / {histograma.cuantil(0.99):g} ({histograma.total})"
+            )
+    for componente, valores in metricas.valores_colectores().items():
+        numericos = ", ".join(
+            f"{clave}={valor:g}" if isinstance(valor, float) else f"{clave}={valor}"
+            for clave, valor in valores.items()
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool)
+        )
+        lineas.append(f"<b>{componente}</b>: {numericos}")
+    texto = "\n".join(lineas)
+    # Un mensaje de Telegram no pasa de 4096 caracteres; se corta por una línea entera
+    return texto if len(texto) <= 4000 else texto[:texto.rindex("\n", 0, 4000)]
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not es_admin(update):
+        return
+    responder(update, texto_estadisticas(), fusionable=False)
+
+async def perfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not es_admin(update) or not ajustes.perfilador:
+        return
+    try:
+        segundos = float(context.args[0]) if context.args else 10.0
+    except ValueError:
+        responder(update, "Uso: /perfil [segundos]")
+        return
+    if perfilador.ocupado:
+        responder(update, "Ya hay un perfil en curso.")
+        return
+    responder(update, f"⏱️ Perfilando durante {segundos:g} s...")
+    informe = await perfilador.perfilar(segundos)
+    await despachador.enviar_documento(update.effective_chat.id, informe.encode("utf-8"), "perfil.txt")
+
 # --- Configuración del Bot ---
-app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CommandHandler("menu", menu))
-app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, editar_textos))
-app.add_handler(CallbackQueryHandler(botones))
-
-logger.info("Bot en marcha...")
-app.run_polling()
+async def al_iniciar(application: Application):
+    despachador.iniciar(application.bot)
+    # En segundo plano: hasta que esté, los tokens de los ejemplos se estiman
+    compilador_prompts.cargar_en_segundo_plano()
+    if ajustes.metricas_puerto:
+        puerto = await servidor_metricas.iniciar(ajustes.metricas_host, ajustes.metricas_puerto)
+        logger.info("Métricas en http://%s:%d/metrics", ajustes.metricas_host, puerto)
+    for lote in gestor_lotes.pendientes():
+        # Con varios trabajadores, cada uno retoma los lotes de sus chats
+        if not es_mio(ajustes, lote.chat_id):
+            continue
+        logger.info("Retomando el lote %s (%d/%d)", lote.id, lote.completados, len(lote.temas))
+        lanzar_lote(lote)
+
+async def al_apagar(application: Application):
+    if servidor_metricas.creado:
+        await servidor_metricas.detener()
+    await generaciones.cerrar()
+    uso = compilador_prompts.estadisticas()
+    logger.info(
+        "Generaciones: %s",
+        generaciones.estadisticas(uso["tokens_prompt_medio"], uso["tokens_completion_medio"]),
+    )
+    for tarea in list(tareas_lotes):
+        tarea.cancel()
+    await asyncio.gather(*tareas_lotes, return_exceptions=True)
+    await despachador.cerrar()
+    logger.info("Mensajes salientes: %s", despachador.estadisticas())
+    logger.info("Procesamiento de updates: %s", application.update_processor.estadisticas())
+    logger.info("Candidatos de reescritura: %s", candidatos.estadisticas())
+    logger.info("Uso de tokens: %s", uso)
+    if ajustes.streaming:
+        logger.info("Streaming: %s", ediciones.estadisticas())
+    logger.info(
+        "Selección de ejemplos (%s): %s, posts: %s",
+        ajustes.seleccion_ejemplos, indice_ejemplos.estadisticas(), estadisticas_de_posts()
+    )
+    # Lo que no llegó a usarse no se construye solo para cerrarlo
+    if cache_completions.creado:
+        logger.info("Caché de completions: %s", cache_completions.estadisticas())
+        cache_completions.cerrar()
+    if almacen.creado:
+        await almacen.cerrar()
+        logger.info("Almacenamiento: %s", almacen.estadisticas())
+    if sesiones.creado:
+        logger.info("Sesiones: %s", sesiones.estadisticas())
+        sesiones.cerrar()
+    if completador.creado:
+        logger.info("Backend de completions: %s", completador.estadisticas())
+        for backend in completador.backends:
+            await backend.cliente.cerrar()
+
+COMPONENTES = (
+    completador, servidor_metricas, indice_duplicados, indice_ejemplos, almacen, despachador,
+    gestor_lotes, compilador_prompts, cache_completions, candidatos, ediciones, sesiones,
+)
+
+def create_app(settings: Ajustes = None) -> Application:
+    """
+    Construye la Application con sus handlers a partir de `settings` (por
+    defecto, las variables de entorno). No crea el almacén, el cliente del
+    modelo ni las cachés: cada uno se construye la primera vez que se usa.
+    """
+    global ajustes
+    ajustes = settings if settings is not None else Ajustes.desde_entorno()
+    if not ajustes.telegram_bot_token:
+        raise ValueError("Falta TELEGRAM_BOT_TOKEN")
+    for componente in COMPONENTES:
+        componente.reiniciar()
+
+    app = (
+        Application.builder()
+        .token(ajustes.telegram_bot_token)
+        .base_url(ajustes.telegram_base_url)
+        # Chats distintos en paralelo; los updates de un mismo chat, en orden y de uno en uno
+        .concurrent_updates(ProcesadorPorChat(ajustes.max_updates_concurrentes))
+        .post_init(al_iniciar)
+        .post_shutdown(al_apagar)
+        .build()
+    )
+    app.add_handler(CommandHandler("start", medido("start", con_estado_compartido(start))))
+    app.add_handler(CommandHandler("menu", medido("menu", con_estado_compartido(menu))))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("perfil", perfil))
+    app.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND, medido("recibir_mensaje", con_estado_compartido(editar_textos))
+    ))
+    app.add_handler(MessageHandler(
+        filters.Document.ALL, medido("recibir_documento", con_estado_compartido(recibir_documento))
+    ))
+    app.add_handler(CallbackQueryHandler(medido(
+        "botones", con_estado_compartido(botones), lambda update: etiqueta_callback(update.callback_query.data or "")
+    )))
+
+    # Profundidad de colas, aciertos de caché, circuitos... se leen al exportar
+    metricas.colector("updates", app.update_processor.estadisticas)
+    metricas.colector("salida", estadisticas_de(despachador))
+    metricas.colector("generaciones", generaciones.estadisticas)
+    metricas.colector("lotes", lambda: {"en_curso": len(tareas_lotes)})
+    metricas.colector("llm", estadisticas_de(completador))
+    metricas.colector("cache", estadisticas_de(cache_completions))
+    metricas.colector("candidatos", estadisticas_de(candidatos))
+    metricas.colector("tokens", estadisticas_de(compilador_prompts))
+    metricas.colector("almacen", estadisticas_de(almacen))
+    metricas.colector("sesiones", estadisticas_de(sesiones))
+    metricas.colector("seleccion", estadisticas_de(indice_ejemplos))
+    metricas.colector("posts", estadisticas_de_posts)
+    if ajustes.streaming:
+        metricas.colector("streaming", estadisticas_de(ediciones))
+    return app
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    settings = Ajustes.desde_entorno()
+    # Los trabajadores comparten la salida del enrutador: cada línea dice de quién es
+    proceso = "" if settings.trabajador is None else f"trabajador {settings.trabajador} - "
+    logging.basicConfig(
+        format=f"%(asctime)s - {proceso}%(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    if not settings.telegram_bot_token or not settings.openai_api_key:
+        logger.error("Falta TELEGRAM_BOT_TOKEN u OPENAI_API_KEY")
+        sys.exit(1)
+    if settings.modo == "webhook" and not settings.webhook_secreto and not settings.webhook_sin_secreto:
+        logger.error("MODO=webhook necesita WEBHOOK_SECRETO (o WEBHOOK_SIN_SECRETO=1 si otro lo comprueba)")
+        sys.exit(1)
+    if settings.trabajadores > 1 and settings.trabajador is None:
+        if settings.almacen != "sqlite":
+            logger.error("TRABAJADORES > 1 necesita ALMACEN=sqlite para compartir la configuración")
+            sys.exit(1)
+        logger.info("Enrutador en marcha (%s) con %d trabajadores...", settings.modo, settings.trabajadores)
+        asyncio.run(ejecutar_enrutador(settings))
+        return
+    app = create_app(settings)
+
+    logger.info("Bot en marcha (%s)...", settings.modo)
+    if settings.modo == "webhook":
+        asyncio.run(ejecutar_webhook(
+            app,
+            url=settings.webhook_url,
+            host=settings.webhook_host,
+            puerto=settings.webhook_puerto,
+            ruta=settings.webhook_ruta,
+            secreto=settings.webhook_secreto,
+            drenar=settings.webhook_drenar,
+            sin_secreto=settings.webhook_sin_secreto,
+        ))
+    else:
+        app.run_polling()
+
+if __name__ == "__main__":
+    main()
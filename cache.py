@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from llm import Respuesta
+
+logger = logging.getLogger(__name__)
+
+
+def clave_completion(modelo: str, mensajes: list) -> str:
+    """
+    Hash del prompt completo (mensajes de sistema y usuario) y del modelo.
+    Cualquier cambio en la personalidad, servicios, etiqueta o ejemplos cambia
+    el prompt renderizado y, con él, la clave: no hace falta invalidar a mano.
+    """
+    contenido = json.dumps([modelo, mensajes], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+class CacheCompletions:
+    """
+    Caché de completions con expulsión LRU y caducidad por TTL en memoria,
+    más una capa opcional en disco (SQLite) que sobrevive a los reinicios.
+    """
+
+    def __init__(self, max_entradas: int = 512, ttl: float = 86400.0, ruta_disco: str = None):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._memoria = OrderedDict()  # clave -> (creado, Respuesta)
+        self._disco = None
+        self._bloqueo_disco = threading.Lock()
+        if ruta_disco:
+            self._disco = sqlite3.connect(ruta_disco, check_same_thread=False)
+            self._disco.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "clave TEXT PRIMARY KEY, creado REAL, texto TEXT, tokens_prompt INTEGER, tokens_completion INTEGER)"
+            )
+            self._disco.execute("DELETE FROM completions WHERE creado < ?", (time.time() - ttl,))
+            self._disco.commit()
+        self.aciertos_memoria = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self.tokens_ahorrados = 0
+
+    async def obtener(self, clave: str):
+        entrada = self._memoria.get(clave)
+        if entrada is not None:
+            creado, respuesta = entrada
+            if time.time() - creado < self.ttl:
+                self._memoria.move_to_end(clave)
+                self.aciertos_memoria += 1
+                self.tokens_ahorrados += respuesta.tokens_prompt + respuesta.tokens_completion
+                return respuesta
+            del self._memoria[clave]
+        if self._disco is not None:
+            fila = await asyncio.to_thread(self._leer_disco, clave)
+            if fila is not None and time.time() - fila[0] < self.ttl:
+                respuesta = Respuesta(*fila[1:])
+                self._guardar_memoria(clave, fila[0], respuesta)
+                self.aciertos_disco += 1
+                self.tokens_ahorrados += respuesta.tokens_prompt + respuesta.tokens_completion
+                return respuesta
+        self.fallos += 1
+        return None
+
+    async def guardar(self, clave: str, respuesta: Respuesta):
+        creado = time.time()
+        self._guardar_memoria(clave, creado, respuesta)
+        if self._disco is not None:
+            await asyncio.to_thread(self._escribir_disco, clave, creado, respuesta)
+
+    def cerrar(self):
+        if self._disco is not None:
+            with self._bloqueo_disco:
+                self._disco.close()
+            self._disco = None
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos_memoria + self.aciertos_disco + self.fallos
+        return {
+            "entradas_memoria": len(self._memoria),
+            "aciertos_memoria": self.aciertos_memoria,
+            "aciertos_disco": self.aciertos_disco,
+            "fallos": self.fallos,
+            "tasa_aciertos": (self.aciertos_memoria + self.aciertos_disco) / consultas if consultas else 0.0,
+            "tokens_ahorrados": self.tokens_ahorrados,
+        }
+
+    def _guardar_memoria(self, clave: str, creado: float, respuesta: Respuesta):
+        self._memoria[clave] = (creado, respuesta)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    def _leer_disco(self, clave: str):
+        with self._bloqueo_disco:
+            return self._disco.execute(
+                "SELECT creado, texto, tokens_prompt, tokens_completion FROM completions WHERE clave = ?",
+                (clave,),
+            ).fetchone()
+
+    def _escribir_disco(self, clave: str, creado: float, respuesta: Respuesta):
+        with self._bloqueo_disco:
+            self._disco.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (clave, creado, respuesta.texto, respuesta.tokens_prompt, respuesta.tokens_completion),
+            )
+            self._disco.commit()
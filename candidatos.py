@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Candidato:
+    texto: str
+    id_ejemplo: int
+    tokens: int = 0
+    creado: float = field(default_factory=time.monotonic)
+
+
+class _BufferChat:
+    def __init__(self, chat_id: int, clave: tuple):
+        self.chat_id = chat_id
+        self.clave = clave
+        self.listos = deque()
+        self.pendientes = {}  # tarea -> ID de ejemplo
+        self.en_marcha = set()  # las pendientes que ya tienen su hueco y están llamando al LLM
+
+    def indices_usados(self) -> set:
+        return {c.id_ejemplo for c in self.listos} | set(self.pendientes.values())
+
+
+class GestorCandidatos:
+    """
+    Buffer por chat de posts pregenerados en segundo plano.
+    Mientras el usuario lee un post, se generan hasta `tamano` alternativas para
+    que "Reescribir" pueda responder sin esperar una llamada completa al LLM.
+    Los candidatos caducan a los `ttl` segundos y se descartan al cancelar.
+    Como mucho se mantienen buffers para `max_chats` chats (los más antiguos se descartan).
+    Solo `max_concurrencia` candidatos llaman al LLM a la vez, para que la
+    especulación no ocupe los huecos de las peticiones que alguien espera.
+    """
+
+    def __init__(self, tamano: int = 2, ttl: float = 600.0, max_chats: int = 1000, max_concurrencia: int = 2):
+        self.tamano = tamano
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self._buffers = {}
+        self.aciertos = 0
+        self.aciertos_en_vuelo = 0
+        self.fallos = 0
+        self.generados = 0
+        self.descartados = 0
+        self.cancelados = 0
+        self.tokens_usados = 0
+        self.tokens_desperdiciados = 0
+
+    def precargar(self, chat_id: int, clave: tuple, generar, elegir_indice):
+        """
+        Completa el buffer del chat hasta `tamano` candidatos.
+        `generar(indice)` es una corrutina que devuelve un Candidato y
+        `elegir_indice(excluir)` escoge el ejemplo para cada candidato nuevo.
+        """
+        if self.tamano <= 0:
+            return
+        buffer = self._buffers.get(chat_id)
+        if buffer is None or buffer.clave != clave:
+            self.cancelar(chat_id)
+            buffer = self._buffers[chat_id] = _BufferChat(chat_id, clave)
+            while len(self._buffers) > self.max_chats:
+                self.cancelar(next(iter(self._buffers)))
+        self._purgar(buffer)
+        while len(buffer.listos) + len(buffer.pendientes) < self.tamano:
+            indice = elegir_indice(buffer.indices_usados())
+            tarea = asyncio.create_task(self._generar(buffer, generar, indice))
+            buffer.pendientes[tarea] = indice
+            tarea.add_done_callback(lambda t, b=buffer: self._al_terminar(b, t))
+
+    async def tomar(self, chat_id: int, clave: tuple):
+        """
+        Devuelve el siguiente candidato para el chat, o None si no hay ninguno.
+        Si solo hay candidatos en vuelo se espera al primero que termine, que
+        siempre llega antes que una generación nueva; los que aún esperan su
+        turno para llamar al LLM no cuentan.
+        """
+        buffer = self._buffers.get(chat_id)
+        if buffer is None or buffer.clave != clave:
+            self.fallos += 1
+            return None
+        self._purgar(buffer)
+        if buffer.listos:
+            self.aciertos += 1
+            return buffer.listos.popleft()
+        while buffer.en_marcha:
+            hechas, _ = await asyncio.wait(list(buffer.en_marcha), return_when=asyncio.FIRST_COMPLETED)
+            for tarea in hechas:
+                self._al_terminar(buffer, tarea)
+            if buffer.listos:
+                self.aciertos_en_vuelo += 1
+                return buffer.listos.popleft()
+        self.fallos += 1
+        return None
+
+    def cancelar(self, chat_id: int):
+        """Descarta los candidatos del chat (post aceptado o tema nuevo)."""
+        buffer = self._buffers.pop(chat_id, None)
+        if buffer is None:
+            return
+        for tarea in list(buffer.pendientes):
+            if tarea.done():
+                self._al_terminar(buffer, tarea)
+            else:
+                tarea.cancel()
+                self.cancelados += 1
+        buffer.pendientes.clear()
+        while buffer.listos:
+            self._descartar(buffer.listos.popleft())
+
+    def estadisticas(self) -> dict:
+        peticiones = self.aciertos + self.aciertos_en_vuelo + self.fallos
+        return {
+            "chats": len(self._buffers),
+            "aciertos": self.aciertos,
+            "aciertos_en_vuelo": self.aciertos_en_vuelo,
+            "fallos": self.fallos,
+            "tasa_aciertos": (self.aciertos + self.aciertos_en_vuelo) / peticiones if peticiones else 0.0,
+            "generados": self.generados,
+            "descartados": self.descartados,
+            "cancelados": self.cancelados,
+            "tokens_usados": self.tokens_usados,
+            "tokens_desperdiciados": self.tokens_desperdiciados,
+        }
+
+    async def _generar(self, buffer: _BufferChat, generar, indice: int) -> Candidato:
+        async with self._semaforo:
+            buffer.en_marcha.add(asyncio.current_task())
+            return await generar(indice)
+
+    def _al_terminar(self, buffer: _BufferChat, tarea: asyncio.Task):
+        buffer.en_marcha.discard(tarea)
+        if buffer.pendientes.pop(tarea, None) is None:
+            return
+        if tarea.cancelled():
+            return
+        if tarea.exception() is not None:
+            logger.warning("Error pregenerando candidato: %s", tarea.exception())
+            return
+        candidato = tarea.result()
+        self.generados += 1
+        self.tokens_usados += candidato.tokens
+        if self._buffers.get(buffer.chat_id) is buffer:
+            buffer.listos.append(candidato)
+        else:
+            self._descartar(candidato)
+
+    def _purgar(self, buffer: _BufferChat):
+        limite = time.monotonic() - self.ttl
+        while buffer.listos and buffer.listos[0].creado < limite:
+            self._descartar(buffer.listos.popleft())
+
+    def _descartar(self, candidato: Candidato):
+        self.descartados += 1
+        self.tokens_desperdiciados += candidato.tokens
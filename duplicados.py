@@ -0,0 +1,183 @@
+import hashlib
+import operator
+import html
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+
+_ETIQUETA = re.compile(r"<[^>]+>")
+_ESPACIOS = re.compile(r"\s+")
+_VACIA = 1 << 32
+_DESPLAZAMIENTO = 1 << 33
+
+
+def normalizar(texto: str) -> str:
+    """Quita el formato HTML, unifica Unicode y mayúsculas y colapsa los espacios."""
+    texto = html.unescape(_ETIQUETA.sub(" ", texto))
+    texto = unicodedata.normalize("NFKC", texto).casefold()
+    return _ESPACIOS.sub(" ", texto).strip()
+
+
+def hash_normalizado(texto: str) -> str:
+    return hashlib.sha1(normalizar(texto).encode("utf-8")).hexdigest()
+
+
+class _IndiceTipo:
+    def __init__(self):
+        self.exactos = defaultdict(set)   # hash normalizado -> claves
+        self.cubetas = defaultdict(set)   # (banda, valores) -> claves
+        self.firmas = {}                  # clave -> (hash normalizado, firma MinHash)
+
+
+class IndiceDuplicados:
+    """
+    Índice de ejemplos por tipo de post para detectar duplicados.
+    Los duplicados exactos (tras normalizar) se encuentran por hash en O(1).
+    Los casi duplicados se buscan con firmas MinHash sobre shingles de
+    caracteres agrupadas en cubetas LSH; los candidatos se confirman con la
+    similitud de Jaccard estimada frente a `umbral`.
+    Las claves son los IDs estables de los ejemplos: borrar uno solo quita su
+    entrada, sin tocar las de los demás.
+    """
+
+    def __init__(self, umbral: float = 0.8, permutaciones: int = 64, bandas: int = 8, shingle: int = 5):
+        if permutaciones % bandas:
+            raise ValueError("permutaciones debe ser múltiplo de bandas")
+        self.umbral = umbral
+        self.bandas = bandas
+        self.filas = permutaciones // bandas
+        self.shingle = shingle
+        self.permutaciones = permutaciones
+        self._tipos = defaultdict(_IndiceTipo)
+
+    def firma(self, normalizado: str) -> tuple:
+        """
+        Firma MinHash de una sola permutación: cada shingle se reparte por su hash
+        en una de las `permutaciones` casillas y se guarda el mínimo de cada una.
+        Las casillas vacías toman el valor de la siguiente ocupada (densificación
+        por rotación), así el coste es lineal en el número de shingles.
+        """
+        k = self.shingle
+        if len(normalizado) <= k:
+            shingles = {normalizado}
+        else:
+            shingles = {normalizado[i:i + k] for i in range(len(normalizado) - k + 1)}
+        casillas = self.permutaciones
+        firma = [_VACIA] * casillas
+        for shingle in shingles:
+            valor = zlib.crc32(shingle.encode("utf-8"))
+            casilla, rango = valor % casillas, valor // casillas
+            if rango < firma[casilla]:
+                firma[casilla] = rango
+        if _VACIA in firma:
+            ocupadas = [i for i, v in enumerate(firma) if v != _VACIA]
+            for i in range(casillas):
+                if firma[i] == _VACIA:
+                    siguiente = next((j for j in ocupadas if j > i), ocupadas[0])
+                    # El desplazamiento distingue valores prestados de valores propios
+                    firma[i] = firma[siguiente] + (siguiente - i) % casillas * _DESPLAZAMIENTO
+        return tuple(firma)
+
+    def similitud(self, firma_a: tuple, firma_b: tuple) -> float:
+        return sum(map(operator.eq, firma_a, firma_b)) / len(firma_a)
+
+    def agregar(self, tipo: str, clave, texto: str):
+        indice = self._tipos[tipo]
+        normalizado = normalizar(texto)
+        exacto = hashlib.sha1(normalizado.encode("utf-8")).hexdigest()
+        firma = self.firma(normalizado)
+        indice.exactos[exacto].add(clave)
+        for banda in self._bandas(firma):
+            indice.cubetas[banda].add(clave)
+        indice.firmas[clave] = (exacto, firma)
+
+    def quitar(self, tipo: str, clave):
+        indice = self._tipos.get(tipo)
+        if indice is None or clave not in indice.firmas:
+            return
+        exacto, firma = indice.firmas.pop(clave)
+        indice.exactos[exacto].discard(clave)
+        if not indice.exactos[exacto]:
+            del indice.exactos[exacto]
+        for banda in self._bandas(firma):
+            indice.cubetas[banda].discard(clave)
+            if not indice.cubetas[banda]:
+                del indice.cubetas[banda]
+
+    def reconstruir(self, tipo: str, ejemplos):
+        """Indexa de cero el tipo a partir de pares (clave, texto)."""
+        self._tipos.pop(tipo, None)
+        for clave, texto in ejemplos:
+            self.agregar(tipo, clave, texto)
+
+    def renombrar_tipo(self, tipo: str, nuevo: str):
+        if tipo in self._tipos:
+            self._tipos[nuevo] = self._tipos.pop(tipo)
+
+    def eliminar_tipo(self, tipo: str):
+        self._tipos.pop(tipo, None)
+
+    def exacto(self, tipo: str, texto: str):
+        """Clave de un ejemplo con el mismo texto normalizado, o None."""
+        indice = self._tipos.get(tipo)
+        if indice is None:
+            return None
+        claves = indice.exactos.get(hash_normalizado(texto))
+        return min(claves) if claves else None
+
+    def buscar(self, tipo: str, texto: str, excluir=None):
+        """
+        Devuelve (clave, similitud) del ejemplo más parecido a `texto` que supere
+        el umbral, o None. Un duplicado exacto devuelve similitud 1.0, pero una
+        similitud estimada de 1.0 no implica que lo sea: para eso, exacto().
+        """
+        indice = self._tipos.get(tipo)
+        if indice is None:
+            return None
+        normalizado = normalizar(texto)
+        exacto = hashlib.sha1(normalizado.encode("utf-8")).hexdigest()
+        for clave in indice.exactos.get(exacto, ()):
+            if clave != excluir:
+                return clave, 1.0
+        if self.umbral >= 1:
+            return None
+        firma = self.firma(normalizado)
+        candidatos = set()
+        for banda in self._bandas(firma):
+            candidatos |= indice.cubetas.get(banda, set())
+        candidatos.discard(excluir)
+        mejor = None
+        for clave in candidatos:
+            similitud = self.similitud(firma, indice.firmas[clave][1])
+            if similitud >= self.umbral and (mejor is None or similitud > mejor[1]):
+                mejor = (clave, similitud)
+        return mejor
+
+    def duplicados(self, tipo: str) -> list:
+        """
+        Claves que sobran en el tipo: para cada grupo de ejemplos duplicados o
+        casi duplicados se conserva el de clave más baja (el ID más antiguo).
+        """
+        indice = self._tipos.get(tipo)
+        if indice is None:
+            return []
+        sobrantes = set()
+        for clave in sorted(indice.firmas):
+            if clave in sobrantes:
+                continue
+            exacto, firma = indice.firmas[clave]
+            sobrantes |= {otra for otra in indice.exactos[exacto] if otra > clave}
+            if self.umbral < 1:
+                candidatos = set()
+                for banda in self._bandas(firma):
+                    candidatos |= indice.cubetas[banda]
+                sobrantes |= {
+                    otra for otra in candidatos
+                    if otra > clave and self.similitud(firma, indice.firmas[otra][1]) >= self.umbral
+                }
+        return sorted(sobrantes)
+
+    def _bandas(self, firma: tuple):
+        r = self.filas
+        return [(b, firma[b * r:(b + 1) * r]) for b in range(self.bandas)]
@@ -0,0 +1,319 @@
+"""
+Modo multiproceso (TRABAJADORES > 1). Este proceso recibe los updates, por
+polling o por webhook, y los reparte entre N trabajadores. Cada trabajador
+es un bot.py normal en modo webhook, escuchando solo en 127.0.0.1. El reparto
+usa hash consistente del chat: todos los updates de un chat van al mismo
+trabajador, en orden, y si cambia el número de trabajadores solo se mueve
+~1/N de los chats.
+
+El estado compartido vive en SQLite (WAL), así que cualquier trabajador
+puede continuar la conversación de un chat que le llegue:
+- la configuración, en ALMACEN_SQLITE; cada trabajador aplica las escrituras
+  de los demás con AlmacenSQLite.sincronizar() antes de cada update;
+- las conversaciones, en SESIONES_SQLITE (ver sesiones.py). Como el reparto
+  es por chat, cada trabajador solo usa las de sus chats y las tiene en
+  memoria; las lee de SQLite al arrancar o si le llega un chat nuevo.
+"""
+import asyncio
+import bisect
+import dataclasses
+import hashlib
+import logging
+import os
+import secrets
+import signal
+import sys
+import time
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from ajustes import Ajustes
+from almacen import AlmacenSQLite
+from planificador import clave_chat
+from sesiones import GestorSesiones
+from webhook import ServidorWebhook
+
+logger = logging.getLogger(__name__)
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+RUTA_TRABAJADOR = "/update"
+SESIONES_POR_DEFECTO = "sesiones.db"
+# Lo que ya se leyó de Telegram se entrega a los trabajadores antes de pararlos
+DRENAR_TRABAJADORES = 10.0
+
+
+def _hash(texto: str) -> int:
+    return int.from_bytes(hashlib.md5(texto.encode("utf-8")).digest()[:8], "big")
+
+
+class AnilloHash:
+    """Hash consistente con `replicas` puntos virtuales por nodo para repartir las claves por igual."""
+
+    def __init__(self, nodos, replicas: int = 100):
+        self._puntos = sorted((_hash(f"{nodo}:{replica}"), nodo) for nodo in nodos for replica in range(replicas))
+        self._hashes = [punto for punto, _ in self._puntos]
+
+    def nodo(self, clave):
+        posicion = bisect.bisect(self._hashes, _hash(str(clave))) % len(self._puntos)
+        return self._puntos[posicion][1]
+
+
+def es_mio(ajustes: Ajustes, chat_id) -> bool:
+    """Si los updates de `chat_id` le tocan a este proceso (siempre, si no hay trabajadores)."""
+    if ajustes.trabajador is None:
+        return True
+    return AnilloHash(range(ajustes.trabajadores)).nodo(chat_id) == ajustes.trabajador
+
+
+class Trabajador:
+    def __init__(self, indice: int, puerto: int, entorno: dict):
+        self.indice = indice
+        self.puerto = puerto
+        self.entorno = entorno
+        self.proceso = None
+        self.cola = asyncio.Queue()
+        self.enviados = 0
+        self.reintentos = 0
+        self.reinicios = 0
+
+    async def arrancar(self):
+        # En su propio grupo de procesos: Ctrl+C llega solo al enrutador, que los para en orden
+        self.proceso = await asyncio.create_subprocess_exec(
+            sys.executable, BOT, env=self.entorno, start_new_session=True,
+        )
+
+    def estadisticas(self) -> dict:
+        return {
+            "pid": self.proceso.pid if self.proceso else None,
+            "en_cola": self.cola.qsize(),
+            "enviados": self.enviados,
+            "reintentos": self.reintentos,
+            "reinicios": self.reinicios,
+        }
+
+
+class Enrutador:
+    """
+    Reparte los updates de `update_queue` entre los trabajadores. Expone `bot`
+    y `update_queue` como una Application, así ServidorWebhook le entrega los
+    updates igual que a un bot de un solo proceso.
+    """
+
+    def __init__(self, ajustes: Ajustes, bot: Bot):
+        self.ajustes = ajustes
+        self.bot = bot
+        self.update_queue = asyncio.Queue()
+        self.anillo = AnilloHash(range(ajustes.trabajadores))
+        self.ruta_sesiones = ajustes.sesiones_sqlite or SESIONES_POR_DEFECTO
+        self._secreto = secrets.token_hex(16)
+        self.trabajadores = [
+            Trabajador(indice, ajustes.trabajadores_puerto + indice, self._entorno(indice))
+            for indice in range(ajustes.trabajadores)
+        ]
+        self._tareas = []
+        self._parando = False
+        self.sin_chat = 0
+
+    def _entorno(self, indice: int) -> dict:
+        ajustes = dataclasses.replace(
+            self.ajustes,
+            trabajador=indice,
+            modo="webhook",
+            webhook_url=None,
+            webhook_host="127.0.0.1",
+            webhook_puerto=self.ajustes.trabajadores_puerto + indice,
+            webhook_ruta=RUTA_TRABAJADOR,
+            webhook_secreto=self._secreto,
+            webhook_drenar=max(self.ajustes.webhook_drenar, DRENAR_TRABAJADORES),
+            sesiones_sqlite=self.ruta_sesiones,
+            # El límite global de Telegram es por bot: se reparte entre los trabajadores
+            salida_por_segundo=self.ajustes.salida_por_segundo / self.ajustes.trabajadores,
+            metricas_puerto=self.ajustes.metricas_puerto + indice if self.ajustes.metricas_puerto else 0,
+        )
+        entorno = dict(os.environ)
+        for nombre, valor in ajustes.a_entorno().items():
+            if valor is None:
+                entorno.pop(nombre, None)
+            else:
+                entorno[nombre] = valor
+        return entorno
+
+    async def iniciar(self, timeout: float = 60.0):
+        # Esquemas, WAL y la migración de config.json, una sola vez antes de que haya concurrencia
+        almacen = AlmacenSQLite(self.ajustes.almacen_sqlite)
+        almacen.migrar_desde_json(self.ajustes.config_file)
+        await almacen.cerrar()
+        GestorSesiones(self.ruta_sesiones).cerrar()
+
+        for trabajador in self.trabajadores:
+            await trabajador.arrancar()
+        await asyncio.gather(*(self._esperar(trabajador, timeout) for trabajador in self.trabajadores))
+        for trabajador in self.trabajadores:
+            self._tareas.append(asyncio.create_task(self._enviar(trabajador)))
+            self._tareas.append(asyncio.create_task(self._supervisar(trabajador)))
+        self._tareas.append(asyncio.create_task(self._repartir()))
+        logger.info("%d trabajadores listos en los puertos %d-%d", len(self.trabajadores),
+                    self.trabajadores[0].puerto, self.trabajadores[-1].puerto)
+
+    async def detener(self):
+        try:
+            await asyncio.wait_for(self._drenar(), DRENAR_TRABAJADORES)
+        except asyncio.TimeoutError:
+            logger.warning("Quedaron updates sin entregar a los trabajadores: %s", self.estadisticas())
+        self._parando = True
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        arrancados = [trabajador for trabajador in self.trabajadores if trabajador.proceso is not None]
+        for trabajador in arrancados:
+            if trabajador.proceso.returncode is None:
+                trabajador.proceso.send_signal(signal.SIGTERM)
+        for trabajador in arrancados:
+            try:
+                await asyncio.wait_for(trabajador.proceso.wait(), 30)
+            except asyncio.TimeoutError:
+                logger.warning("El trabajador %d no terminó a tiempo", trabajador.indice)
+                trabajador.proceso.kill()
+
+    def estadisticas(self) -> dict:
+        return {
+            "sin_chat": self.sin_chat,
+            "trabajadores": {trabajador.indice: trabajador.estadisticas() for trabajador in self.trabajadores},
+        }
+
+    async def _drenar(self):
+        await self.update_queue.join()
+        await asyncio.gather(*(trabajador.cola.join() for trabajador in self.trabajadores))
+
+    async def _esperar(self, trabajador: Trabajador, timeout: float):
+        """Espera a que el servidor del trabajador acepte conexiones."""
+        limite = time.monotonic() + timeout
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", trabajador.puerto)
+                writer.close()
+                return
+            except OSError:
+                if trabajador.proceso.returncode is not None or time.monotonic() > limite:
+                    raise RuntimeError(f"El trabajador {trabajador.indice} no ha arrancado; revisa su log")
+                await asyncio.sleep(0.1)
+
+    async def _repartir(self):
+        while True:
+            update = await self.update_queue.get()
+            clave = clave_chat(update)
+            if clave is None:
+                # Sin chat no hay orden que respetar: se reparte por update
+                clave = update.update_id
+                self.sin_chat += 1
+            self.trabajadores[self.anillo.nodo(clave)].cola.put_nowait(update.to_json().encode("utf-8"))
+            self.update_queue.task_done()
+
+    async def _enviar(self, trabajador: Trabajador):
+        """
+        Una conexión keep-alive por trabajador y un update cada vez: el orden
+        de llegada se conserva. Si el trabajador se cae, se reintenta el mismo
+        update hasta que vuelva (puede llegarle dos veces si cayó justo al recibirlo).
+        """
+        cabeceras = (
+            f"POST {RUTA_TRABAJADOR} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {self._secreto}\r\n"
+        ).encode()
+        reader = writer = None
+        while True:
+            cuerpo = await trabajador.cola.get()
+            espera = 0.05
+            while True:
+                try:
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection("127.0.0.1", trabajador.puerto)
+                    writer.write(cabeceras + f"Content-Length: {len(cuerpo)}\r\n\r\n".encode() + cuerpo)
+                    await writer.drain()
+                    estado = await reader.readline()
+                    while (await reader.readline()) not in (b"\r\n", b""):
+                        pass
+                    if not estado:
+                        raise ConnectionResetError("El trabajador cerró la conexión")
+                    break
+                except OSError:
+                    if writer is not None:
+                        writer.close()
+                    reader = writer = None
+                    trabajador.reintentos += 1
+                    await asyncio.sleep(espera)
+                    espera = min(espera * 2, 1.0)
+            if b" 200 " in estado:
+                trabajador.enviados += 1
+            else:
+                logger.warning("El trabajador %d rechazó un update: %r", trabajador.indice, estado)
+            trabajador.cola.task_done()
+
+    async def _supervisar(self, trabajador: Trabajador):
+        while True:
+            codigo = await trabajador.proceso.wait()
+            if self._parando:
+                return
+            trabajador.reinicios += 1
+            logger.error("El trabajador %d terminó con código %s; se reinicia", trabajador.indice, codigo)
+            await asyncio.sleep(1)
+            await trabajador.arrancar()
+
+
+async def _polling(enrutador: Enrutador, bot: Bot):
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.warning("Error en getUpdates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                enrutador.update_queue.put_nowait(update)
+                offset = update.update_id + 1
+    finally:
+        if offset is not None:
+            # Confirma a Telegram los últimos updates leídos para que no los reenvíe
+            await bot.get_updates(offset=offset, timeout=0, limit=1)
+
+
+async def ejecutar_enrutador(ajustes: Ajustes):
+    """
+    Equivalente a `application.run_polling()` o a ejecutar_webhook() con
+    TRABAJADORES procesos detrás; espera a SIGINT/SIGTERM para apagarse.
+    """
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(senal, parar.set)
+
+    bot = Bot(ajustes.telegram_bot_token, base_url=ajustes.telegram_base_url)
+    enrutador = Enrutador(ajustes, bot)
+    async with bot:
+        try:
+            await enrutador.iniciar()
+            if ajustes.modo == "webhook":
+                servidor = ServidorWebhook(
+                    enrutador, ruta=ajustes.webhook_ruta, secreto=ajustes.webhook_secreto,
+                    sin_secreto=ajustes.webhook_sin_secreto,
+                )
+                puerto = await servidor.iniciar(ajustes.webhook_host, ajustes.webhook_puerto)
+                if ajustes.webhook_url:
+                    await bot.set_webhook(
+                        ajustes.webhook_url, secret_token=ajustes.webhook_secreto, allowed_updates=Update.ALL_TYPES
+                    )
+                logger.info("Webhook escuchando en %s:%d%s", ajustes.webhook_host, puerto, ajustes.webhook_ruta)
+                await parar.wait()
+                await servidor.detener(ajustes.webhook_drenar)
+                logger.info("Webhook: %s", servidor.estadisticas())
+            else:
+                await bot.delete_webhook()
+                polling = asyncio.create_task(_polling(enrutador, bot))
+                await parar.wait()
+                polling.cancel()
+                await asyncio.gather(polling, return_exceptions=True)
+        finally:
+            await enrutador.detener()
+            logger.info("Enrutador: %s", enrutador.estadisticas())
@@ -0,0 +1,144 @@
+import html
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+
+@dataclass
+class _Etiqueta:
+    inicio: int
+    fin: int
+    orden: int
+    apertura: str
+    cierre: str
+
+
+def mapa_utf16(text: str) -> list:
+    """
+    Devuelve una lista que traduce cada offset UTF-16 (el que usa Telegram) al
+    índice correspondiente en la cadena de Python. Se construye una sola vez por
+    mensaje; los caracteres fuera del BMP ocupan dos posiciones.
+    """
+    mapa = []
+    for i, ch in enumerate(text):
+        mapa.append(i)
+        if ord(ch) >= 0x10000:
+            mapa.append(i + 1)
+    mapa.append(len(text))
+    return mapa
+
+
+def _etiquetas_html(ent):
+    """Etiquetas de apertura y cierre para una entidad, o None si no lleva formato."""
+    tipo = ent.type
+    if tipo == "bold":
+        return "<b>", "</b>"
+    if tipo == "italic":
+        return "<i>", "</i>"
+    if tipo == "underline":
+        return "<u>", "</u>"
+    if tipo == "strikethrough":
+        return "<s>", "</s>"
+    if tipo == "spoiler":
+        return "<tg-spoiler>", "</tg-spoiler>"
+    if tipo == "code":
+        return "<code>", "</code>"
+    if tipo == "pre":
+        if getattr(ent, "language", None):
+            return f'<pre><code class="language-{html.escape(ent.language)}">', "</code></pre>"
+        return "<pre>", "</pre>"
+    if tipo == "blockquote":
+        return "<blockquote>", "</blockquote>"
+    if tipo == "expandable_blockquote":
+        return "<blockquote expandable>", "</blockquote>"
+    if tipo == "text_link":
+        return f'<a href="{html.escape(ent.url)}">', "</a>"
+    if tipo == "text_mention":
+        return f'<a href="tg://user?id={ent.user.id}">', "</a>"
+    if tipo == "custom_emoji":
+        return f'<tg-emoji emoji-id="{html.escape(ent.custom_emoji_id)}">', "</tg-emoji>"
+    return None
+
+
+def convert_entities_to_html(message) -> str:
+    """
+    Reconstruye el texto formateado en HTML a partir de las entidades que envía Telegram.
+    Recorre el texto una sola vez: abre y cierra etiquetas en cada frontera de
+    entidad, escapa el texto intermedio y junta las partes al final. Las
+    entidades anidadas se emiten como tales; si dos se solapan sin anidarse, la
+    interior se cierra y se vuelve a abrir para que el HTML siga siendo válido.
+    """
+    if not message.entities:
+        return message.text
+
+    text = message.text
+    mapa = mapa_utf16(text)
+    ultimo = len(mapa) - 1
+    aperturas = defaultdict(list)
+    fronteras = set()
+    for orden, ent in enumerate(message.entities):
+        etiquetas = _etiquetas_html(ent)
+        if etiquetas is None:
+            continue
+        inicio = mapa[min(ent.offset, ultimo)]
+        fin = mapa[min(ent.offset + ent.length, ultimo)]
+        if inicio >= fin:
+            continue
+        aperturas[inicio].append(_Etiqueta(inicio, fin, orden, *etiquetas))
+        fronteras.update((inicio, fin))
+
+    partes = []
+    pila = []
+    cierres = Counter()
+    anterior = 0
+    for pos in sorted(fronteras):
+        partes.append(html.escape(text[anterior:pos], quote=False))
+        anterior = pos
+        reabrir = []
+        while cierres[pos]:
+            etiqueta = pila.pop()
+            partes.append(etiqueta.cierre)
+            cierres[etiqueta.fin] -= 1
+            if etiqueta.fin != pos:
+                reabrir.append(etiqueta)
+        # Las que terminan más tarde quedan por fuera
+        nuevas = reabrir + aperturas.get(pos, [])
+        nuevas.sort(key=lambda e: (-e.fin, e.orden))
+        for etiqueta in nuevas:
+            partes.append(etiqueta.apertura)
+            pila.append(etiqueta)
+            cierres[etiqueta.fin] += 1
+    partes.append(html.escape(text[anterior:], quote=False))
+    return "".join(partes)
+
+
+_ETIQUETA_HTML = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+_FINAL_INCOMPLETO = re.compile(r"<[^>]*$|&[#\w]*$")
+
+
+def cerrar_html_parcial(texto: str) -> str:
+    """
+    Convierte un HTML a medio generar en uno válido para Telegram: quita la
+    etiqueta o entidad cortada al final, descarta cierres sin apertura y cierra
+    las etiquetas que siguen abiertas.
+    """
+    texto = _FINAL_INCOMPLETO.sub("", texto)
+    partes = []
+    abiertas = []
+    anterior = 0
+    for coincidencia in _ETIQUETA_HTML.finditer(texto):
+        partes.append(texto[anterior:coincidencia.start()])
+        anterior = coincidencia.end()
+        cierre, nombre = coincidencia.group(1), coincidencia.group(2).lower()
+        if not cierre:
+            abiertas.append(nombre)
+            partes.append(coincidencia.group(0))
+        elif nombre in abiertas:
+            while abiertas:
+                abierta = abiertas.pop()
+                partes.append(f"</{abierta}>")
+                if abierta == nombre:
+                    break
+    partes.append(texto[anterior:])
+    partes.extend(f"</{nombre}>" for nombre in reversed(abiertas))
+    return "".join(partes)
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Vuelo:
+    __slots__ = ("clave", "tarea")
+
+    def __init__(self, clave, tarea):
+        self.clave = clave
+        self.tarea = tarea
+
+
+class GeneracionesEnVuelo:
+    """
+    Como mucho una generación en vuelo por chat. Si llega otra petición
+    idéntica mientras la primera sigue en curso, se une a ella y no se lanza
+    una nueva llamada; si llega una distinta, sustituye a la anterior, que se
+    cancela (la cancelación corta también la petición HTTP al modelo).
+    El resultado solo se presenta si la generación sigue siendo la vigente.
+    """
+
+    def __init__(self):
+        self._vuelos = {}
+        self.lanzadas = 0
+        self.coalescidas = 0
+        self.canceladas = 0
+
+    def lanzar(self, chat_id, clave, generar, presentar, al_cancelar=None) -> bool:
+        """
+        Lanza `await generar()` en segundo plano y después `await presentar(resultado)`.
+        `al_cancelar()` se llama si otra petición la sustituye antes de terminar.
+        Devuelve False si la petición se ha unido a una idéntica en curso.
+        """
+        vuelo = self._vuelos.get(chat_id)
+        if vuelo is not None:
+            if vuelo.clave == clave:
+                self.coalescidas += 1
+                return False
+            self.canceladas += 1
+            vuelo.tarea.cancel()
+        self.lanzadas += 1
+        tarea = asyncio.create_task(self._volar(chat_id, generar, presentar, al_cancelar))
+        self._vuelos[chat_id] = _Vuelo(clave, tarea)
+        return True
+
+    def cancelar(self, chat_id) -> bool:
+        vuelo = self._vuelos.pop(chat_id, None)
+        if vuelo is None:
+            return False
+        self.canceladas += 1
+        vuelo.tarea.cancel()
+        return True
+
+    async def cerrar(self):
+        tareas = [vuelo.tarea for vuelo in self._vuelos.values()]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    def estadisticas(self, tokens_prompt_medio: float = 0.0, tokens_completion_medio: float = 0.0) -> dict:
+        # Una petición unida se ahorra la llamada entera; una cancelada, al menos la respuesta
+        return {
+            "lanzadas": self.lanzadas,
+            "coalescidas": self.coalescidas,
+            "canceladas": self.canceladas,
+            "en_vuelo": len(self._vuelos),
+            "tokens_ahorrados_estimados": round(
+                self.coalescidas * (tokens_prompt_medio + tokens_completion_medio)
+                + self.canceladas * tokens_completion_medio
+            ),
+        }
+
+    async def _volar(self, chat_id, generar, presentar, al_cancelar):
+        tarea = asyncio.current_task()
+        try:
+            resultado = await generar()
+        except asyncio.CancelledError:
+            if al_cancelar is not None:
+                try:
+                    await asyncio.shield(al_cancelar())
+                except Exception as e:
+                    logger.debug("Error al limpiar una generación cancelada: %s", e)
+            raise
+        except Exception as e:
+            logger.error("Error en una generación del chat %s: %s", chat_id, e)
+            return
+        finally:
+            vuelo = self._vuelos.get(chat_id)
+            if vuelo is not None and vuelo.tarea is tarea:
+                del self._vuelos[chat_id]
+        # Ya fuera del registro: una petición nueva no puede cortar la presentación a medias
+        try:
+            await presentar(resultado)
+        except Exception as e:
+            logger.error("Error al presentar una generación del chat %s: %s", chat_id, e)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorGeneracion(Exception):
+    """No se pudo obtener una completion, ni con reintentos ni con el respaldo."""
+
+
+@dataclass
+class Respuesta:
+    texto: str
+    tokens_prompt: int = 0
+    tokens_completion: int = 0
+
+
+class ClienteLLM:
+    """
+    Cliente asíncrono de completions con conexiones HTTP reutilizadas.
+    Limita cuántas peticiones hay en vuelo a la vez y aplica dos timeouts:
+    uno por petición HTTP y otro total (incluida la espera por un hueco libre).
+    """
+
+    def __init__(self, api_key: str, base_url: str = None, max_concurrencia: int = 8,
+                 max_conexiones: int = 20, timeout_peticion: float = 30.0, timeout_total: float = 90.0,
+                 max_reintentos: int = 2):
+        # openai y httpx se importan aquí: ErrorGeneracion y Respuesta no los necesitan
+        # y el bot arranca sin pagar su importación hasta la primera completion
+        import httpx
+        from openai import AsyncOpenAI
+
+        self.timeout_total = timeout_total
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_conexiones, max_keepalive_connections=max_conexiones),
+            timeout=httpx.Timeout(timeout_peticion, connect=5.0),
+        )
+        self._cliente = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url or None,
+            http_client=self._http,
+            timeout=timeout_peticion,
+            max_retries=max_reintentos,
+        )
+
+    async def completar(self, mensajes: list, modelo: str, **kwargs) -> Respuesta:
+        return await asyncio.wait_for(self._completar(mensajes, modelo, **kwargs), self.timeout_total)
+
+    async def _completar(self, mensajes: list, modelo: str, **kwargs) -> Respuesta:
+        async with self._semaforo:
+            response = await self._cliente.chat.completions.create(model=modelo, messages=mensajes, **kwargs)
+        usage = response.usage
+        eleccion = response.choices[0]
+        if eleccion.message.content is None:
+            # Sin texto (p. ej. cortado por el filtro de contenido): no hay post que mostrar
+            raise ErrorGeneracion(f"Respuesta sin contenido (finish_reason={eleccion.finish_reason})")
+        return Respuesta(
+            texto=eleccion.message.content.strip(),
+            tokens_prompt=usage.prompt_tokens if usage else 0,
+            tokens_completion=usage.completion_tokens if usage else 0,
+        )
+
+    async def completar_stream(self, mensajes: list, modelo: str, al_fragmento, **kwargs) -> Respuesta:
+        """Como completar, pero llama a `al_fragmento(texto)` con cada trozo según llega."""
+        return await asyncio.wait_for(self._completar_stream(mensajes, modelo, al_fragmento, **kwargs), self.timeout_total)
+
+    async def _completar_stream(self, mensajes: list, modelo: str, al_fragmento, **kwargs) -> Respuesta:
+        partes = []
+        usage = None
+        async with self._semaforo:
+            stream = await self._cliente.chat.completions.create(
+                model=modelo, messages=mensajes, stream=True, stream_options={"include_usage": True}, **kwargs
+            )
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    partes.append(chunk.choices[0].delta.content)
+                    al_fragmento(chunk.choices[0].delta.content)
+        return Respuesta(
+            texto="".join(partes).strip(),
+            tokens_prompt=usage.prompt_tokens if usage else 0,
+            tokens_completion=usage.completion_tokens if usage else 0,
+        )
+
+    async def cerrar(self):
+        await self._cliente.close()
+        await self._http.aclose()
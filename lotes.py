@@ -0,0 +1,181 @@
+import asyncio
+import csv
+import html
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+
+logger = logging.getLogger(__name__)
+
+MAX_TEMAS = 500
+_CABECERAS = {"tema", "temas", "topic", "topics", "idea"}
+
+
+def leer_temas(texto: str, nombre: str = "") -> list:
+    """
+    Temas de un CSV (primera columna, con o sin cabecera) o de un texto con
+    un tema por línea. Se ignoran las líneas vacías.
+    """
+    if nombre.lower().endswith(".csv"):
+        filas = [fila[0].strip() for fila in csv.reader(io.StringIO(texto)) if fila and fila[0].strip()]
+        if filas and filas[0].lower() in _CABECERAS:
+            filas = filas[1:]
+    else:
+        filas = [linea.strip() for linea in texto.splitlines() if linea.strip()]
+    return filas[:MAX_TEMAS]
+
+
+@dataclass
+class Lote:
+    id: str
+    chat_id: int
+    tipo_post: str
+    temas: list
+    resultados: dict = field(default_factory=dict)   # fila (str) -> {"post" | "error", "segundos"}
+    mensaje_id: int = None
+    creado: float = field(default_factory=time.time)
+    segundos: float = 0.0                             # tiempo de pared acumulado entre ejecuciones
+
+    @property
+    def completados(self) -> int:
+        return len(self.resultados)
+
+    @property
+    def terminado(self) -> bool:
+        return len(self.resultados) >= len(self.temas)
+
+    @property
+    def errores(self) -> int:
+        return sum("error" in r for r in self.resultados.values())
+
+    @property
+    def segundos_en_serie(self) -> float:
+        """Lo que habría tardado generando los posts de uno en uno."""
+        return sum(r["segundos"] for r in self.resultados.values())
+
+
+class GestorLotes:
+    """
+    Genera posts en lote con concurrencia limitada. Cada lote se guarda en
+    `directorio` tras cada fila, así que si el bot se reinicia a mitad se
+    retoma generando solo las filas que faltan.
+    """
+
+    def __init__(self, directorio: str = "lotes", concurrencia: int = 4):
+        self.directorio = directorio
+        self.concurrencia = concurrencia
+        self._bloqueo = asyncio.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+    def crear(self, chat_id: int, tipo_post: str, temas: list) -> Lote:
+        lote = Lote(uuid.uuid4().hex[:12], chat_id, tipo_post, temas)
+        self._escribir(lote)
+        return lote
+
+    def pendientes(self) -> list:
+        """Lotes de una ejecución anterior que no llegaron a entregarse."""
+        lotes = []
+        for nombre in sorted(os.listdir(self.directorio)):
+            if not nombre.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directorio, nombre), encoding="utf-8") as file:
+                    lote = Lote(**json.load(file))
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning("No se pudo leer el lote %s: %s", nombre, e)
+                continue
+            lotes.append(lote)
+        return lotes
+
+    async def guardar(self, lote: Lote):
+        # Las filas terminan a la vez: las escrituras se hacen de una en una
+        async with self._bloqueo:
+            datos = json.dumps(asdict(lote), ensure_ascii=False)
+            await asyncio.to_thread(self._escribir_datos, lote.id, datos)
+
+    async def ejecutar(self, lote: Lote, generar, al_progreso=None):
+        """
+        Genera las filas que faltan con `await generar(tema)` y llama a
+        `al_progreso(lote)` tras cada una. Un error en una fila se guarda
+        en su resultado y no detiene el resto.
+        """
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        inicio = time.perf_counter()
+        segundos_previos = lote.segundos
+
+        async def fila(indice: int, tema: str):
+            async with semaforo:
+                comienzo = time.perf_counter()
+                try:
+                    resultado = {"post": await generar(tema)}
+                except Exception as e:
+                    resultado = {"error": str(e) or type(e).__name__}
+                resultado["segundos"] = time.perf_counter() - comienzo
+            lote.resultados[str(indice)] = resultado
+            lote.segundos = segundos_previos + time.perf_counter() - inicio
+            await self.guardar(lote)
+            if al_progreso is not None:
+                await al_progreso(lote)
+
+        await asyncio.gather(*(
+            fila(indice, tema) for indice, tema in enumerate(lote.temas) if str(indice) not in lote.resultados
+        ))
+
+    def borrar(self, lote: Lote):
+        try:
+            os.remove(self._ruta(lote.id))
+        except FileNotFoundError:
+            pass
+
+    def documento_json(self, lote: Lote) -> bytes:
+        posts, errores = [], []
+        for indice, tema in enumerate(lote.temas):
+            resultado = lote.resultados.get(str(indice), {})
+            if "post" in resultado:
+                posts.append({"fila": indice + 1, "tema": tema, "post": resultado["post"]})
+            else:
+                errores.append({"fila": indice + 1, "tema": tema, "error": resultado.get("error", "sin generar")})
+        return json.dumps(
+            {"tipo_post": lote.tipo_post, "posts": posts, "errores": errores},
+            ensure_ascii=False, indent=2,
+        ).encode("utf-8")
+
+    def documento_html(self, lote: Lote) -> bytes:
+        datos = json.loads(self.documento_json(lote))
+        partes = [
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">",
+            f"<title>Posts: {html.escape(lote.tipo_post)}</title></head><body>",
+            f"<h1>{html.escape(lote.tipo_post)}</h1>",
+        ]
+        for post in datos["posts"]:
+            # Los posts ya vienen en el HTML de Telegram; se muestran tal cual
+            partes.append(
+                f"<section><h2>{post['fila']}. {html.escape(post['tema'])}</h2>"
+                f"<div style=\"white-space: pre-wrap\">{post['post']}</div></section>"
+            )
+        if datos["errores"]:
+            partes.append("<h1>Errores</h1><ul>")
+            for error in datos["errores"]:
+                partes.append(
+                    f"<li>{error['fila']}. {html.escape(error['tema'])}: {html.escape(error['error'])}</li>"
+                )
+            partes.append("</ul>")
+        partes.append("</body></html>")
+        return "\n".join(partes).encode("utf-8")
+
+    def _ruta(self, lote_id: str) -> str:
+        return os.path.join(self.directorio, f"{lote_id}.json")
+
+    def _escribir(self, lote: Lote):
+        self._escribir_datos(lote.id, json.dumps(asdict(lote), ensure_ascii=False))
+
+    def _escribir_datos(self, lote_id: str, datos: str):
+        ruta = self._ruta(lote_id)
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as file:
+            file.write(datos)
+        os.replace(temporal, ruta)
@@ -0,0 +1,202 @@
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _etiquetas(etiquetas: dict, extra: str = "") -> str:
+    partes = [f'{clave}="{_escapar(valor)}"' for clave, valor in sorted(etiquetas.items())]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Contador:
+    __slots__ = ("valor",)
+
+    def __init__(self):
+        self.valor = 0.0
+
+    def sumar(self, cantidad: float = 1.0):
+        self.valor += cantidad
+
+
+class _Histograma:
+    __slots__ = ("buckets", "cuentas", "suma", "total")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.cuentas = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.cuentas[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def cuantil(self, q: float) -> float:
+        """Aproximación por el límite superior del bucket donde cae el cuantil."""
+        if not self.total:
+            return 0.0
+        objetivo = q * self.total
+        acumulado = 0
+        for limite, cuenta in zip(self.buckets, self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return limite
+        return float("inf")
+
+
+class _Familia:
+    __slots__ = ("tipo", "ayuda", "series")
+
+    def __init__(self, tipo: str, ayuda: str):
+        self.tipo = tipo
+        self.ayuda = ayuda
+        self.series = {}
+
+
+class Registro:
+    """
+    Registro de métricas en memoria con salida en el formato de texto de
+    Prometheus. Contadores e histogramas se actualizan en el momento; los
+    colectores son funciones `estadisticas()` de otros componentes que se
+    leen al exportar y cuyos valores numéricos se publican como gauges.
+    """
+
+    def __init__(self, prefijo: str = "hacedor"):
+        self.prefijo = prefijo
+        self._familias = {}
+        self._colectores = {}
+
+    def contador(self, nombre: str, ayuda: str = "", **etiquetas) -> _Contador:
+        return self._serie(nombre, "counter", ayuda, etiquetas, _Contador)
+
+    def histograma(self, nombre: str, ayuda: str = "", buckets: tuple = BUCKETS_SEGUNDOS, **etiquetas) -> _Histograma:
+        return self._serie(nombre, "histogram", ayuda, etiquetas, lambda: _Histograma(buckets))
+
+    @contextmanager
+    def medir(self, nombre: str, ayuda: str = "", **etiquetas):
+        """Observa en el histograma `nombre` los segundos que tarda el bloque."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histograma(nombre, ayuda, **etiquetas).observar(time.perf_counter() - inicio)
+
+    def colector(self, componente: str, estadisticas):
+        self._colectores[componente] = estadisticas
+
+    def histogramas(self, nombre: str) -> list:
+        """(etiquetas, histograma) de cada serie de `nombre`, para resúmenes como /stats."""
+        familia = self._familias.get(self._nombre(nombre))
+        return [] if familia is None else [(dict(clave), serie) for clave, serie in familia.series.items()]
+
+    def valores_colectores(self) -> dict:
+        valores = {}
+        for componente, estadisticas in self._colectores.items():
+            try:
+                valores[componente] = estadisticas()
+            except Exception as e:
+                logger.warning("Error leyendo las estadísticas de %s: %s", componente, e)
+        return valores
+
+    def texto_prometheus(self) -> str:
+        lineas = []
+        for nombre, familia in self._familias.items():
+            if familia.ayuda:
+                lineas.append(f"# HELP {nombre} {familia.ayuda}")
+            lineas.append(f"# TYPE {nombre} {familia.tipo}")
+            for clave, serie in familia.series.items():
+                etiquetas = dict(clave)
+                if familia.tipo == "counter":
+                    lineas.append(f"{nombre}{_etiquetas(etiquetas)} {serie.valor}")
+                    continue
+                acumulado = 0
+                for limite, cuenta in zip(serie.buckets, serie.cuentas):
+                    acumulado += cuenta
+                    le = _etiquetas(etiquetas, f'le="{limite}"')
+                    lineas.append(f"{nombre}_bucket{le} {acumulado}")
+                le = _etiquetas(etiquetas, 'le="+Inf"')
+                lineas.append(f"{nombre}_bucket{le} {serie.total}")
+                lineas.append(f"{nombre}_sum{_etiquetas(etiquetas)} {serie.suma}")
+                lineas.append(f"{nombre}_count{_etiquetas(etiquetas)} {serie.total}")
+        for componente, estadisticas in self.valores_colectores().items():
+            for clave, valor in estadisticas.items():
+                if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                    continue
+                nombre = self._nombre(f"{componente}_{clave}")
+                lineas.append(f"# TYPE {nombre} gauge")
+                lineas.append(f"{nombre} {valor}")
+        return "\n".join(lineas) + "\n"
+
+    def _nombre(self, nombre: str) -> str:
+        return f"{self.prefijo}_{nombre}" if self.prefijo else nombre
+
+    def _serie(self, nombre: str, tipo: str, ayuda: str, etiquetas: dict, crear):
+        nombre = self._nombre(nombre)
+        familia = self._familias.get(nombre)
+        if familia is None:
+            familia = self._familias[nombre] = _Familia(tipo, ayuda)
+        clave = tuple(sorted(etiquetas.items()))
+        serie = familia.series.get(clave)
+        if serie is None:
+            serie = familia.series[clave] = crear()
+        return serie
+
+
+class ServidorMetricas:
+    """
+    Expone GET /metrics en formato Prometheus y, si hay perfilador,
+    GET /perfil?segundos=N con el perfil muestreado de esa ventana.
+    """
+
+    def __init__(self, registro: Registro, perfilador=None):
+        self.registro = registro
+        self.perfilador = perfilador
+        self._servidor = None
+
+    async def iniciar(self, host: str = "127.0.0.1", puerto: int = 9100) -> int:
+        self._servidor = await asyncio.start_server(self._atender, host, puerto)
+        return self._servidor.sockets[0].getsockname()[1]
+
+    async def detener(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            linea = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            partes = linea.decode("latin-1").split(" ")
+            url = urlsplit(partes[1] if len(partes) > 1 else "/")
+            if url.path == "/metrics":
+                estado, cuerpo = "200 OK", self.registro.texto_prometheus()
+            elif url.path == "/perfil" and self.perfilador is not None:
+                segundos = float(parse_qs(url.query).get("segundos", ["10"])[0])
+                estado, cuerpo = "200 OK", await self.perfilador.perfilar(segundos)
+            else:
+                estado, cuerpo = "404 Not Found", "no encontrado\n"
+            datos = cuerpo.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {estado}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(datos)}\r\nConnection: close\r\n\r\n".encode() + datos
+            )
+            await writer.drain()
+        except (ConnectionResetError, ValueError, RuntimeError) as e:
+            logger.debug("Petición de métricas fallida: %s", e)
+        finally:
+            writer.close()
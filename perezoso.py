@@ -0,0 +1,30 @@
+class Perezoso:
+    """
+    Sustituto de un objeto que se construye con `crear()` la primera vez que
+    se usa; a partir de ahí delega en él. Permite declarar los componentes
+    del bot a nivel de módulo sin pagar su construcción (ni la importación
+    de sus dependencias) hasta que hacen falta.
+    """
+
+    __slots__ = ("_crear", "_objeto")
+
+    def __init__(self, crear):
+        self._crear = crear
+        self._objeto = None
+
+    @property
+    def creado(self) -> bool:
+        return self._objeto is not None
+
+    def _objeto_real(self):
+        # Nombre privado para no tapar ningún atributo del objeto envuelto
+        if self._objeto is None:
+            self._objeto = self._crear()
+        return self._objeto
+
+    def reiniciar(self):
+        """El siguiente uso vuelve a construir el objeto (p. ej. con otros ajustes)."""
+        self._objeto = None
+
+    def __getattr__(self, nombre):
+        return getattr(self._objeto_real(), nombre)
@@ -0,0 +1,76 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_SEGUNDOS = 300
+
+
+class PerfiladorMuestreo:
+    """
+    Perfilador por muestreo para usar en producción sin reiniciar: durante la
+    ventana pedida, un hilo lee cada `intervalo` segundos la pila del hilo
+    del event loop y cuenta las pilas vistas. Fuera de esa ventana no cuesta
+    nada. Solo se hace un perfil a la vez.
+    """
+
+    def __init__(self, intervalo: float = 0.005, max_funciones: int = 30):
+        self.intervalo = intervalo
+        self.max_funciones = max_funciones
+        self._bloqueo = asyncio.Lock()
+
+    @property
+    def ocupado(self) -> bool:
+        return self._bloqueo.locked()
+
+    async def perfilar(self, segundos: float) -> str:
+        """
+        Muestrea durante `segundos` y devuelve un informe con las funciones
+        más vistas (propias y acumuladas) y las pilas plegadas, en el formato
+        que aceptan flamegraph.pl y speedscope.
+        """
+        segundos = max(0.1, min(float(segundos), MAX_SEGUNDOS))
+        if self.ocupado:
+            return "Ya hay un perfil en curso.\n"
+        async with self._bloqueo:
+            objetivo = threading.get_ident()
+            return self._informe(*await asyncio.to_thread(self._muestrear, objetivo, segundos), segundos)
+
+    def _muestrear(self, objetivo: int, segundos: float):
+        pilas = Counter()
+        muestras = 0
+        fin = time.monotonic() + segundos
+        while time.monotonic() < fin:
+            frame = sys._current_frames().get(objetivo)
+            if frame is not None:
+                pila = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pila.append(f"{codigo.co_name} ({_modulo(codigo.co_filename)}:{codigo.co_firstlineno})")
+                    frame = frame.f_back
+                pilas[tuple(reversed(pila))] += 1
+                muestras += 1
+            time.sleep(self.intervalo)
+        return pilas, muestras
+
+    def _informe(self, pilas: Counter, muestras: int, segundos: float) -> str:
+        if not muestras:
+            return "Sin muestras.\n"
+        propias, acumuladas = Counter(), Counter()
+        for pila, veces in pilas.items():
+            propias[pila[-1]] += veces
+            for funcion in set(pila):
+                acumuladas[funcion] += veces
+        lineas = [f"{muestras} muestras en {segundos:.1f} s (una cada {self.intervalo * 1000:.1f} ms)", ""]
+        lineas.append("Tiempo propio:")
+        lineas += [f"{veces / muestras:7.1%}  {funcion}" for funcion, veces in propias.most_common(self.max_funciones)]
+        lineas += ["", "Tiempo acumulado:"]
+        lineas += [f"{veces / muestras:7.1%}  {funcion}" for funcion, veces in acumuladas.most_common(self.max_funciones)]
+        lineas += ["", "Pilas plegadas:"]
+        lineas += [f"{';'.join(pila)} {veces}" for pila, veces in pilas.most_common()]
+        return "\n".join(lineas) + "\n"
+
+
+def _modulo(ruta: str) -> str:
+    return ruta.rsplit("/", 1)[-1]
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def aplicar_operacion(config: dict, operacion: dict):
+    """
+    Aplica un cambio del diario sobre la configuración en memoria.
+    Operaciones: set (asigna), append (añade a una lista), del (borra una clave
+    o posición) y rename (mueve una clave de diccionario a `valor`).
+    """
+    *camino, ultimo = operacion["ruta"]
+    destino = config
+    for paso in camino:
+        destino = destino[paso]
+    op = operacion["op"]
+    if op == "set":
+        destino[ultimo] = operacion["valor"]
+    elif op == "append":
+        destino[ultimo].append(operacion["valor"])
+    elif op == "del":
+        del destino[ultimo]
+    elif op == "rename":
+        destino[operacion["valor"]] = destino.pop(ultimo)
+    else:
+        raise ValueError(f"Operación desconocida: {op}")
+
+
+class DiarioConfig:
+    """
+    Persistencia de la configuración como snapshot + diario de cambios.
+    Cada cambio se añade al diario (una línea JSON) en lotes agrupados cada
+    `intervalo_flush` segundos y escritos fuera del event loop. Cada
+    `compactar_cada` entradas se reescribe el snapshot con un rename atómico y
+    se vacía el diario. La secuencia guardada en el snapshot evita aplicar dos
+    veces un cambio si el proceso cae entre ambos pasos.
+    """
+
+    CLAVE_SECUENCIA = "_secuencia"
+
+    def __init__(self, ruta: str, intervalo_flush: float = 0.5, compactar_cada: int = 1000, fsync: bool = True):
+        self.ruta = ruta
+        self.ruta_diario = ruta + ".diario"
+        self.intervalo_flush = intervalo_flush
+        self.compactar_cada = compactar_cada
+        self.fsync = fsync
+        self._secuencia = 0
+        self._entradas_diario = 0
+        self._pendientes = []
+        self._tarea_flush = None
+        self._bloqueo = asyncio.Lock()
+        self.bytes_logicos = 0
+        self.bytes_escritos = 0
+        self.flushes = 0
+        self.compactaciones = 0
+        self._latencias_flush = deque(maxlen=200)
+        self.al_escribir = None
+
+    def cargar(self, por_defecto: dict) -> dict:
+        """Lee el snapshot y reaplica las entradas del diario posteriores a él."""
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as file:
+                config = json.load(file)
+        except FileNotFoundError:
+            config = por_defecto
+        self._secuencia = config.pop(self.CLAVE_SECUENCIA, 0)
+        valido = 0
+        try:
+            with open(self.ruta_diario, "rb") as file:
+                for numero, linea in enumerate(file, start=1):
+                    try:
+                        if not linea.endswith(b"\n"):
+                            raise ValueError("sin salto de línea")
+                        operacion = json.loads(linea)
+                    except ValueError:
+                        # Última línea a medio escribir por una caída: se descarta
+                        logger.warning("Entrada %d del diario incompleta; se ignora", numero)
+                        self._truncar_diario(valido)
+                        break
+                    valido += len(linea)
+                    if operacion["n"] <= self._secuencia:
+                        continue
+                    aplicar_operacion(config, operacion)
+                    self._secuencia = operacion["n"]
+                    self._entradas_diario += 1
+        except FileNotFoundError:
+            pass
+        return config
+
+    def registrar(self, config: dict, operacion: dict):
+        """Encola un cambio ya aplicado en memoria y programa su escritura."""
+        self._secuencia += 1
+        operacion["n"] = self._secuencia
+        linea = json.dumps(operacion, ensure_ascii=False) + "\n"
+        self._pendientes.append(linea)
+        self.bytes_logicos += len(linea.encode("utf-8"))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Sin event loop (scripts, migraciones): se escribe en el momento
+            self._escribir_diario(self._tomar_pendientes())
+            return
+        if self._tarea_flush is None:
+            self._tarea_flush = loop.create_task(self._flush_diferido(config))
+
+    async def flush(self, config: dict):
+        async with self._bloqueo:
+            datos = self._tomar_pendientes()
+            if datos:
+                inicio = time.perf_counter()
+                await asyncio.to_thread(self._escribir_diario, datos)
+                self._medido("flush", time.perf_counter() - inicio)
+                self.flushes += 1
+            if self._entradas_diario >= self.compactar_cada:
+                await self._compactar(config)
+
+    async def compactar(self, config: dict):
+        async with self._bloqueo:
+            await self._compactar(config)
+
+    async def cerrar(self, config: dict):
+        if self._tarea_flush is not None:
+            self._tarea_flush.cancel()
+            self._tarea_flush = None
+        await self.flush(config)
+        if self._entradas_diario:
+            await self.compactar(config)
+
+    def estadisticas(self) -> dict:
+        latencias = sorted(self._latencias_flush)
+        return {
+            "flushes": self.flushes,
+            "compactaciones": self.compactaciones,
+            "entradas_diario": self._entradas_diario,
+            "bytes_logicos": self.bytes_logicos,
+            "bytes_escritos": self.bytes_escritos,
+            "amplificacion_escritura": self.bytes_escritos / self.bytes_logicos if self.bytes_logicos else 0.0,
+            "flush_p50_ms": latencias[len(latencias) // 2] * 1000 if latencias else 0.0,
+            "flush_max_ms": latencias[-1] * 1000 if latencias else 0.0,
+        }
+
+    async def _flush_diferido(self, config: dict):
+        await asyncio.sleep(self.intervalo_flush)
+        self._tarea_flush = None
+        try:
+            await self.flush(config)
+        except Exception:
+            logger.exception("Error al escribir el diario de configuración")
+
+    def _tomar_pendientes(self) -> str:
+        datos = "".join(self._pendientes)
+        self._entradas_diario += len(self._pendientes)
+        self._pendientes = []
+        return datos
+
+    async def _compactar(self, config: dict):
+        # El snapshot se serializa en el loop para que sea coherente con la
+        # secuencia; los cambios aún no escritos ya quedan incluidos en él.
+        self._tomar_pendientes()
+        snapshot = dict(config)
+        snapshot[self.CLAVE_SECUENCIA] = self._secuencia
+        datos = json.dumps(snapshot, indent=4, ensure_ascii=False)
+        inicio = time.perf_counter()
+        await asyncio.to_thread(self._escribir_snapshot, datos)
+        self._medido("compactacion", time.perf_counter() - inicio)
+        self._entradas_diario = 0
+        self.compactaciones += 1
+
+    def _medido(self, operacion: str, segundos: float):
+        self._latencias_flush.append(segundos)
+        if self.al_escribir is not None:
+            self.al_escribir(operacion, segundos)
+
+    def _truncar_diario(self, tamano: int):
+        # Lo que se añada después tiene que quedar tras la última entrada buena,
+        # no tras los restos de la rota, o el siguiente arranque lo descartaría
+        with open(self.ruta_diario, "r+b") as file:
+            file.truncate(tamano)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+
+    def _escribir_diario(self, datos: str):
+        if not datos:
+            return
+        codificado = datos.encode("utf-8")
+        with open(self.ruta_diario, "ab") as file:
+            file.write(codificado)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+        self.bytes_escritos += len(codificado)
+
+    def _escribir_snapshot(self, datos: str):
+        temporal = self.ruta + ".tmp"
+        codificado = datos.encode("utf-8")
+        with open(temporal, "wb") as file:
+            file.write(codificado)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+        os.replace(temporal, self.ruta)
+        # El diario solo se vacía cuando el snapshot ya está en su sitio
+        with open(self.ruta_diario, "wb"):
+            pass
+        self.bytes_escritos += len(codificado)
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from telegram.ext import BaseUpdateProcessor
+
+
+# Para el semáforo de BaseUpdateProcessor: el límite de verdad lo pone ProcesadorPorChat
+_SIN_LIMITE = 1 << 30
+
+
+class _ColaChat:
+    __slots__ = ("bloqueo", "pendientes")
+
+    def __init__(self):
+        self.bloqueo = asyncio.Lock()
+        self.pendientes = 0
+
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    """
+    Procesa updates de chats distintos en paralelo, hasta `max_concurrencia`
+    a la vez, pero los de un mismo chat uno detrás de otro y en orden de
+    llegada, así la sesión de un chat (ver sesiones.py) no se pisa.
+    Primero se espera el turno del chat y después un hueco global, para que
+    un chat con muchos updates en cola no ocupe huecos que no puede usar.
+    El semáforo de BaseUpdateProcessor se toma antes de do_process_update, así
+    que queda sin límite práctico y el global es uno propio, tomado después.
+    """
+
+    def __init__(self, max_concurrencia: int = 16, max_chats_medidos: int = 1000):
+        super().__init__(_SIN_LIMITE)
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self._chats = {}
+        self._metricas = OrderedDict()      # chat -> [procesados, espera_total, espera_max, profundidad_max]
+        self._max_chats_medidos = max_chats_medidos
+        self._esperas = deque(maxlen=1000)
+        self.en_cola = 0
+        self.en_proceso = 0
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = clave_chat(update)
+        if chat_id is None:
+            # Sin chat no hay orden que respetar
+            async with self._semaforo:
+                await coroutine
+            return
+
+        llegada = time.monotonic()
+        cola = self._chats.get(chat_id)
+        if cola is None:
+            cola = self._chats[chat_id] = _ColaChat()
+        cola.pendientes += 1
+        self.en_cola += 1
+        metricas = self._metricas_chat(chat_id)
+        metricas[3] = max(metricas[3], cola.pendientes)
+        try:
+            async with cola.bloqueo, self._semaforo:
+                espera = time.monotonic() - llegada
+                self.en_cola -= 1
+                self.en_proceso += 1
+                self._esperas.append(espera)
+                metricas[0] += 1
+                metricas[1] += espera
+                metricas[2] = max(metricas[2], espera)
+                try:
+                    await coroutine
+                finally:
+                    self.en_proceso -= 1
+        finally:
+            cola.pendientes -= 1
+            if not cola.pendientes:
+                del self._chats[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def estadisticas(self, top: int = 5) -> dict:
+        esperas = sorted(self._esperas)
+        peores = sorted(self._metricas.items(), key=lambda par: par[1][2], reverse=True)[:top]
+        return {
+            "en_cola": self.en_cola,
+            "en_proceso": self.en_proceso,
+            "chats_con_cola": len(self._chats),
+            "espera_p50_ms": esperas[len(esperas) // 2] * 1000 if esperas else 0.0,
+            "espera_p99_ms": esperas[int(len(esperas) * 0.99)] * 1000 if esperas else 0.0,
+            "chats_mas_lentos": {
+                chat_id: {
+                    "procesados": procesados,
+                    "espera_media_ms": espera_total / procesados * 1000 if procesados else 0.0,
+                    "espera_max_ms": espera_max * 1000,
+                    "profundidad_max": profundidad_max,
+                }
+                for chat_id, (procesados, espera_total, espera_max, profundidad_max) in peores
+            },
+        }
+
+    def _metricas_chat(self, chat_id) -> list:
+        metricas = self._metricas.pop(chat_id, None) or [0, 0.0, 0.0, 0]
+        self._metricas[chat_id] = metricas
+        if len(self._metricas) > self._max_chats_medidos:
+            self._metricas.popitem(last=False)
+        return metricas
+
+
+def clave_chat(update):
+    """Chat al que pertenece el update (o el usuario, si no hay chat); None si no hay ninguno."""
+    if not hasattr(update, "effective_chat"):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return ("usuario", update.effective_user.id)
+    return None
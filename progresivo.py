@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from formato import cerrar_html_parcial
+
+logger = logging.getLogger(__name__)
+
+# Margen bajo el límite de 4096 caracteres de Telegram para el cursor y los cierres
+_MAX_PARCIAL = 4000
+
+
+class EditorProgresivo:
+    """
+    Muestra un post mientras se genera: envía un marcador al instante y lo va
+    editando con el texto recibido, como mucho una vez cada `intervalo` segundos.
+    Cada edición intermedia es HTML válido; el teclado se añade en la final.
+    Las ediciones se hacen con `await editar(mensaje, texto, reply_markup)`; si
+    la final falla, el post se manda con `enviar(texto, reply_markup)`.
+    """
+
+    def __init__(self, ediciones: "EdicionesProgresivas", mensaje, enviar, editar):
+        self._ediciones = ediciones
+        self._mensaje = mensaje
+        self._enviar = enviar
+        self._editar_mensaje = editar
+        self._texto = ""
+        self._mostrado = None
+        self._hay_texto = asyncio.Event()
+        self._inicio = time.monotonic()
+        self._primer_texto = None
+        self._tarea = asyncio.create_task(self._bucle())
+
+    def agregar(self, fragmento: str):
+        self._texto += fragmento
+        self._hay_texto.set()
+
+    async def finalizar(self, texto: str, reply_markup=None):
+        await self._detener()
+        # retry_after y "not modified" ya los resuelve quien edita; esto es lo que queda
+        try:
+            await self._editar(texto, reply_markup=reply_markup)
+        except Exception as e:
+            # El marcador ya no se puede editar (borrado, HTML rechazado...): el post no se pierde
+            logger.warning("No se pudo editar el mensaje final (%s); se envía uno nuevo", e)
+            self._enviar(texto, reply_markup)
+        self._ediciones.registrar(self._primer_texto, time.monotonic() - self._inicio)
+
+    async def cancelar(self, texto: str):
+        """Detiene las ediciones y deja `texto` en el mensaje en lugar del post."""
+        await self._detener()
+        await self._editar(texto)
+
+    async def _detener(self):
+        self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Lo que cortase las ediciones intermedias no debe impedir la final
+            logger.warning("Las ediciones intermedias terminaron con un error: %s", e)
+
+    async def _bucle(self):
+        intervalo = self._ediciones.intervalo
+        while True:
+            await self._hay_texto.wait()
+            self._hay_texto.clear()
+            parcial = cerrar_html_parcial(self._texto[:_MAX_PARCIAL]).strip()
+            if parcial and parcial != self._mostrado:
+                try:
+                    await self._editar(parcial + " ▌")
+                except Exception as e:
+                    # Un HTML raro del modelo, un fallo de red que sobrevive a los reintentos...
+                    # no deben cortar el streaming; la edición final (o su respaldo) mostrará el post
+                    logger.debug("Edición intermedia rechazada: %s", e)
+                self._mostrado = parcial
+                if self._primer_texto is None:
+                    self._primer_texto = time.monotonic() - self._inicio
+            await asyncio.sleep(intervalo)
+
+    async def _editar(self, texto: str, reply_markup=None):
+        await self._editar_mensaje(self._mensaje, texto, reply_markup)
+
+
+class EdicionesProgresivas:
+    """Crea editores progresivos y mide el tiempo hasta el primer texto visible."""
+
+    def __init__(self, intervalo: float = 1.0, marcador: str = "✍️ Generando post…"):
+        self.intervalo = intervalo
+        self.marcador = marcador
+        self._primer_texto = deque(maxlen=500)
+        self._total = deque(maxlen=500)
+
+    async def iniciar(self, enviar, editar) -> EditorProgresivo:
+        """
+        Envía el marcador con `await enviar(texto)` y devuelve el editor del
+        mensaje, que lo edita con `await editar(mensaje, texto, reply_markup)`.
+        """
+        mensaje = await enviar(self.marcador)
+        return EditorProgresivo(self, mensaje, enviar, editar)
+
+    def registrar(self, primer_texto: float, total: float):
+        if primer_texto is not None:
+            self._primer_texto.append(primer_texto)
+        self._total.append(total)
+
+    def estadisticas(self) -> dict:
+        primer_texto = sorted(self._primer_texto)
+        total = sorted(self._total)
+        return {
+            "posts": len(total),
+            "primer_texto_p50_s": primer_texto[len(primer_texto) // 2] if primer_texto else 0.0,
+            "total_p50_s": total[len(total) // 2] if total else 0.0,
+        }
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import re
+from collections import deque
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+_SIN_CARGAR = object()
+_ETIQUETA_CORTADA = re.compile(r"<[^>]*$")
+
+
+@dataclass
+class _Plantilla:
+    sistema: str
+    prefijo: str
+    medio: str
+    sufijo: str
+
+
+class CompiladorPrompts:
+    """
+    Construye los mensajes de generate_post a partir de plantillas precompiladas.
+    La parte estática (personaje, servicios, etiqueta, idioma e instrucciones) se
+    compila una vez por versión de la configuración; en cada llamada solo se
+    añaden el tema y los ejemplos, recortados a `presupuesto_ejemplos` tokens.
+    También lleva la cuenta de los tokens de prompt y respuesta de cada llamada.
+    El tokenizador se carga aparte con cargar_codificador(): es lo más lento de construir.
+    """
+
+    def __init__(self, modelo: str, presupuesto_ejemplos: int = 600, max_ejemplos: int = 1, historial: int = 200):
+        self.presupuesto_ejemplos = presupuesto_ejemplos
+        self.max_ejemplos = max_ejemplos
+        self.modelo = modelo
+        self._plantillas = {}
+        self._codificador = _SIN_CARGAR
+        self._carga = None
+        self.llamadas = 0
+        self.tokens_prompt = 0
+        self.tokens_completion = 0
+        self.ejemplos_recortados = 0
+        self.ultimas_llamadas = deque(maxlen=historial)
+
+    @property
+    def codificador(self):
+        """tiktoken si ya está cargado; None mientras tanto o si no se pudo cargar."""
+        return None if self._codificador is _SIN_CARGAR else self._codificador
+
+    async def cargar_codificador(self):
+        """
+        Carga el tokenizador fuera del event loop: la primera vez tiktoken
+        descarga su vocabulario. Mientras tanto, o si falla (sin red, sin
+        tiktoken), se estima con ~4 caracteres por token, y no se reintenta.
+        """
+        if self._codificador is _SIN_CARGAR:
+            self._codificador = await asyncio.to_thread(self._crear_codificador)
+
+    def cargar_en_segundo_plano(self):
+        if self._carga is None:
+            self._carga = asyncio.get_running_loop().create_task(self.cargar_codificador())
+
+    def _crear_codificador(self):
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+        try:
+            try:
+                return tiktoken.encoding_for_model(self.modelo)
+            except KeyError:
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning("No se pudo cargar el tokenizador; se estiman los tokens: %s", e)
+            return None
+
+    def contar_tokens(self, texto: str) -> int:
+        if self.codificador is not None:
+            return len(self.codificador.encode(texto))
+        return len(texto) // 4 + 1
+
+    def recortar(self, texto: str, tokens: int) -> str:
+        """Corta el texto a `tokens` tokens sin dejar una etiqueta HTML a medias."""
+        if self.codificador is not None:
+            codificado = self.codificador.encode(texto)
+            if len(codificado) <= tokens:
+                return texto
+            recortado = self.codificador.decode(codificado[:tokens])
+        else:
+            if len(texto) <= tokens * 4:
+                return texto
+            recortado = texto[:tokens * 4]
+        return _ETIQUETA_CORTADA.sub("", recortado).rstrip() + "…"
+
+    def ajustar_ejemplos(self, ejemplos: list) -> list:
+        """
+        Selecciona ejemplos en orden de preferencia mientras quepan en el
+        presupuesto. Si el primero no cabe entero, se recorta.
+        """
+        seleccion = []
+        restante = self.presupuesto_ejemplos
+        for ejemplo in ejemplos[:self.max_ejemplos]:
+            tokens = self.contar_tokens(ejemplo)
+            if tokens <= restante:
+                seleccion.append(ejemplo)
+                restante -= tokens
+            elif not seleccion:
+                seleccion.append(self.recortar(ejemplo, restante))
+                self.ejemplos_recortados += 1
+                break
+            else:
+                break
+        return seleccion
+
+    def mensajes(self, configuracion: dict, tema: str, ejemplos: list) -> list:
+        plantilla = self._plantilla(configuracion)
+        ejemplos = self.ajustar_ejemplos(ejemplos)
+        if len(ejemplos) == 1:
+            bloque = f"Ejemplo (solo para inspirarte en el formato y la extensión):\n{ejemplos[0]}"
+        else:
+            bloque = "Ejemplos (solo para inspirarte en el formato y la extensión):\n" + "\n\n---\n\n".join(ejemplos)
+        return [
+            {"role": "system", "content": plantilla.sistema},
+            {"role": "user", "content": plantilla.prefijo + tema + plantilla.medio + bloque + plantilla.sufijo}
+        ]
+
+    def registrar_uso(self, tokens_prompt: int, tokens_completion: int):
+        self.llamadas += 1
+        self.tokens_prompt += tokens_prompt
+        self.tokens_completion += tokens_completion
+        self.ultimas_llamadas.append((tokens_prompt, tokens_completion))
+
+    def estadisticas(self) -> dict:
+        return {
+            "llamadas": self.llamadas,
+            "tokens_prompt": self.tokens_prompt,
+            "tokens_completion": self.tokens_completion,
+            "tokens_prompt_medio": self.tokens_prompt / self.llamadas if self.llamadas else 0.0,
+            "tokens_completion_medio": self.tokens_completion / self.llamadas if self.llamadas else 0.0,
+            "ejemplos_recortados": self.ejemplos_recortados,
+            "plantillas": len(self._plantillas),
+            "tokenizador": (
+                "sin cargar" if self._codificador is _SIN_CARGAR
+                else "tiktoken" if self._codificador is not None else "estimado"
+            ),
+        }
+
+    def _plantilla(self, configuracion: dict) -> _Plantilla:
+        version = (
+            configuracion["nombre"], configuracion["etiqueta"], configuracion["personalidad"],
+            tuple(configuracion["servicios"]), configuracion.get("idioma", ""),
+        )
+        plantilla = self._plantillas.get(version)
+        if plantilla is None:
+            # Solo interesa la versión vigente de la configuración
+            self._plantillas.clear()
+            plantilla = self._plantillas[version] = self._compilar(configuracion)
+        return plantilla
+
+    def _compilar(self, configuracion: dict) -> _Plantilla:
+        prefijo = (
+            f"Genera un post para Telegram en {configuracion.get('idioma', '')} utilizando HTML para el formato "
+            f"(por ejemplo, <b> para negrita, <i> para cursiva, <u> para subrayado, etc.).\n"
+            f"El post debe inspirarse en el siguiente ejemplo para mantener un estilo y extensión similares, "
+            f"pero el contenido final debe ser 100% original y adaptado a la idea principal que se proporciona a continuación.\n\n"
+            f"Idea principal (interpreta y corrige posibles errores ortográficos o de redacción):\n\""
+        )
+        medio = "\"\n\n"
+        sufijo = (
+            f"\n\n"
+            f"Utiliza internamente los siguientes datos para adaptar el tono y estilo, pero no los muestres directamente en el resultado final:\n"
+            f"- Personalidad del personaje: {configuracion['personalidad']}\n"
+            f"- Servicios o productos que ofrece: {', '.join(configuracion['servicios'])}\n\n"
+            f"En el post, incorpora de forma natural la etiqueta \"{configuracion['etiqueta']}\" en el llamado a la acción (CTA), "
+            f"asegurándote de que el CTA sea breve.\n\n"
+            f"⚠️ **Importante:** Redacta únicamente el contenido final del post para Telegram, sin encabezados ni detalles internos "
+            f"(no incluyas palabras como 'Idea principal:', 'Ejemplo:', 'Personalidad:' o 'Servicios:'). No uses hashtags ni puntos finales innecesarios. "
+            f"El post debe basarse en la idea proporcionada, interpretándola de forma coherente (por ejemplo, si la idea es 'Hoy ganaremos', "
+            f"el texto debe transmitir que 'hoy se ganará')."
+        )
+        sistema = f"Habla como {configuracion['nombre']}. No incluyas datos internos; responde solo con el contenido final del post."
+        return _Plantilla(sistema, prefijo, medio, sufijo)
@@ -0,0 +1,110 @@
+import heapq
+import math
+import re
+import time
+from collections import Counter, defaultdict, deque
+
+from duplicados import normalizar
+
+_PALABRA = re.compile(r"\w+")
+_VACIAS = frozenset(
+    "a al algo como con de del el ella ellos en es esa ese esta este hay la las le lo los mas más me mi mis muy "
+    "no nos o para pero por que qué se si sin su sus te tu tus un una unos y ya "
+    "and are as at be by for from in is it of on or that the this to was with you your".split()
+)
+
+
+def terminos(texto: str) -> list:
+    return [t for t in _PALABRA.findall(normalizar(texto)) if t not in _VACIAS and len(t) > 1]
+
+
+class _IndiceTipo:
+    def __init__(self):
+        self.documentos = {}                  # clave -> Counter de términos
+        self.longitudes = {}                  # clave -> número de términos
+        self.invertido = defaultdict(dict)    # término -> {clave: frecuencia}; su len() es la df
+        self.longitud_total = 0
+
+
+class IndiceBM25:
+    """
+    Índice BM25 por tipo de post para elegir los ejemplos más relevantes para un tema.
+    Se actualiza de forma incremental y solo puntúa los ejemplos que comparten
+    algún término con la consulta, así que el coste depende de las listas de
+    términos del tema y no del tamaño total de la biblioteca.
+    Las claves son los IDs estables de los ejemplos: borrar o editar uno solo
+    toca sus términos, y la frecuencia de documento de cada término (el número
+    de ejemplos que lo contienen) se ajusta a la vez.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._tipos = defaultdict(_IndiceTipo)
+        self._latencias = deque(maxlen=500)
+        self.consultas = 0
+
+    def agregar(self, tipo: str, clave, texto: str):
+        indice = self._tipos[tipo]
+        frecuencias = Counter(terminos(texto))
+        indice.documentos[clave] = frecuencias
+        indice.longitudes[clave] = sum(frecuencias.values())
+        indice.longitud_total += indice.longitudes[clave]
+        for termino, frecuencia in frecuencias.items():
+            indice.invertido[termino][clave] = frecuencia
+
+    def quitar(self, tipo: str, clave):
+        indice = self._tipos.get(tipo)
+        if indice is None or clave not in indice.documentos:
+            return
+        frecuencias = indice.documentos.pop(clave)
+        indice.longitud_total -= indice.longitudes.pop(clave)
+        for termino in frecuencias:
+            del indice.invertido[termino][clave]
+            if not indice.invertido[termino]:
+                del indice.invertido[termino]
+
+    def reconstruir(self, tipo: str, ejemplos: list):
+        """`ejemplos` son pares (clave, texto)."""
+        self._tipos.pop(tipo, None)
+        for clave, texto in ejemplos:
+            self.agregar(tipo, clave, texto)
+
+    def renombrar_tipo(self, tipo: str, nuevo: str):
+        if tipo in self._tipos:
+            self._tipos[nuevo] = self._tipos.pop(tipo)
+
+    def eliminar_tipo(self, tipo: str):
+        self._tipos.pop(tipo, None)
+
+    def mejores(self, tipo: str, consulta: str, k: int, excluir=()) -> list:
+        """Las `k` claves con mayor puntuación BM25 para la consulta, como (clave, puntuación)."""
+        inicio = time.perf_counter()
+        indice = self._tipos.get(tipo)
+        puntuaciones = Counter()
+        if indice is not None and indice.documentos:
+            n = len(indice.documentos)
+            media = indice.longitud_total / n or 1
+            for termino in set(terminos(consulta)):
+                postings = indice.invertido.get(termino)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for clave, frecuencia in postings.items():
+                    if clave in excluir:
+                        continue
+                    norma = frecuencia + self.k1 * (1 - self.b + self.b * indice.longitudes[clave] / media)
+                    puntuaciones[clave] += idf * frecuencia * (self.k1 + 1) / norma
+        resultado = heapq.nlargest(k, puntuaciones.items(), key=lambda par: par[1])
+        self._latencias.append(time.perf_counter() - inicio)
+        self.consultas += 1
+        return resultado
+
+    def estadisticas(self) -> dict:
+        latencias = sorted(self._latencias)
+        return {
+            "consultas": self.consultas,
+            "ejemplos_indexados": sum(len(i.documentos) for i in self._tipos.values()),
+            "seleccion_p50_ms": latencias[len(latencias) // 2] * 1000 if latencias else 0.0,
+            "seleccion_p99_ms": latencias[int(len(latencias) * 0.99)] * 1000 if latencias else 0.0,
+        }
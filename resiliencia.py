@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import httpx
+import openai
+
+from llm import ClienteLLM, ErrorGeneracion, Respuesta
+
+logger = logging.getLogger(__name__)
+
+# Errores que suelen resolverse solos: timeouts, cortes de red, 429 y 5xx
+REINTENTABLES = (
+    asyncio.TimeoutError,
+    httpx.TransportError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class Interruptor:
+    """
+    Circuit breaker. Tras `fallos_para_abrir` fallos seguidos se abre y no deja
+    pasar peticiones durante `enfriamiento` segundos; después deja pasar una
+    de prueba (semiabierto) y según su resultado se cierra o vuelve a abrirse.
+    """
+
+    def __init__(self, fallos_para_abrir: int = 5, enfriamiento: float = 30.0):
+        self.fallos_para_abrir = fallos_para_abrir
+        self.enfriamiento = enfriamiento
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+        self.aperturas = 0
+        self._prueba_en_curso = False
+
+    @property
+    def estado(self) -> str:
+        if self.fallos_seguidos < self.fallos_para_abrir:
+            return "cerrado"
+        return "abierto" if time.monotonic() < self.abierto_hasta else "semiabierto"
+
+    def permite(self) -> bool:
+        estado = self.estado
+        if estado == "cerrado":
+            return True
+        if estado == "semiabierto" and not self._prueba_en_curso:
+            self._prueba_en_curso = True
+            return True
+        return False
+
+    def exito(self):
+        self.fallos_seguidos = 0
+        self._prueba_en_curso = False
+
+    def abandonar(self):
+        """La petición se canceló sin resultado: no cuenta ni como éxito ni como fallo."""
+        self._prueba_en_curso = False
+
+    def fallo(self):
+        self.fallos_seguidos += 1
+        self._prueba_en_curso = False
+        if self.fallos_seguidos >= self.fallos_para_abrir:
+            if time.monotonic() >= self.abierto_hasta:
+                self.aperturas += 1
+            self.abierto_hasta = time.monotonic() + self.enfriamiento
+
+
+@dataclass
+class Backend:
+    nombre: str
+    cliente: ClienteLLM
+    modelo: str
+
+
+class ClienteResiliente:
+    """
+    Capa sobre uno o dos backends de completions:
+    - reintenta los errores transitorios con backoff exponencial y jitter,
+      probando primero el otro backend si lo hay;
+    - si una petición tarda más que el percentil `percentil_cobertura` de las
+      últimas latencias, lanza una segunda igual (hedging) y se queda con la
+      primera que responda, cancelando la otra; como mucho en una fracción
+      `max_coberturas` de las peticiones, para no duplicar la carga;
+    - con el circuito del principal abierto, pasa al respaldo.
+    Si nada funciona lanza ErrorGeneracion.
+    """
+
+    def __init__(self, principal: Backend, respaldo: Backend = None, reintentos: int = 2, espera_base: float = 0.2,
+                 percentil_cobertura: float = 0.95, max_coberturas: float = 0.1, min_muestras: int = 20,
+                 fallos_para_abrir: int = 5, enfriamiento: float = 30.0):
+        self.backends = [principal] + ([respaldo] if respaldo else [])
+        self.interruptores = {b.nombre: Interruptor(fallos_para_abrir, enfriamiento) for b in self.backends}
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.percentil_cobertura = percentil_cobertura
+        self.max_coberturas = max_coberturas
+        self.min_muestras = min_muestras
+        self._latencias = deque(maxlen=200)
+        self._totales = deque(maxlen=1000)
+        self.peticiones = 0
+        self.reintentos_hechos = 0
+        self.coberturas = 0
+        self.coberturas_ganadas = 0
+        self.respaldos = 0
+        self.errores = 0
+
+    async def completar(self, mensajes: list, **kwargs) -> Respuesta:
+        inicio = time.perf_counter()
+        self.peticiones += 1
+        try:
+            return await self._con_reintentos(lambda backend: self._con_cobertura(backend, mensajes, kwargs))
+        finally:
+            self._totales.append(time.perf_counter() - inicio)
+
+    async def completar_stream(self, mensajes: list, al_fragmento, **kwargs) -> Respuesta:
+        """
+        Sin hedging: solo se reintenta (o se pasa al respaldo) si el fallo llega
+        antes del primer fragmento, para no mostrar dos textos mezclados.
+        """
+        recibido = False
+
+        def fragmento(texto: str):
+            nonlocal recibido
+            recibido = True
+            al_fragmento(texto)
+
+        async def intento(backend: Backend) -> Respuesta:
+            try:
+                return await backend.cliente.completar_stream(mensajes, backend.modelo, fragmento, **kwargs)
+            except REINTENTABLES as e:
+                if recibido:
+                    raise ErrorGeneracion(f"La respuesta se cortó a medias: {e}") from e
+                raise
+
+        inicio = time.perf_counter()
+        self.peticiones += 1
+        try:
+            return await self._con_reintentos(intento)
+        finally:
+            self._totales.append(time.perf_counter() - inicio)
+
+    def umbral_cobertura(self):
+        """Segundos tras los que se lanza la segunda petición, o None si no toca."""
+        if not self.percentil_cobertura or len(self._latencias) < self.min_muestras:
+            return None
+        if self.coberturas >= self.max_coberturas * self.peticiones:
+            return None
+        latencias = sorted(self._latencias)
+        return latencias[min(len(latencias) - 1, int(len(latencias) * self.percentil_cobertura))]
+
+    def estadisticas(self) -> dict:
+        totales = sorted(self._totales)
+        return {
+            "peticiones": self.peticiones,
+            "reintentos": self.reintentos_hechos,
+            "coberturas": self.coberturas,
+            "coberturas_ganadas": self.coberturas_ganadas,
+            "respaldos": self.respaldos,
+            "errores": self.errores,
+            "circuitos": {nombre: i.estado for nombre, i in self.interruptores.items()},
+            "aperturas": {nombre: i.aperturas for nombre, i in self.interruptores.items()},
+            "p50_s": totales[len(totales) // 2] if totales else 0.0,
+            "p99_s": totales[int(len(totales) * 0.99)] if totales else 0.0,
+        }
+
+    async def _con_reintentos(self, llamar) -> Respuesta:
+        ultimo = None
+        fallido = None
+        for intento in range(self.reintentos + 1):
+            if intento:
+                self.reintentos_hechos += 1
+                await asyncio.sleep(min(10.0, self.espera_base * 2 ** (intento - 1)) * random.uniform(0.5, 1.5))
+            backend = self._elegir_backend(evitar=fallido)
+            if backend is None:
+                break
+            interruptor = self.interruptores[backend.nombre]
+            try:
+                respuesta = await llamar(backend)
+            except asyncio.CancelledError:
+                interruptor.abandonar()
+                raise
+            except ErrorGeneracion:
+                interruptor.fallo()
+                self.errores += 1
+                raise
+            except REINTENTABLES as e:
+                interruptor.fallo()
+                ultimo = e
+                fallido = backend
+                logger.warning("Fallo transitorio en %s (intento %d): %r", backend.nombre, intento + 1, e)
+                continue
+            except openai.APIError as e:
+                # 4xx y similares: repetir la misma petición no lo va a arreglar
+                interruptor.exito()
+                self.errores += 1
+                raise ErrorGeneracion(str(e)) from e
+            interruptor.exito()
+            return respuesta
+        self.errores += 1
+        if ultimo is None:
+            raise ErrorGeneracion("Todos los backends tienen el circuito abierto")
+        raise ErrorGeneracion(f"Sin respuesta tras {self.reintentos + 1} intentos: {ultimo!r}") from ultimo
+
+    def _elegir_backend(self, evitar: Backend = None):
+        candidatos = [b for b in self.backends if b is not evitar] + ([evitar] if evitar else [])
+        for backend in candidatos:
+            if self.interruptores[backend.nombre].permite():
+                if backend is not self.backends[0]:
+                    self.respaldos += 1
+                return backend
+        return None
+
+    async def _con_cobertura(self, backend: Backend, mensajes: list, kwargs: dict) -> Respuesta:
+        umbral = self.umbral_cobertura()
+        primera = asyncio.create_task(self._medir(backend, mensajes, kwargs))
+        tareas = [primera]
+        try:
+            if umbral is not None:
+                hechas, _ = await asyncio.wait(tareas, timeout=umbral)
+                if not hechas:
+                    self.coberturas += 1
+                    tareas.append(asyncio.create_task(self._medir(backend, mensajes, kwargs)))
+            pendientes = set(tareas)
+            while pendientes:
+                hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    if tarea.exception() is None:
+                        if tarea is not primera:
+                            self.coberturas_ganadas += 1
+                        return tarea.result()
+            # Han fallado todas: se propaga el error de la primera
+            return primera.result()
+        finally:
+            for tarea in tareas:
+                if not tarea.done():
+                    tarea.cancel()
+                # La perdedora puede haber fallado (o fallar al cancelarse) sin que nadie mire su error
+                tarea.add_done_callback(_recoger_error)
+
+    async def _medir(self, backend: Backend, mensajes: list, kwargs: dict) -> Respuesta:
+        inicio = time.perf_counter()
+        respuesta = await backend.cliente.completar(mensajes, backend.modelo, **kwargs)
+        self._latencias.append(time.perf_counter() - inicio)
+        return respuesta
+
+
+def _recoger_error(tarea: asyncio.Task):
+    # El error que importa ya se ha propagado o se ha descartado a propósito
+    if not tarea.cancelled():
+        tarea.exception()
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+_MAX_MENSAJE = 4096
+
+
+class _Cubo:
+    """Token bucket. `reservar` descuenta un token y devuelve cuánto hay que esperar para usarlo."""
+
+    __slots__ = ("tasa", "capacidad", "tokens", "actualizado")
+
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.actualizado = time.monotonic()
+
+    def reservar(self) -> float:
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+        self.tokens -= 1
+        return -self.tokens / self.tasa if self.tokens < 0 else 0.0
+
+    def pausar(self, segundos: float):
+        """Vacía el cubo para que el siguiente token no llegue antes de `segundos`."""
+        self.reservar()
+        self.tokens = min(self.tokens, -segundos * self.tasa)
+
+
+@dataclass
+class _Saliente:
+    texto: str
+    parse_mode: str
+    reply_markup: object
+    fusionable: bool
+    llamada: object = None  # bot -> corrutina, para lo que no es send_message
+    encolado: float = field(default_factory=time.monotonic)
+    futuros: list = field(default_factory=list)
+
+
+class DespachadorSalida:
+    """
+    Cola de mensajes salientes. Los handlers encolan y siguen; un trabajador por
+    chat los envía en orden respetando dos token buckets (por chat y global),
+    obedece `retry_after` de Telegram y reintenta los fallos de red con
+    backoff exponencial con jitter. Los mensajes cortos que se acumulan en la
+    cola de un chat se funden en uno solo cuando caben.
+    Las ediciones y los documentos pasan por la misma cola y los mismos límites.
+    """
+
+    def __init__(self, por_segundo: float = 25.0, por_chat: float = 1.0, rafaga_chat: int = 3,
+                 reintentos: int = 4, max_fusion: int = 1000, max_chats: int = 10000):
+        self.por_segundo = por_segundo
+        self.por_chat = por_chat
+        self.rafaga_chat = rafaga_chat
+        self.reintentos = reintentos
+        self.max_fusion = max_fusion
+        self.max_chats = max_chats
+        self._bot = None
+        self._global = _Cubo(por_segundo, por_segundo)
+        self._cubos = OrderedDict()
+        self._colas = {}
+        self._trabajadores = {}
+        self._latencias = deque(maxlen=1000)
+        self.enviados = 0
+        self.fusionados = 0
+        self.esperas_chat = 0
+        self.esperas_global = 0
+        self.retry_after = 0
+        self.reintentos_red = 0
+        self.fallidos = 0
+
+    def iniciar(self, bot):
+        self._bot = bot
+
+    def enviar(self, chat_id: int, texto: str, parse_mode: str = "HTML", reply_markup=None,
+               fusionable: bool = True) -> asyncio.Future:
+        """
+        Encola un mensaje y devuelve un futuro con el Message enviado. No hace
+        falta esperarlo; solo quien necesita el mensaje (p. ej. para editarlo).
+        """
+        fusionable = fusionable and len(texto) <= self.max_fusion
+        return self._encolar(chat_id, _Saliente(texto, parse_mode, reply_markup, fusionable))
+
+    def editar(self, chat_id: int, message_id: int, texto: str, parse_mode: str = "HTML",
+               reply_markup=None) -> asyncio.Future:
+        """Encola la edición de un mensaje ya enviado, en orden con lo demás del chat."""
+        async def llamada(bot):
+            try:
+                return await bot.edit_message_text(
+                    texto, chat_id=chat_id, message_id=message_id, parse_mode=parse_mode, reply_markup=reply_markup
+                )
+            except BadRequest as e:
+                # El mensaje ya tiene ese texto y ese teclado: no hay nada que cambiar
+                if "not modified" not in str(e).lower():
+                    raise
+                return True
+        return self._encolar(chat_id, _Saliente(texto, parse_mode, reply_markup, False, llamada))
+
+    def enviar_documento(self, chat_id: int, documento: bytes, nombre: str) -> asyncio.Future:
+        return self._encolar(chat_id, _Saliente(
+            nombre, None, None, False, lambda bot: bot.send_document(chat_id, documento, filename=nombre)
+        ))
+
+    def _encolar(self, chat_id: int, saliente: _Saliente) -> asyncio.Future:
+        futuro = asyncio.get_running_loop().create_future()
+        futuro.add_done_callback(_marcar_recogido)
+        saliente.futuros.append(futuro)
+        self._colas.setdefault(chat_id, deque()).append(saliente)
+        if chat_id not in self._trabajadores:
+            self._trabajadores[chat_id] = asyncio.create_task(self._trabajar(chat_id))
+        return futuro
+
+    async def cerrar(self, timeout: float = 10.0):
+        """Espera a que se vacíen las colas; lo que quede después se cancela."""
+        tareas = list(self._trabajadores.values())
+        if tareas:
+            _, pendientes = await asyncio.wait(tareas, timeout=timeout)
+            for tarea in pendientes:
+                tarea.cancel()
+
+    def estadisticas(self) -> dict:
+        latencias = sorted(self._latencias)
+        return {
+            "enviados": self.enviados,
+            "fusionados": self.fusionados,
+            "en_cola": sum(len(cola) for cola in self._colas.values()),
+            "esperas_chat": self.esperas_chat,
+            "esperas_global": self.esperas_global,
+            "retry_after": self.retry_after,
+            "reintentos_red": self.reintentos_red,
+            "fallidos": self.fallidos,
+            "cola_p50_ms": latencias[len(latencias) // 2] * 1000 if latencias else 0.0,
+            "cola_p99_ms": latencias[int(len(latencias) * 0.99)] * 1000 if latencias else 0.0,
+        }
+
+    async def _trabajar(self, chat_id: int):
+        cola = self._colas[chat_id]
+        try:
+            while cola:
+                await self._turno(chat_id)
+                saliente = self._fusionar(cola)
+                self._latencias.append(time.monotonic() - saliente.encolado)
+                try:
+                    mensaje = await self._enviar(chat_id, saliente)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.fallidos += 1
+                    logger.error("No se pudo enviar un mensaje al chat %s: %s", chat_id, e)
+                    for futuro in saliente.futuros:
+                        if not futuro.done():
+                            futuro.set_exception(e)
+                    continue
+                self.enviados += 1
+                for futuro in saliente.futuros:
+                    if not futuro.done():
+                        futuro.set_result(mensaje)
+        finally:
+            # Solo quedan mensajes si el trabajador se canceló al cerrar
+            for saliente in cola:
+                for futuro in saliente.futuros:
+                    futuro.cancel()
+            del self._trabajadores[chat_id]
+            del self._colas[chat_id]
+
+    async def _turno(self, chat_id: int):
+        cubo = self._cubos.pop(chat_id, None) or _Cubo(self.por_chat, self.rafaga_chat)
+        self._cubos[chat_id] = cubo
+        if len(self._cubos) > self.max_chats:
+            self._cubos.popitem(last=False)
+        espera = cubo.reservar()
+        if espera:
+            self.esperas_chat += 1
+            await asyncio.sleep(espera)
+        espera = self._global.reservar()
+        if espera:
+            self.esperas_global += 1
+            await asyncio.sleep(espera)
+
+    def _fusionar(self, cola: deque) -> _Saliente:
+        """
+        Saca el primer mensaje y le une los siguientes mientras sean cortos,
+        del mismo formato y quepan. Solo el último puede llevar teclado.
+        """
+        saliente = cola.popleft()
+        while (
+            cola and saliente.fusionable and saliente.reply_markup is None
+            and cola[0].fusionable and cola[0].parse_mode == saliente.parse_mode
+            and len(saliente.texto) + len(cola[0].texto) + 2 <= _MAX_MENSAJE
+        ):
+            siguiente = cola.popleft()
+            saliente.texto += "\n\n" + siguiente.texto
+            saliente.reply_markup = siguiente.reply_markup
+            saliente.futuros += siguiente.futuros
+            self.fusionados += 1
+        return saliente
+
+    async def _enviar(self, chat_id: int, saliente: _Saliente):
+        intento = 0
+        while True:
+            try:
+                if saliente.llamada is not None:
+                    return await saliente.llamada(self._bot)
+                return await self._bot.send_message(
+                    chat_id, saliente.texto, parse_mode=saliente.parse_mode, reply_markup=saliente.reply_markup
+                )
+            except RetryAfter as e:
+                self.retry_after += 1
+                retraso = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                # Telegram no dice si el límite era del chat o global: se frenan ambos
+                self._global.pausar(retraso)
+                await asyncio.sleep(retraso)
+            except (BadRequest, Forbidden):
+                raise
+            except NetworkError:
+                intento += 1
+                if intento > self.reintentos:
+                    raise
+                self.reintentos_red += 1
+                await asyncio.sleep(min(30.0, 0.5 * 2 ** intento) * random.uniform(0.5, 1.5))
+
+
+def _marcar_recogido(futuro: asyncio.Future):
+    # Casi nadie espera estos futuros: el error ya se registra en el log
+    if not futuro.cancelled():
+        futuro.exception()
@@ -0,0 +1,272 @@
+"""
+Estado de las conversaciones: qué espera el bot del próximo mensaje de cada
+chat (un Estado) y los pocos datos que acompañan a ese paso y al último post
+presentado. Es un registro con __slots__ por chat en lugar de las banderas
+esperando_*/edit_* sueltas en `context.user_data`: un único estado a la vez,
+sin combinaciones imposibles, y un tercio menos de memoria por sesión (ver
+bench/sesiones.py).
+
+GestorSesiones las mantiene en memoria con un máximo de entradas (se expulsa
+la usada hace más tiempo) y una caducidad por inactividad. Con una ruta,
+además, se guardan en SQLite: los cambios y los accesos (para que una
+conversación activa no se dé por caducada al reiniciar) se agrupan y se
+escriben cada `intervalo_flush` segundos en una sola transacción. Una sesión
+que no está en memoria (tras un reinicio o una expulsión) se lee de ahí, así
+la conversación sigue donde estaba.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class Estado(Enum):
+    """Qué espera el bot del próximo mensaje del chat. El valor es el que se guarda en SQLite."""
+
+    NINGUNO = "ninguno"
+    # Asistente de configuración inicial, en este orden
+    NOMBRE = "nombre"
+    ETIQUETA = "etiqueta"
+    PERSONALIDAD = "personalidad"
+    SERVICIOS = "servicios"
+    IDIOMA = "idioma"
+    # Edición de un campo de la configuración
+    EDITAR_NOMBRE = "editar_nombre"
+    EDITAR_ETIQUETA = "editar_etiqueta"
+    EDITAR_PERSONALIDAD = "editar_personalidad"
+    EDITAR_SERVICIOS = "editar_servicios"
+    EDITAR_IDIOMA = "editar_idioma"
+    # Tipos de post y ejemplos
+    NUEVO_TIPO = "nuevo_tipo"
+    RENOMBRAR_TIPO = "renombrar_tipo"          # tipo_editar
+    EJEMPLO = "ejemplo"                        # tipo_post
+    EDITAR_EJEMPLO = "editar_ejemplo"          # tipo_editar, id_ejemplo
+    BUSCAR_EJEMPLO = "buscar_ejemplo"          # tipo_editar
+    # Generación
+    TEMA_POST = "tema_post"                    # tipo_post
+    TEMAS_LOTE = "temas_lote"                  # tipo_post
+
+
+class Sesion:
+    __slots__ = (
+        "chat", "estado", "tipo_post", "tipo_editar", "id_ejemplo", "filtro_ejemplos",
+        "ultimo_post", "ultimo_tipo_post", "ultimo_tema", "ultimo_ejemplo", "usada",
+    )
+    # Lo que se guarda en SQLite, en este orden
+    CAMPOS = __slots__[1:-1]
+
+    def __init__(self, chat: int):
+        self.chat = chat
+        self.estado = Estado.NINGUNO
+        self.tipo_post = None           # tipo para el ejemplo, el post o el lote que se espera
+        self.tipo_editar = None         # tipo abierto en "Editar tipos de post"
+        self.id_ejemplo = None          # ejemplo que se está editando
+        self.filtro_ejemplos = ""       # comienzo buscado al ver los ejemplos
+        self.ultimo_post = None         # último post presentado, para aceptarlo o reescribirlo
+        self.ultimo_tipo_post = None
+        self.ultimo_tema = None
+        self.ultimo_ejemplo = None      # ID del ejemplo en que se basó
+        self.usada = time.time()
+
+    def esperar(self, estado: Estado, **datos):
+        """Pasa a esperar `estado`, que sustituye al anterior, con los datos que necesita."""
+        self.estado = estado
+        for campo, valor in datos.items():
+            setattr(self, campo, valor)
+
+    def terminar(self):
+        self.estado = Estado.NINGUNO
+
+    def olvidar_post(self):
+        self.ultimo_post = self.ultimo_tipo_post = self.ultimo_tema = self.ultimo_ejemplo = None
+
+    def valores(self) -> tuple:
+        return (self.estado.value,) + tuple(getattr(self, campo) for campo in self.CAMPOS[1:])
+
+    @classmethod
+    def desde_valores(cls, chat: int, valores, usada: float) -> "Sesion":
+        sesion = cls(chat)
+        for campo, valor in zip(cls.CAMPOS[1:], valores[1:]):
+            setattr(sesion, campo, valor)
+        sesion.estado = Estado(valores[0])
+        sesion.usada = usada
+        return sesion
+
+    def vacia(self) -> bool:
+        """Sin nada que recordar: equivale a no tener sesión y no hace falta guardarla."""
+        return self.estado is Estado.NINGUNO and self.ultimo_post is None and self.tipo_editar is None
+
+
+class GestorSesiones:
+    """
+    Sesiones por chat, como mucho `max_sesiones` en memoria y caducadas tras
+    `ttl` segundos sin uso. Quien cambia una sesión llama a `guardar()`; sin
+    ruta no se persiste nada y una sesión expulsada o caducada se pierde.
+    """
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS conversaciones (
+            chat INTEGER PRIMARY KEY,
+            datos TEXT NOT NULL,
+            usada REAL NOT NULL
+        );
+    """
+
+    def __init__(self, ruta: str = None, max_sesiones: int = 10000, ttl: float = 86400.0, intervalo_flush: float = 0.5):
+        self.ruta = ruta
+        self.max_sesiones = max_sesiones
+        self.ttl = ttl
+        self.intervalo_flush = intervalo_flush
+        self._sesiones = OrderedDict()      # chat -> Sesion, de la usada hace más tiempo a la más reciente
+        self._pendientes = {}               # chat -> Sesion con cambios por escribir
+        self._tarea_flush = None
+        self._db = None
+        if ruta:
+            self._db = sqlite3.connect(ruta, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(self.ESQUEMA)
+            self._db.execute("DELETE FROM conversaciones WHERE usada < ?", (time.time() - ttl,))
+        self.aciertos = 0
+        self.cargadas = 0
+        self.nuevas = 0
+        self.expulsadas = 0
+        self.caducadas = 0
+        self.escrituras = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._sesiones)
+
+    def obtener(self, chat: int) -> Sesion:
+        ahora = time.time()
+        self._caducar(ahora)
+        sesion = self._sesiones.get(chat)
+        if sesion is not None:
+            self._sesiones.move_to_end(chat)
+            self.aciertos += 1
+        else:
+            sesion = self._cargar(chat, ahora)
+            self._sesiones[chat] = sesion
+            self._expulsar()
+        sesion.usada = ahora
+        # También sin cambios: en SQLite tiene que constar que sigue activa,
+        # o al reiniciar se tomaría por caducada
+        self._anotar(sesion)
+        return sesion
+
+    def guardar(self, sesion: Sesion):
+        """Anota que la sesión ha cambiado; se escribe en el próximo flush."""
+        if sesion.chat not in self._sesiones:
+            # Una generación en segundo plano puede terminar con su sesión ya expulsada
+            self._sesiones[sesion.chat] = sesion
+            self._expulsar()
+        self._anotar(sesion)
+
+    def _anotar(self, sesion: Sesion):
+        if self._db is None:
+            return
+        self._pendientes[sesion.chat] = sesion
+        if self._tarea_flush is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+        else:
+            self._tarea_flush = loop.create_task(self._flush_diferido())
+
+    def flush(self):
+        """Escribe las sesiones pendientes en una transacción; las vacías se borran."""
+        if not self._pendientes:
+            return
+        pendientes, self._pendientes = list(self._pendientes.values()), {}
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.executemany(
+                "INSERT INTO conversaciones VALUES (?, ?, ?) "
+                "ON CONFLICT(chat) DO UPDATE SET datos = excluded.datos, usada = excluded.usada",
+                (
+                    (sesion.chat, json.dumps(sesion.valores(), ensure_ascii=False), sesion.usada)
+                    for sesion in pendientes if not sesion.vacia()
+                ),
+            )
+            self._db.executemany(
+                "DELETE FROM conversaciones WHERE chat = ?",
+                ((sesion.chat,) for sesion in pendientes if sesion.vacia()),
+            )
+        self.escrituras += len(pendientes)
+        self.flushes += 1
+
+    def cerrar(self):
+        if self._tarea_flush is not None:
+            self._tarea_flush.cancel()
+            self._tarea_flush = None
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    def estadisticas(self) -> dict:
+        return {
+            "en_memoria": len(self._sesiones),
+            "max_sesiones": self.max_sesiones,
+            "aciertos": self.aciertos,
+            "cargadas": self.cargadas,
+            "nuevas": self.nuevas,
+            "expulsadas": self.expulsadas,
+            "caducadas": self.caducadas,
+            "pendientes": len(self._pendientes),
+            "escrituras": self.escrituras,
+            "flushes": self.flushes,
+        }
+
+    async def _flush_diferido(self):
+        await asyncio.sleep(self.intervalo_flush)
+        self._tarea_flush = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Error al guardar las sesiones")
+
+    def _cargar(self, chat: int, ahora: float) -> Sesion:
+        # Expulsada con cambios aún sin escribir: la pendiente es la más reciente
+        sesion = self._pendientes.get(chat)
+        if sesion is not None:
+            self.aciertos += 1
+            return sesion
+        if self._db is not None:
+            fila = self._db.execute(
+                "SELECT datos, usada FROM conversaciones WHERE chat = ? AND usada >= ?", (chat, ahora - self.ttl)
+            ).fetchone()
+            if fila is not None:
+                try:
+                    sesion = Sesion.desde_valores(chat, json.loads(fila[0]), fila[1])
+                except (ValueError, TypeError, IndexError):
+                    logger.warning("Sesión del chat %s ilegible; se empieza de cero", chat)
+                else:
+                    self.cargadas += 1
+                    return sesion
+        self.nuevas += 1
+        return Sesion(chat)
+
+    def _caducar(self, ahora: float):
+        # El orden LRU también es el de inactividad: basta mirar el principio
+        limite = ahora - self.ttl
+        while self._sesiones:
+            sesion = next(iter(self._sesiones.values()))
+            if sesion.usada >= limite:
+                break
+            self._sesiones.popitem(last=False)
+            self.caducadas += 1
+
+    def _expulsar(self):
+        while len(self._sesiones) > self.max_sesiones:
+            # Si tiene cambios pendientes, el flush la escribe igualmente
+            self._sesiones.popitem(last=False)
+            self.expulsadas += 1
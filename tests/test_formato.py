@@ -0,0 +1,130 @@
+import re
+from html.parser import HTMLParser
+from types import SimpleNamespace
+
+from telegram import MessageEntity, User
+
+from formato import cerrar_html_parcial, convert_entities_to_html, mapa_utf16
+
+
+def _mensaje(text: str, *entidades) -> SimpleNamespace:
+    """Un mensaje con `text` y entidades (tipo, offset, length[, extra]) en UTF-16."""
+    lista = []
+    for tipo, offset, length, *extra in entidades:
+        lista.append(MessageEntity(tipo, offset, length, **(extra[0] if extra else {})))
+    return SimpleNamespace(text=text, entities=lista)
+
+
+def _utf16(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+class _Anidamiento(HTMLParser):
+    """Comprueba que cada cierre corresponde a la última etiqueta abierta."""
+
+    def __init__(self):
+        super().__init__()
+        self.abiertas = []
+
+    def handle_starttag(self, tag, attrs):
+        self.abiertas.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.abiertas and self.abiertas.pop() == tag, tag
+
+
+def _bien_anidado(texto: str) -> bool:
+    parser = _Anidamiento()
+    parser.feed(texto)
+    parser.close()
+    return not parser.abiertas
+
+
+def test_sin_entidades_devuelve_el_texto():
+    assert convert_entities_to_html(SimpleNamespace(text="hola", entities=())) == "hola"
+
+
+def test_entidades_simples_y_atributos():
+    mensaje = _mensaje(
+        "negrita enlace usuario",
+        ("bold", 0, 7),
+        ("text_link", 8, 6, {"url": "https://a.b/?x=1&y=\"2\""}),
+        ("text_mention", 15, 7, {"user": User(42, "Ana", False)}),
+    )
+    assert convert_entities_to_html(mensaje) == (
+        '<b>negrita</b> <a href="https://a.b/?x=1&amp;y=&quot;2&quot;">enlace</a> '
+        '<a href="tg://user?id=42">usuario</a>'
+    )
+
+
+def test_escapa_el_texto_dentro_y_fuera_de_las_entidades():
+    mensaje = _mensaje("a<b> & <i>c</i>", ("code", 0, 4))
+    assert convert_entities_to_html(mensaje) == "<code>a&lt;b&gt;</code> &amp; &lt;i&gt;c&lt;/i&gt;"
+
+
+def test_pre_con_lenguaje():
+    mensaje = _mensaje("x = 1", ("pre", 0, 5, {"language": "py<"}))
+    assert convert_entities_to_html(mensaje) == '<pre><code class="language-py&lt;">x = 1</code></pre>'
+
+
+def test_entidades_anidadas():
+    # «uno dos tres»: negrita en todo, cursiva en «dos»
+    mensaje = _mensaje("uno dos tres", ("bold", 0, 12), ("italic", 4, 3))
+    assert convert_entities_to_html(mensaje) == "<b>uno <i>dos</i> tres</b>"
+
+
+def test_misma_extension_respeta_el_orden_de_las_entidades():
+    mensaje = _mensaje("ab", ("bold", 0, 2), ("italic", 0, 2))
+    assert convert_entities_to_html(mensaje) == "<b><i>ab</i></b>"
+
+
+def test_entidades_solapadas_se_cierran_y_reabren():
+    # negrita en «abcd», cursiva en «cdef»: la cursiva se parte en la frontera
+    mensaje = _mensaje("abcdef", ("bold", 0, 4), ("italic", 2, 4))
+    resultado = convert_entities_to_html(mensaje)
+    assert resultado == "<b>ab<i>cd</i></b><i>ef</i>"
+    assert _bien_anidado(resultado)
+
+
+def test_solapamientos_encadenados_siguen_bien_anidados():
+    text = "0123456789"
+    mensaje = _mensaje(text, ("bold", 0, 5), ("italic", 2, 5), ("underline", 4, 5), ("strikethrough", 1, 8))
+    resultado = convert_entities_to_html(mensaje)
+    assert _bien_anidado(resultado)
+    # Quitando las etiquetas queda el texto original
+    assert re.sub(r"<[^>]+>", "", resultado) == text
+
+
+def test_offsets_utf16_con_caracteres_fuera_del_bmp():
+    text = "😀 hola 👍🏽 adiós"
+    inicio_hola = _utf16("😀 ")
+    inicio_adios = _utf16("😀 hola 👍🏽 ")
+    mensaje = _mensaje(
+        text,
+        ("bold", inicio_hola, 4),
+        ("italic", inicio_adios, 5),
+        ("spoiler", _utf16("😀 hola "), _utf16("👍🏽")),
+    )
+    assert convert_entities_to_html(mensaje) == (
+        "😀 <b>hola</b> <tg-spoiler>👍🏽</tg-spoiler> <i>adiós</i>"
+    )
+
+
+def test_entidad_que_cubre_un_emoji_entero():
+    mensaje = _mensaje("a😀b", ("bold", 1, 2))
+    assert convert_entities_to_html(mensaje) == "a<b>😀</b>b"
+
+
+def test_entidad_que_se_pasa_del_final_se_recorta():
+    mensaje = _mensaje("a😀", ("bold", 0, 10))
+    assert convert_entities_to_html(mensaje) == "<b>a😀</b>"
+
+
+def test_mapa_utf16():
+    assert mapa_utf16("a😀b") == [0, 1, 2, 2, 3]
+
+
+def test_cerrar_html_parcial():
+    assert cerrar_html_parcial("<b>hola <i>mun") == "<b>hola <i>mun</i></b>"
+    assert cerrar_html_parcial("texto</b> <a href=\"x") == "texto "
+    assert cerrar_html_parcial("uno &am") == "uno "
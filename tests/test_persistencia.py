@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import persistencia
+from persistencia import DiarioConfig, aplicar_operacion
+
+POR_DEFECTO = {"ejemplos": []}
+
+
+def _cambio(diario: DiarioConfig, config: dict, op: str, ruta: list, valor=None):
+    """Aplica el cambio en memoria y lo anota, como hace AlmacenJSON._guardar."""
+    operacion = {"op": op, "ruta": ruta, "valor": valor}
+    aplicar_operacion(config, operacion)
+    # Sin event loop en marcha, registrar() escribe el diario en el momento
+    diario.registrar(config, operacion)
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "config.json")
+
+
+def test_caida_entre_snapshot_y_vaciado_no_aplica_dos_veces(ruta, monkeypatch):
+    diario = DiarioConfig(ruta, fsync=False)
+    config = diario.cargar(json.loads(json.dumps(POR_DEFECTO)))
+    for texto in ("a", "b", "c"):
+        _cambio(diario, config, "append", ["ejemplos"], texto)
+
+    reemplazar = os.replace
+
+    def caer_tras_renombrar(origen, destino):
+        reemplazar(origen, destino)
+        raise OSError("caída simulada antes de vaciar el diario")
+
+    monkeypatch.setattr(persistencia.os, "replace", caer_tras_renombrar)
+    with pytest.raises(OSError):
+        asyncio.run(diario.compactar(config))
+    monkeypatch.undo()
+
+    # El snapshot nuevo ya está en su sitio y el diario conserva las mismas entradas
+    with open(ruta, encoding="utf-8") as file:
+        assert json.load(file)["ejemplos"] == ["a", "b", "c"]
+    assert os.path.getsize(ruta + ".diario") > 0
+
+    recuperado = DiarioConfig(ruta, fsync=False).cargar(json.loads(json.dumps(POR_DEFECTO)))
+    assert recuperado == {"ejemplos": ["a", "b", "c"]}
+
+
+def test_ultima_linea_a_medias_se_descarta(ruta):
+    diario = DiarioConfig(ruta, fsync=False)
+    config = diario.cargar(json.loads(json.dumps(POR_DEFECTO)))
+    _cambio(diario, config, "append", ["ejemplos"], "a")
+    _cambio(diario, config, "append", ["ejemplos"], "b")
+    tamano_bueno = os.path.getsize(ruta + ".diario")
+    with open(ruta + ".diario", "ab") as file:
+        file.write(b'{"op": "append", "ruta": ["ejemplos"], "val')
+
+    recuperado = DiarioConfig(ruta, fsync=False).cargar(json.loads(json.dumps(POR_DEFECTO)))
+    assert recuperado == {"ejemplos": ["a", "b"]}
+    # Los restos de la línea rota se quitan del fichero
+    assert os.path.getsize(ruta + ".diario") == tamano_bueno
+
+
+def test_cambio_tras_recuperar_sobrevive_al_siguiente_arranque(ruta):
+    diario = DiarioConfig(ruta, fsync=False)
+    config = diario.cargar(json.loads(json.dumps(POR_DEFECTO)))
+    _cambio(diario, config, "append", ["ejemplos"], "a")
+    with open(ruta + ".diario", "ab") as file:
+        file.write('{"op": "append", "ruta": ["ejemplos"], "valor": "perd'.encode("utf-8"))
+
+    diario = DiarioConfig(ruta, fsync=False)
+    config = diario.cargar(json.loads(json.dumps(POR_DEFECTO)))
+    _cambio(diario, config, "append", ["ejemplos"], "b")
+    _cambio(diario, config, "set", ["nombre"], "ñandú")
+
+    recuperado = DiarioConfig(ruta, fsync=False).cargar(json.loads(json.dumps(POR_DEFECTO)))
+    assert recuperado == {"ejemplos": ["a", "b"], "nombre": "ñandú"}
+
+
+def test_compactar_vacia_el_diario_y_sigue_la_secuencia(ruta):
+    diario = DiarioConfig(ruta, fsync=False)
+    config = diario.cargar(json.loads(json.dumps(POR_DEFECTO)))
+    _cambio(diario, config, "append", ["ejemplos"], "a")
+    asyncio.run(diario.compactar(config))
+    assert os.path.getsize(ruta + ".diario") == 0
+
+    diario = DiarioConfig(ruta, fsync=False)
+    config = diario.cargar(json.loads(json.dumps(POR_DEFECTO)))
+    _cambio(diario, config, "append", ["ejemplos"], "b")
+    recuperado = DiarioConfig(ruta, fsync=False).cargar(json.loads(json.dumps(POR_DEFECTO)))
+    assert recuperado == {"ejemplos": ["a", "b"]}
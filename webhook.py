@@ -0,0 +1,163 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+import time
+from collections import deque
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+_ESTADOS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large",
+}
+
+
+class ServidorWebhook:
+    """
+    Servidor HTTP mínimo sobre asyncio que recibe los updates de Telegram.
+    Comprueba el token secreto, responde 200 en cuanto el update se ha leído
+    y lo deja en la cola de la aplicación, que lo procesa como en polling.
+    Sin secreto cualquiera que conozca la URL podría inyectar updates, así que
+    solo se acepta con `sin_secreto=True` explícito.
+    """
+
+    def __init__(self, application, ruta: str = "/telegram", secreto: str = None, max_cuerpo: int = 1 << 20,
+                 sin_secreto: bool = False):
+        if not secreto and not sin_secreto:
+            raise ValueError("El webhook necesita un token secreto (WEBHOOK_SECRETO)")
+        self.application = application
+        self.ruta = ruta
+        self.secreto = secreto
+        self.max_cuerpo = max_cuerpo
+        self._servidor = None
+        self._conexiones = set()
+        self._latencias = deque(maxlen=1000)
+        self.recibidos = 0
+        self.rechazados = 0
+        self.descartados = 0
+
+    async def iniciar(self, host: str = "0.0.0.0", puerto: int = 8080) -> int:
+        self._servidor = await asyncio.start_server(self._atender, host, puerto)
+        return self._servidor.sockets[0].getsockname()[1]
+
+    async def detener(self, drenar: float = 0.0):
+        """
+        Deja de aceptar updates. Con `drenar` > 0 espera hasta ese tiempo a que
+        la cola se vacíe; lo que quede sin procesar se descarta y se cuenta.
+        Telegram ya recibió el 200 de esos updates y no los reenviará.
+        """
+        self._servidor.close()
+        for writer in list(self._conexiones):
+            writer.close()
+        await self._servidor.wait_closed()
+        cola = self.application.update_queue
+        limite = time.monotonic() + drenar
+        while not cola.empty() and time.monotonic() < limite:
+            await asyncio.sleep(0.05)
+        while not cola.empty():
+            cola.get_nowait()
+            self.descartados += 1
+        if self.descartados:
+            logger.warning("Se descartaron %d updates sin procesar al detener el webhook", self.descartados)
+
+    def estadisticas(self) -> dict:
+        latencias = sorted(self._latencias)
+        return {
+            "recibidos": self.recibidos,
+            "rechazados": self.rechazados,
+            "descartados": self.descartados,
+            "encolado_p50_ms": latencias[len(latencias) // 2] * 1000 if latencias else 0.0,
+            "encolado_p99_ms": latencias[int(len(latencias) * 0.99)] * 1000 if latencias else 0.0,
+        }
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Telegram reutiliza la conexión: se atienden peticiones hasta que se cierre
+        self._conexiones.add(writer)
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                metodo, _, resto = linea.decode("latin-1").partition(" ")
+                ruta = resto.split(" ", 1)[0].split("?", 1)[0]
+                cabeceras = {}
+                while True:
+                    cabecera = await reader.readline()
+                    if cabecera in (b"\r\n", b"\n", b""):
+                        break
+                    nombre, _, valor = cabecera.decode("latin-1").partition(":")
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+                longitud = int(cabeceras.get("content-length", 0))
+                if longitud > self.max_cuerpo:
+                    await self._responder(writer, 413)
+                    break
+                cuerpo = await reader.readexactly(longitud)
+                inicio = time.perf_counter()
+                await self._responder(writer, await self._procesar(metodo, ruta, cabeceras, cuerpo))
+                self._latencias.append(time.perf_counter() - inicio)
+                if cabeceras.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            self._conexiones.discard(writer)
+            writer.close()
+
+    async def _procesar(self, metodo: str, ruta: str, cabeceras: dict, cuerpo: bytes) -> int:
+        if ruta != self.ruta:
+            return 404
+        if metodo != "POST":
+            return 405
+        if self.secreto and not hmac.compare_digest(
+            cabeceras.get("x-telegram-bot-api-secret-token", ""), self.secreto
+        ):
+            self.rechazados += 1
+            return 403
+        try:
+            update = Update.de_json(json.loads(cuerpo), self.application.bot)
+        except (ValueError, TypeError, KeyError):
+            self.rechazados += 1
+            return 400
+        self.recibidos += 1
+        self.application.update_queue.put_nowait(update)
+        return 200
+
+    async def _responder(self, writer: asyncio.StreamWriter, estado: int):
+        writer.write(f"HTTP/1.1 {estado} {_ESTADOS[estado]}\r\nContent-Length: 0\r\n\r\n".encode())
+        await writer.drain()
+
+
+async def ejecutar_webhook(application, url: str = None, host: str = "0.0.0.0", puerto: int = 8080,
+                           ruta: str = "/telegram", secreto: str = None, drenar: float = 0.0,
+                           sin_secreto: bool = False):
+    """
+    Equivalente a `application.run_polling()` en modo webhook: arranca la
+    aplicación y el servidor, registra la URL en Telegram si se indica y
+    espera a SIGINT/SIGTERM para apagarse ordenadamente.
+    """
+    servidor = ServidorWebhook(application, ruta=ruta, secreto=secreto, sin_secreto=sin_secreto)
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for senal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(senal, parar.set)
+
+    try:
+        async with application:
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            puerto = await servidor.iniciar(host, puerto)
+            if url:
+                await application.bot.set_webhook(url, secret_token=secreto, allowed_updates=Update.ALL_TYPES)
+            logger.info("Webhook escuchando en %s:%d%s", host, puerto, ruta)
+            await parar.wait()
+            await servidor.detener(drenar)
+            await application.stop()
+    finally:
+        logger.info("Webhook: %s", servidor.estadisticas())
+        if application.post_shutdown:
+            await application.post_shutdown(application)